@@ -1,12 +1,34 @@
 # app/api/routes.py
 
+import asyncio
+import logging
+from typing import List
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect, HTTPException, Request
-from fastapi.responses import JSONResponse
-from app.services import get_geojson, generate_route, generate_route_summary
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from app.services import (
+    get_layer_payloads,
+    generate_route,
+    generate_routes,
+    generate_route_summary,
+    stream_route_summary,
+    get_route_record,
+    route_location_names,
+    get_fact_store,
+    get_feature_store,
+    summary_cache
+)
 import json
+import orjson
 from shapely.geometry import Point
 import geopandas as gpd
-from app.models.schemas import RouteRequest, RouteResponse
+from app.models.schemas import RouteRequest, RouteResponse, CompactRouteResponse, RouteAlternatives
+from app.utils.metrics import latest_metrics
+from app.utils.compression import compressed_response
+from app.services.feature_service import MAX_PAGE_SIZE, parse_bbox, check_tile
+from app.services.batch_service import BATCH_MAX_SIZE
+from app.services.route_service import MAX_ALTERNATIVES
+
+logger = logging.getLogger(__name__)
 
 # Create the main API router
 router = APIRouter()
@@ -23,44 +45,210 @@ async def list_geojson_files(request: Request):
 async def get_geojson_file(file_key: str, request: Request):
     """
     Endpoint to get a specific GeoJSON file by its key.
+    Served from bytes encoded at load/refresh time; send If-None-Match with the ETag to get a 304 when unchanged.
+    """
+    return get_layer_payloads(request).get(file_key).response(request)
+
+@router.get("/features/{file_key}")
+async def query_features(file_key: str, request: Request, bbox: str = None, offset: int = 0, limit: int = 1000):
+    """
+    Endpoint to get one page of a layer's features, optionally only those within bbox=min_lon,min_lat,max_lon,max_lat.
+    Features are in id order; pass next_offset back as offset for the next page.
+    """
+    if offset < 0 or not 0 < limit <= MAX_PAGE_SIZE:
+        raise HTTPException(status_code=422, detail=f"offset must be >= 0 and limit between 1 and {MAX_PAGE_SIZE}.")
+    feature_collection = get_feature_store(request).query(file_key, parse_bbox(bbox), offset, limit)
+    return compressed_response(request, orjson.dumps(feature_collection, option=orjson.OPT_SERIALIZE_NUMPY), media_type="application/geo+json")
+
+@router.get("/tiles/{layer}/{z}/{x}/{y}")
+async def get_tile(layer: str, z: int, x: int, y: int, request: Request):
     """
-    return get_geojson(file_key, request)
+    Endpoint to get a Mapbox Vector Tile of a layer (e.g. park or park.geojson) at an XYZ tile address.
+    """
+    check_tile(z, x, y)
+    file_key = layer if layer.endswith('.geojson') else f"{layer}.geojson"
+    feature_store = get_feature_store(request)
+    tile = feature_store.cached_tile(file_key, z, x, y)
+    if tile is None:
+        tile = await asyncio.to_thread(feature_store.render_tile, file_key, z, x, y)
+    return compressed_response(request, tile, media_type="application/vnd.mapbox-vector-tile")
+
+@router.get("/tile-cache/stats")
+async def get_tile_cache_stats(request: Request):
+    """
+    Endpoint to report the vector tile cache size and hit rate.
+    """
+    return get_feature_store(request).tile_cache.stats()
     
+@router.get("/leg-cache/stats")
+async def get_leg_cache_stats(request: Request):
+    """
+    Endpoint to report the route leg cache size and hit rate.
+    """
+    leg_cache = request.app.state.route_client.leg_cache
+    if leg_cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **leg_cache.stats()}
+
+@router.get("/summary-cache/stats")
+async def get_summary_cache_stats():
+    """
+    Endpoint to report the route summary cache size and hit rate.
+    """
+    return summary_cache.stats()
+
+@router.get("/metrics")
+async def get_metrics():
+    """
+    Endpoint to expose the stage timings, call counts and request latencies in the Prometheus text format.
+    """
+    content, content_type = latest_metrics()
+    return Response(content=content, media_type=content_type)
+
+@router.post("/layers/refresh")
+async def refresh_layers(request: Request):
+    """
+    Endpoint to pull new and changed GeoJSON layers from S3 and swap them in without a restart.
+    """
+    try:
+        changes = await request.app.state.layer_sync.refresh(request.app.state)
+    except Exception as e:
+        raise HTTPException(status_code=502, detail=f"Error syncing layers from S3: {str(e)}")
+    return changes
+
+@router.get("/layers/status")
+async def get_layer_status(request: Request):
+    """
+    Endpoint to report the loaded layers, their S3 ETags, when they were last synced and their encoded payload sizes.
+    """
+    return {**request.app.state.layer_sync.status(), "payload_bytes": get_layer_payloads(request).stats()}
+
+def parse_user_data(user_data: dict) -> dict:
+    # Kept local to this request; the generated route is stored under its route_id
+    return {
+        "user_location": user_data["user_location"],
+        "end_location": user_data["end_location"],
+        "search_radius": user_data["search_radius"],
+        "num_POIs": 5,
+        "max_route_length": user_data["max_route_length"],
+        # below are placeholder values
+        "poi_types": user_data['poi_types'],
+        "amenity": user_data['amenity'], #True
+        "barrier_free": user_data['barrier_free'], #True
+        "solver": user_data.get('solver', 'orienteering')
+    }
+
 @router.post("/generate_route")
-async def generate_route_endpoint(request: Request, user_data: dict):
+async def generate_route_endpoint(request: Request, user_data: dict, format: str = "full", alternatives: int = 1):
+    # format=compact returns polyline-encoded segments that reference route_points by index,
+    # serialized with orjson and brotli/gzip-compressed as the client accepts.
+    # alternatives=k returns up to k distinct routes, ranked by score, as {"routes": [{"rank", "score", "route"}, ...]}
+    if format not in ("full", "compact"):
+        raise HTTPException(status_code=422, detail="format must be 'full' or 'compact'.")
+    if not 1 <= alternatives <= MAX_ALTERNATIVES:
+        raise HTTPException(status_code=422, detail=f"alternatives must be between 1 and {MAX_ALTERNATIVES}.")
     try:
-        # Access the GeoJSON files and user data from app state
-        print(user_data)
-        request.app.state.user_data = {
-            "user_location": user_data["user_location"],
-            "end_location": user_data["end_location"],
-            "search_radius": user_data["search_radius"],
-            "num_POIs": 5,
-            "max_route_length": user_data["max_route_length"],
-            # below are placeholder values
-            "poi_types": user_data['poi_types'],
-            "amenity": user_data['amenity'], #True
-            "barrier_free": user_data['barrier_free'] #True
-        }
+        route_user_data = parse_user_data(user_data)
 
         # Pass necessary data to the service function
-        print(request.app.state.user_data)
-        route_response = generate_route(request, request.app.state.user_data)
+        logger.debug("Route request: %s", route_user_data)
+        route_response = await generate_route(request, route_user_data, response_format=format, alternatives=alternatives)
 
+        if format == "compact" and isinstance(route_response, (CompactRouteResponse, RouteAlternatives)):
+            return compressed_response(request, orjson.dumps(route_response.model_dump()))
         return route_response
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/generate_route/batch")
+async def generate_route_batch(request: Request, batch: List[dict], format: str = "full"):
+    """
+    Endpoint to generate several routes in one request, each taking the same fields as /generate_route.
+    Streams one JSON line per route as it finishes, {"index": ..., "route": ...} or {"index": ..., "error": ...},
+    where index is the route's position in the batch.
+    """
+    if format not in ("full", "compact"):
+        raise HTTPException(status_code=422, detail="format must be 'full' or 'compact'.")
+    if not 0 < len(batch) <= BATCH_MAX_SIZE:
+        raise HTTPException(status_code=422, detail=f"A batch must hold between 1 and {BATCH_MAX_SIZE} routes.")
+    try:
+        batch = [parse_user_data(user_data) for user_data in batch]
+    except (KeyError, TypeError) as e:
+        raise HTTPException(status_code=422, detail=f"Every route needs the /generate_route fields: missing {e}.")
+
+    async def lines():
+        async for index, route_response, error in generate_routes(request, batch, response_format=format):
+            line = {"index": index, "route": route_response.model_dump()} if route_response is not None else {"index": index, "error": error}
+            yield orjson.dumps(line) + b"\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
     
 @router.get("/generate-summary")
-async def generate_summary(request: Request):
+async def generate_summary(route_id: str, request: Request):
+    # Unknown or expired route ids are a 404 rather than a 500
+    record = await get_route_record(route_id, request)
     try:
-        # Extract location names from the request
-        print(request.app.state.route_points)
-        location_names = list(dict.fromkeys(point.name for point in request.app.state.route_points))
+        # Extract location names from the stored route points
+        location_names = route_location_names(record)
+        facts = get_fact_store(request).lookup(location_names)
 
         # Call the LLM service to generate a summary
-        summary = await generate_route_summary(location_names)
+        summary = await generate_route_summary(location_names, facts)
         return {"summary": summary}
     
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/generate-summary/stream")
+async def stream_summary(route_id: str, request: Request):
+    """
+    Endpoint to stream a route summary as Server-Sent Events while Bedrock generates it.
+    Each chunk is a JSON-encoded "data" event; the stream ends with a "done" or "error" event.
+    """
+    record = await get_route_record(route_id, request)
+    location_names = route_location_names(record)
+    facts = get_fact_store(request).lookup(location_names)
+
+    async def events():
+        try:
+            async for text in stream_route_summary(location_names, facts):
+                yield f"data: {json.dumps(text)}\n\n"
+            yield "event: done\ndata: {}\n\n"
+        except Exception as e:
+            yield f"event: error\ndata: {json.dumps(str(e))}\n\n"
+
+    # Disable proxy buffering so each chunk is flushed to the client as it arrives
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@router.websocket("/ws/generate-summary")
+async def stream_summary_ws(websocket: WebSocket):
+    """
+    WebSocket summary stream. The client sends {"route_id": ...} and receives {"type": "token", "text": ...}
+    messages followed by {"type": "done", "summary": ...}, or {"type": "error", "detail": ...}.
+    Several summaries can be requested over one connection.
+    """
+    await websocket.accept()
+    try:
+        while True:
+            message = await websocket.receive_json()
+            try:
+                record = await get_route_record(message["route_id"], websocket)
+            except (HTTPException, KeyError, TypeError):
+                await websocket.send_json({"type": "error", "detail": "Unknown or expired route_id."})
+                continue
+
+            location_names = route_location_names(record)
+            facts = get_fact_store(websocket).lookup(location_names)
+            chunks = []
+            try:
+                async for text in stream_route_summary(location_names, facts):
+                    chunks.append(text)
+                    await websocket.send_json({"type": "token", "text": text})
+            except WebSocketDisconnect:
+                raise
+            except Exception as e:
+                await websocket.send_json({"type": "error", "detail": str(e)})
+                continue
+            await websocket.send_json({"type": "done", "summary": "".join(chunks)})
+    except WebSocketDisconnect:
+        pass
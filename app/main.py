@@ -1,28 +1,71 @@
-from fastapi import FastAPI
+import logging
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from app.api import router  # Import the unified API router
-from app.services import load_all_geojson_files
+from app.services import LayerStore, LayerSync, FeatureStore, LayerPayloads, RoutePlanner, create_session_store, load_fact_store
+from app.utils.router import create_route_client, network_layer_key
+from app.utils.geocoding import ReverseGeocoder
+from app.utils.metrics import start_trace, observe_request
+import asyncio
 from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 import os
 
+logger = logging.getLogger(__name__)
+
 load_dotenv(".env.production")
 
+# DEBUG adds per-leg and per-stop detail to the logs
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper(), format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+# httpx logs every OneMap call at INFO; the counts are on /metrics instead
+if logging.getLogger().level > logging.DEBUG:
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+# Adds each request's stage timings and call counts as Server-Timing and X-Route-Events headers
+ROUTE_TIMING_HEADER = os.getenv("ROUTE_TIMING_HEADER", "false").lower() in ("1", "true", "yes")
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # This code runs before the application starts receiving requests
-    print("Loading GeoJSON files from S3...")
-    app.state.geojson_files = load_all_geojson_files()
-    print("GeoJSON files loaded into memory.")
-    app.state.user_data = {} 
+    # From the local snapshot in LAYER_SNAPSHOT_DIR where it is current, downloading only what changed from S3.
+    # With LAYER_SHARED, one worker does this and the others map the snapshot it writes
+    logger.info("Loading GeoJSON layers...")
+    network_key = network_layer_key()
+    app.state.layer_sync = LayerSync.from_env(hidden_keys=[network_key] if network_key else [])
+    app.state.layer_sync.load()
+    app.state.geojson_files = app.state.layer_sync.geojson_view()
+    logger.info("GeoJSON layers loaded into memory.")
+    # Routing backend (OneMap or the offline walking network) selected by ROUTER_BACKEND
+    app.state.route_client = create_route_client(app.state.layer_sync.frames)
+    app.state.layer_store = LayerStore.from_frames(app.state.layer_sync.layer_frames())
+    logger.info("Layer store built.")
+    # Spatial indexes for the viewport feature queries and vector tiles
+    app.state.feature_store = FeatureStore.from_frames(app.state.layer_sync.layer_frames())
+    # Layers serialized and gzip/brotli-compressed once, served with ETags by /geojson/{file_key};
+    # with LAYER_SHARED, once by the loader and mapped by every other worker
+    app.state.layer_payloads = LayerPayloads(app.state.layer_sync.layer_payloads())
+    # Short per-POI facts for summary prompts and the no-LLM fallback summary
+    app.state.fact_store = load_fact_store(app.state.layer_store)
+    # Generated routes, looked up by route_id; SESSION_BACKEND=redis shares them between workers
+    app.state.session_store = create_session_store()
+    app.state.geocoder = ReverseGeocoder.from_env(app.state.route_client)
+    # Process pool for the CPU stages of batch routes, forked on the first batch
+    app.state.route_planner = RoutePlanner.from_env()
+    # Pull changed layers from S3 in the background every LAYER_SYNC_INTERVAL seconds
+    sync_interval = float(os.getenv("LAYER_SYNC_INTERVAL", 0))
+    sync_task = asyncio.create_task(app.state.layer_sync.run_periodic(app.state, sync_interval)) if sync_interval > 0 else None
     yield
     # This code runs when the application is shutting down
-    print("Application is shutting down")
+    logger.info("Application is shutting down")
+    if sync_task is not None:
+        sync_task.cancel()
+    app.state.route_planner.shutdown()
+    await app.state.route_client.aclose()
+    await app.state.session_store.aclose()
     
     # Purge the app state
     app.state.geojson_files.clear()
-    app.state.user_data.clear()
-    print("GeoJSON files cleared from memory.")
+    logger.info("GeoJSON files cleared from memory.")
 
 # Initialize the FastAPI app with the lifespan context manager
 app = FastAPI(
@@ -40,4 +83,24 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def trace_request(request: Request, call_next):
+    # Stages and counts recorded while handling the request, including in its tasks and threads, land in this trace
+    trace = start_trace()
+    try:
+        response = await call_next(request)
+    except Exception:
+        observe_request(trace, request.method, _route_path(request), 500)
+        raise
+    observe_request(trace, request.method, _route_path(request), response.status_code)
+    if ROUTE_TIMING_HEADER and trace:
+        response.headers["Server-Timing"] = trace.server_timing()
+        response.headers["X-Route-Events"] = trace.count_header()
+    return response
+
+def _route_path(request: Request) -> str:
+    # The route template rather than the raw path, so /geojson/{file_key} is one series
+    route = request.scope.get("route")
+    return route.path if route is not None else "unmatched"
+
 app.include_router(router)
\ No newline at end of file
@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import List, Tuple, Optional
+from typing import List, Tuple, Optional, Union
 
 class UserData(BaseModel):
     user_location: List[float]
@@ -10,6 +10,7 @@ class UserData(BaseModel):
     poi_types: List[str]
     amenity: bool
     barrier_free: bool
+    solver: str = "orienteering"
 
 class RouteRequest(BaseModel):
     user_data: UserData
@@ -26,7 +27,40 @@ class RouteSegment(BaseModel):
     geometry: List[Tuple[float, float]]
 
 class RouteResponse(BaseModel):
+    route_id: Optional[str] = None
     total_distance: float
     total_time: float
     route_points: List[RoutePoint]
     route_segments: List[RouteSegment]
+
+class CompactRouteSegment(BaseModel):
+    from_index: int
+    to_index: int
+    polyline: str
+
+class CompactRouteResponse(BaseModel):
+    # Segments reference route_points by index and carry their geometry as an encoded polyline (lat, lon)
+    route_id: Optional[str] = None
+    format: str = "compact"
+    polyline_precision: int = 5
+    total_distance: float
+    total_time: float
+    route_points: List[RoutePoint]
+    route_segments: List[CompactRouteSegment]
+
+class RouteScore(BaseModel):
+    # Each criterion is between 0 and 1, higher is better; total is their weighted mean
+    total: float
+    distance_use: float
+    poi_count: float
+    diversity: float
+    barrier_free: float
+
+class RankedRoute(BaseModel):
+    rank: int
+    score: RouteScore
+    route: Union[RouteResponse, CompactRouteResponse]
+
+class RouteAlternatives(BaseModel):
+    # Best first; each route has its own route_id
+    routes: List[RankedRoute]
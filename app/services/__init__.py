@@ -3,8 +3,16 @@
 # from .geo_service import GeoDataLoader, GeoAnalyzer, RouteGenerator
 # from .llm_service import LLMService
 from .s3_service import load_all_geojson_files, fetch_geojson_from_s3, get_geojson
+from .layer_service import Layer, LayerStore, AvoidanceIndex, get_layer_store
+from .snapshot_service import build_snapshot, GeoJSONView
+from .feature_service import FeatureStore, LayerIndex, TileCache, get_feature_store
+from .session_service import MemorySessionStore, RedisSessionStore, create_session_store, get_session_store, get_route_record, route_location_names
 from .route_service import generate_route
-from .llm_service import generate_route_summary
+from .batch_service import RoutePlanner, generate_routes, get_route_planner
+from .payload_service import LayerPayload, LayerPayloads, get_layer_payloads
+from .fact_service import FactStore, load_fact_store, get_fact_store
+from .llm_service import generate_route_summary, stream_route_summary, fallback_summary, summary_cache
+from .layer_sync import LayerSync
 
 __all__ = [
     # "GeoDataLoader",
@@ -14,6 +22,35 @@ __all__ = [
     "load_all_geojson_files",
     "fetch_geojson_from_s3",
     "get_geojson",
-    "generate_route"
-    "generate_route_summary"
+    "Layer",
+    "LayerStore",
+    "AvoidanceIndex",
+    "get_layer_store",
+    "build_snapshot",
+    "GeoJSONView",
+    "FeatureStore",
+    "LayerIndex",
+    "TileCache",
+    "get_feature_store",
+    "MemorySessionStore",
+    "RedisSessionStore",
+    "create_session_store",
+    "get_session_store",
+    "get_route_record",
+    "route_location_names",
+    "generate_route",
+    "RoutePlanner",
+    "generate_routes",
+    "get_route_planner",
+    "LayerPayload",
+    "LayerPayloads",
+    "get_layer_payloads",
+    "FactStore",
+    "load_fact_store",
+    "get_fact_store",
+    "generate_route_summary",
+    "stream_route_summary",
+    "fallback_summary",
+    "summary_cache",
+    "LayerSync"
 ]
@@ -0,0 +1,192 @@
+# app/services/batch_service.py
+
+import logging
+import asyncio
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from concurrent.futures.process import BrokenProcessPool
+from fastapi import HTTPException, Request
+from app.services.layer_service import get_layer_store
+from app.services.route_service import DEFAULT_SOLVER, plan_corridor, generate_route
+from app.utils.route_generation import SharedLegs
+from app.utils.metrics import count
+
+logger = logging.getLogger(__name__)
+
+# Largest number of routes accepted in one batch request
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", 100))
+
+# Most planner processes a worker starts unless BATCH_PROCESSES says otherwise
+DEFAULT_MAX_PROCESSES = 4
+
+# Layer store of a planner worker process, inherited from the worker that forked it
+_planner_layer_store = None
+
+
+def _init_planner(layer_store):
+    global _planner_layer_store
+    _planner_layer_store = layer_store
+
+
+def _plan(user_data: dict) -> tuple:
+    try:
+        return plan_corridor(_planner_layer_store, user_data)
+    except HTTPException as e:
+        # HTTPException cannot be unpickled, which would break the pool for every other plan
+        raise ValueError(e.detail) from None
+
+
+class RoutePlanner:
+    """ Process pool running the CPU stages of batch routes (corridor search and clustering) and alternative selections in parallel.
+
+    The pool is forked from this worker, so its processes inherit the layer store and its indexes
+    copy-on-write rather than loading or receiving them. When a layer refresh swaps in a new store,
+    the next batch forks a new pool and the old one exits once its work is done. Without fork, or
+    with max_workers set to 0, the stages run in a thread instead.
+
+    Args:
+    - max_workers (int): Number of planner processes, default_planner_processes() if None
+    """
+
+    def __init__(self, max_workers: int = None):
+        self.max_workers = default_planner_processes() if max_workers is None else max_workers
+        self._executor = None
+        self._layer_store = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "RoutePlanner":
+        max_workers = os.getenv("BATCH_PROCESSES")
+        return cls(int(max_workers) if max_workers is not None else None)
+
+    def _executor_for(self, layer_store):
+        if self.max_workers <= 0 or 'fork' not in multiprocessing.get_all_start_methods():
+            return None
+        with self._lock:
+            if self._executor is None or self._layer_store is not layer_store:
+                if self._executor is not None:
+                    self._executor.shutdown(wait=False)
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context('fork'),
+                    initializer=_init_planner,
+                    initargs=(layer_store,)
+                )
+                self._layer_store = layer_store
+            return self._executor
+
+    async def submit(self, layer_store, fn, *args, local=None):
+        """ Runs fn(*args) in a planner process forked with layer_store.
+
+        fn, its arguments and its result must be picklable. Without a pool, or if it broke,
+        local(*args) runs in a thread instead, fn itself by default.
+        """
+        executor = self._executor_for(layer_store)
+        if executor is not None:
+            try:
+                return await asyncio.wrap_future(executor.submit(fn, *args))
+            except BrokenProcessPool:
+                logger.warning("Route planner pool broke, running in this process instead.")
+                with self._lock:
+                    if self._executor is executor:
+                        self._executor = None
+        return await asyncio.to_thread(local or fn, *args)
+
+    async def plan(self, layer_store, user_data: dict) -> tuple:
+        """ Runs plan_corridor for a route in a planner process.
+
+        Returns:
+        - plan (tuple): As returned by plan_corridor
+        """
+        count("batch_plan")
+        return await self.submit(layer_store, _plan, user_data, local=partial(plan_corridor, layer_store))
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+                self._layer_store = None
+
+
+def default_planner_processes() -> int:
+    """ Splits the CPUs between the web workers, given as WEB_CONCURRENCY, at most DEFAULT_MAX_PROCESSES each.
+
+    Every web worker forks its own pool, and refcounting gradually unshares the layer store pages each
+    planner process inherits, so cores times workers processes would multiply memory as well as oversubscribe the CPUs.
+    """
+    web_workers = max(int(os.getenv("WEB_CONCURRENCY", 1)), 1)
+    return max(min((os.cpu_count() or 1) // web_workers, DEFAULT_MAX_PROCESSES), 1)
+
+
+def plan_key(user_data: dict) -> tuple:
+    """ Identifies the routes whose corridor, layer set and clustering are the same, so they are planned once.
+    """
+    return (
+        tuple(sorted(user_data['poi_types'] or [])),
+        *user_data['user_location'],
+        *user_data['end_location'],
+        user_data['search_radius'],
+        user_data['num_POIs'],
+        user_data.get('solver', DEFAULT_SOLVER)
+    )
+
+
+async def generate_routes(request: Request, batch: list, response_format: str = 'full'):
+    """ Generates a batch of routes, yielding each one as soon as it is done.
+
+    Routes with the same layer set and corridor are planned once, and the plans run in parallel on
+    the route planner's processes. Each route starts routing as soon as its plan is ready, and
+    every distinct leg is fetched once for the whole batch. Legs the OneMap client already has in
+    its leg cache are not fetched at all.
+
+    Args:
+    - request (Request): FastAPI request
+    - batch (list): UserData dicts
+    - response_format (str): 'full' or 'compact', as for generate_route
+
+    Yields:
+    - index (int): Position of the route in batch
+    - route_response: RouteResponse or CompactRouteResponse, or None if the route failed
+    - error (str): Why the route failed, or None
+    """
+    layer_store = get_layer_store(request)
+    planner = get_route_planner(request)
+    route_client = SharedLegs(request.app.state.route_client)
+
+    plans = {}
+    for user_data in batch:
+        key = plan_key(user_data)
+        if key not in plans:
+            plans[key] = asyncio.ensure_future(planner.plan(layer_store, user_data))
+
+    async def run(index: int, user_data: dict):
+        try:
+            route_response = await generate_route(request, user_data, response_format, route_client=route_client, plan=asyncio.shield(plans[plan_key(user_data)]))
+        except Exception as e:
+            logger.warning("Batch route %s failed: %s", index, e)
+            return index, None, str(e)
+        # generate_route answers a tuple of Nones when no route fits the request
+        if isinstance(route_response, tuple):
+            return index, None, "Unable to find a valid route that satisfies the requirements."
+        return index, route_response, None
+
+    tasks = [asyncio.create_task(run(index, user_data)) for index, user_data in enumerate(batch)]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        # The client may disconnect before the batch is done
+        for task in [*tasks, *plans.values()]:
+            task.cancel()
+        await route_client.aclose()
+
+
+def get_route_planner(request: Request) -> RoutePlanner:
+    """
+    Get the route planner process pool created during application startup.
+    """
+    return request.app.state.route_planner
@@ -0,0 +1,125 @@
+# app/services/fact_service.py
+
+import logging
+import json
+import os
+import re
+import sys
+from fastapi import Request
+from app.services.layer_service import LayerStore
+
+logger = logging.getLogger(__name__)
+
+# Snippets are cut at a sentence boundary, or a word boundary, below this many characters
+FACT_LENGTH = 160
+
+_TAGS = re.compile(r'<[^>]+>')
+_SENTENCE_END = re.compile(r'(?<=[.!?])\s')
+
+
+def normalize_name(name) -> str:
+    """ Case- and whitespace-insensitive form of a location name, used as a lookup key.
+    """
+    return " ".join(str(name).split()).casefold()
+
+
+def make_snippet(description, max_length: int = FACT_LENGTH):
+    """ Turns a layer DESCRIPTION into a short plain-text fact, or None if there is nothing usable.
+    """
+    if not isinstance(description, str):
+        return None
+    text = " ".join(_TAGS.sub(" ", description).split())
+    if not text:
+        return None
+    first_sentence = _SENTENCE_END.split(text, maxsplit=1)[0]
+    if len(first_sentence) <= max_length:
+        return first_sentence
+    return text[:max_length].rsplit(" ", 1)[0].rstrip(",;:") + "…"
+
+
+class FactStore:
+    """ Short fact snippets per POI name, precomputed from the loaded layers.
+
+    Summary prompts and the no-LLM fallback summary are assembled from these, so a route's
+    facts are a dictionary lookup rather than part of a model generation.
+
+    Args:
+    - facts (dict): Normalized POI name to snippet
+    """
+
+    def __init__(self, facts: dict = None):
+        self.facts = facts or {}
+
+    @classmethod
+    def from_layer_store(cls, layer_store, max_length: int = FACT_LENGTH) -> "FactStore":
+        """ Batch job: builds a snippet for every named feature in every loaded layer.
+        """
+        facts = {}
+        for key in layer_store.keys():
+            gdf = layer_store.layer(key).gdf
+            if 'NAME' not in gdf.columns or 'DESCRIPTION' not in gdf.columns:
+                continue
+            for name, description in zip(gdf['NAME'].tolist(), gdf['DESCRIPTION'].tolist()):
+                if name is None:
+                    continue
+                snippet = make_snippet(description, max_length)
+                if snippet is not None:
+                    facts.setdefault(normalize_name(name), snippet)
+        return cls(facts)
+
+    @classmethod
+    def from_path(cls, path: str) -> "FactStore":
+        with open(path) as f:
+            return cls(json.load(f))
+
+    def save(self, path: str):
+        with open(path + '.tmp', 'w') as f:
+            json.dump(self.facts, f, ensure_ascii=False)
+        os.replace(path + '.tmp', path)
+
+    def lookup(self, location_names: list) -> dict:
+        """ Returns the snippet of every location that has one, keyed by the name as given.
+        """
+        found = {}
+        for name in location_names:
+            snippet = self.facts.get(normalize_name(name))
+            if snippet is not None:
+                found[name] = snippet
+        return found
+
+    def __len__(self) -> int:
+        return len(self.facts)
+
+
+def load_fact_store(layer_store) -> FactStore:
+    """ Loads the snippets precomputed at FACT_SNIPPETS_PATH, or builds them from the layer store if there are none.
+    """
+    path = os.getenv("FACT_SNIPPETS_PATH")
+    if path and os.path.exists(path):
+        try:
+            return FactStore.from_path(path)
+        except Exception as e:
+            logger.warning("Unable to read fact snippets from %s: %s", path, e)
+    return FactStore.from_layer_store(layer_store)
+
+
+def get_fact_store(request: Request) -> FactStore:
+    """
+    Get the fact snippets built during application startup.
+    """
+    return request.app.state.fact_store
+
+
+if __name__ == "__main__":
+    # Precompute the snippets from the current layers, e.g. in an image build:
+    #   python -m app.services.fact_service facts.json
+    from app.services.layer_sync import LayerSync
+
+    target_path = sys.argv[1] if len(sys.argv) > 1 else os.getenv("FACT_SNIPPETS_PATH")
+    if not target_path:
+        sys.exit("Usage: python -m app.services.fact_service <facts.json>")
+    layer_sync = LayerSync.from_env()
+    layer_sync.load()
+    fact_store = FactStore.from_layer_store(LayerStore.from_frames(layer_sync.layer_frames()))
+    fact_store.save(target_path)
+    print(f"Wrote {len(fact_store)} fact snippets to {target_path}.")
@@ -0,0 +1,264 @@
+# app/services/feature_service.py
+
+import itertools
+import math
+import os
+import threading
+from collections import OrderedDict
+import mapbox_vector_tile
+import numpy as np
+import shapely
+from fastapi import HTTPException, Request
+from geopandas import GeoDataFrame
+from pyproj import Transformer
+
+# Properties carried into vector tiles; anything else is fetched from the feature query by id
+TILE_PROPERTIES = ('NAME', 'TYPE')
+
+TILE_EXTENT = 4096
+
+# Features within this many tile units outside a tile are included, so symbols are not cut at tile edges
+TILE_BUFFER = 64
+
+# Below this zoom, point layers keep at most one point per THIN_CELL_PX x THIN_CELL_PX screen pixels of a 256px tile
+THIN_MAX_ZOOM = int(os.getenv("TILE_THIN_MAX_ZOOM", 15))
+THIN_CELL_PX = 8
+
+MAX_ZOOM = 22
+
+# Largest page a feature query returns
+MAX_PAGE_SIZE = 5000
+
+_to_mercator = Transformer.from_crs('EPSG:4326', 'EPSG:3857', always_xy=True)
+_WORLD_SIZE = 2 * 20037508.342789244
+_versions = itertools.count()
+
+
+def tile_bounds(z: int, x: int, y: int) -> tuple:
+    """ Returns the Web Mercator bounds (minx, miny, maxx, maxy) of an XYZ tile.
+    """
+    size = _WORLD_SIZE / 2 ** z
+    minx = -_WORLD_SIZE / 2 + x * size
+    maxy = _WORLD_SIZE / 2 - y * size
+    return minx, maxy - size, minx + size, maxy
+
+
+def tile_lonlat_bounds(z: int, x: int, y: int, buffer: float = 0) -> tuple:
+    """ Returns the long/lat bounds of an XYZ tile, widened by buffer (a fraction of the tile) on every side.
+    """
+    n = 2 ** z
+    lon = lambda tx: tx / n * 360 - 180
+    lat = lambda ty: math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * ty / n))))
+    return lon(x - buffer), lat(y + 1 + buffer), lon(x + 1 + buffer), lat(y - buffer)
+
+
+class LayerIndex:
+    """ One layer's features with an STRtree in long/lat, for bbox queries and vector tiles.
+
+    Args:
+    - frame (GeoDataFrame): Long/lat layer with every property column; row positions are the feature ids
+    """
+
+    def __init__(self, frame: GeoDataFrame):
+        self.frame = frame.reset_index(drop=True)
+        # Part of the tile cache key, so a tile rendered from a replaced index is never served for the new one
+        self.version = next(_versions)
+        geometries = self.frame.geometry.values
+        self.tree = shapely.STRtree(geometries)
+        self.is_point = bool(len(geometries)) and bool(np.all(shapely.get_type_id(geometries) == 0))
+        self.mercator = shapely.transform(geometries, lambda xy: np.column_stack(_to_mercator.transform(xy[:, 0], xy[:, 1])))
+        self.tile_properties = [column for column in TILE_PROPERTIES if column in self.frame.columns]
+
+    def __len__(self) -> int:
+        return len(self.frame)
+
+    def query_ids(self, bbox: tuple = None) -> np.ndarray:
+        """ Returns the ids of the features intersecting a long/lat bbox (all features without one), in id order.
+        """
+        if bbox is None:
+            return np.arange(len(self.frame))
+        predicate = None if self.is_point else 'intersects'
+        return np.sort(self.tree.query(shapely.box(*bbox), predicate=predicate))
+
+    def features(self, ids: np.ndarray) -> dict:
+        """ Returns the given features as a GeoJSON FeatureCollection, each with its id.
+        """
+        feature_collection = self.frame.iloc[ids].to_geo_dict(drop_id=True)
+        for feature, feature_id in zip(feature_collection["features"], ids.tolist()):
+            feature["id"] = feature_id
+        return feature_collection
+
+    def encode_tile(self, name: str, z: int, x: int, y: int) -> bytes:
+        """ Encodes the features in an XYZ tile as a Mapbox Vector Tile layer called name.
+
+        Point layers are thinned below THIN_MAX_ZOOM to one point per screen cell, keeping the
+        lowest id, so the same points are kept from one request to the next.
+        """
+        ids = self.query_ids(tile_lonlat_bounds(z, x, y, TILE_BUFFER / TILE_EXTENT))
+        bounds = tile_bounds(z, x, y)
+        if self.is_point and z < THIN_MAX_ZOOM and len(ids) > 1:
+            xy = shapely.get_coordinates(self.mercator[ids])
+            cell_size = (bounds[2] - bounds[0]) * THIN_CELL_PX / 256
+            cells = np.floor((xy - bounds[:2]) / cell_size).astype(np.int64)
+            _, first = np.unique(cells, axis=0, return_index=True)
+            ids = ids[np.sort(first)]
+
+        properties = self.frame[self.tile_properties].iloc[ids].to_dict('records') if self.tile_properties else [{}] * len(ids)
+        features = [
+            {
+                "id": int(feature_id),
+                "geometry": geometry,
+                "properties": {key: value for key, value in props.items() if isinstance(value, (str, int, float, bool)) and value == value}
+            }
+            for feature_id, geometry, props in zip(ids, self.mercator[ids], properties)
+        ]
+        return mapbox_vector_tile.encode(
+            [{"name": name, "features": features}],
+            default_options={"quantize_bounds": bounds, "extents": TILE_EXTENT}
+        )
+
+
+class TileCache:
+    """ LRU cache of encoded vector tiles, keyed by layer, index version and z/x/y.
+
+    Args:
+    - max_size (int): Maximum number of tiles kept
+    """
+
+    def __init__(self, max_size: int = 4096):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_env(cls) -> "TileCache":
+        return cls(max_size=int(os.getenv("TILE_CACHE_SIZE", 4096)))
+
+    def get(self, key: tuple):
+        with self._lock:
+            tile = self._entries.get(key)
+            if tile is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return tile
+
+    def put(self, key: tuple, tile: bytes):
+        with self._lock:
+            self._entries[key] = tile
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def discard_layers(self, file_keys):
+        """ Drops every cached tile of the given layers.
+        """
+        file_keys = set(file_keys)
+        with self._lock:
+            for key in [key for key in self._entries if key[0] in file_keys]:
+                del self._entries[key]
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0
+        }
+
+
+class FeatureStore:
+    """ Per-layer spatial indexes for viewport queries and vector tiles of the published layers.
+
+    Args:
+    - indexes (dict): File key to LayerIndex
+    - tile_cache (TileCache): Cache of encoded tiles shared by every layer
+    """
+
+    def __init__(self, indexes: dict, tile_cache: TileCache = None):
+        self._indexes = indexes
+        self.tile_cache = tile_cache if tile_cache is not None else TileCache.from_env()
+
+    @classmethod
+    def from_frames(cls, frames: dict) -> "FeatureStore":
+        return cls({key: LayerIndex(frame) for key, frame in frames.items()})
+
+    def updated(self, frames: dict, removed=()) -> "FeatureStore":
+        """ Returns a new store with the given layers re-indexed and removed layers dropped.
+
+        Unchanged layers share their index, and keep their cached tiles, with this store.
+        """
+        indexes = {key: index for key, index in self._indexes.items() if key not in removed and key not in frames}
+        indexes.update({key: LayerIndex(frame) for key, frame in frames.items()})
+        self.tile_cache.discard_layers([*frames, *removed])
+        return FeatureStore(indexes, self.tile_cache)
+
+    def index(self, file_key: str) -> LayerIndex:
+        if file_key not in self._indexes:
+            raise HTTPException(status_code=404, detail=f"File '{file_key}' not found.")
+        return self._indexes[file_key]
+
+    def query(self, file_key: str, bbox: tuple = None, offset: int = 0, limit: int = 1000) -> dict:
+        """ Returns one page of a layer's features, optionally only those within a bbox.
+
+        Args:
+        - file_key (str): Layer key
+        - bbox (tuple): Optional (min_lon, min_lat, max_lon, max_lat)
+        - offset (int): Number of matching features to skip, in id order
+        - limit (int): Maximum number of features returned
+
+        Returns:
+        - feature_collection (dict): GeoJSON FeatureCollection with numberMatched, numberReturned and next_offset
+        """
+        index = self.index(file_key)
+        ids = index.query_ids(bbox)
+        page = ids[offset:offset + limit]
+        feature_collection = index.features(page)
+        feature_collection["numberMatched"] = len(ids)
+        feature_collection["numberReturned"] = len(page)
+        feature_collection["next_offset"] = offset + len(page) if offset + len(page) < len(ids) else None
+        return feature_collection
+
+    def cached_tile(self, file_key: str, z: int, x: int, y: int):
+        """ Returns the cached vector tile of a layer, or None on a miss.
+        """
+        return self.tile_cache.get((file_key, self.index(file_key).version, z, x, y))
+
+    def render_tile(self, file_key: str, z: int, x: int, y: int) -> bytes:
+        """ Encodes the vector tile of a layer and adds it to the cache.
+        """
+        index = self.index(file_key)
+        tile = index.encode_tile(file_key.removesuffix('.geojson'), z, x, y)
+        self.tile_cache.put((file_key, index.version, z, x, y), tile)
+        return tile
+
+
+def parse_bbox(bbox: str):
+    """ Parses a 'min_lon,min_lat,max_lon,max_lat' query parameter, raising a 422 if it is malformed.
+    """
+    if bbox is None:
+        return None
+    try:
+        values = tuple(float(value) for value in bbox.split(','))
+    except ValueError:
+        values = ()
+    if len(values) != 4 or values[0] > values[2] or values[1] > values[3]:
+        raise HTTPException(status_code=422, detail="bbox must be min_lon,min_lat,max_lon,max_lat.")
+    return values
+
+
+def check_tile(z: int, x: int, y: int):
+    if not 0 <= z <= MAX_ZOOM or not 0 <= x < 2 ** z or not 0 <= y < 2 ** z:
+        raise HTTPException(status_code=404, detail=f"Tile {z}/{x}/{y} does not exist.")
+
+
+def get_feature_store(request: Request) -> FeatureStore:
+    """
+    Get the layer spatial indexes built during application startup.
+    """
+    return request.app.state.feature_store
@@ -0,0 +1,348 @@
+# app/services/layer_service.py
+
+import logging
+import threading
+import numpy as np
+import geopandas as gpd
+from geopandas import GeoDataFrame
+import pandas as pd
+import shapely
+from pyproj import Transformer
+from scipy.spatial import cKDTree
+from shapely import STRtree
+from shapely.geometry import LineString, Point
+from shapely.ops import unary_union
+from fastapi import HTTPException, Request
+
+logger = logging.getLogger(__name__)
+
+# All layers are held in the Singapore projected CRS so distances and buffers are in metres
+LAYER_CRS = 'EPSG:3414'
+
+# Only the attribute columns the routing pipeline and responses actually read are kept
+LAYER_COLUMNS = ['NAME', 'TYPE', 'DESCRIPTION', 'PHOTOURL']
+
+# Stairs are buffered by this many metres to form the areas barrier-free routes must avoid
+AVOIDANCE_KEY = 'stairs.geojson'
+AVOIDANCE_BUFFER = 10
+
+_to_layer_crs = Transformer.from_crs('EPSG:4326', LAYER_CRS, always_xy=True)
+_from_layer_crs = Transformer.from_crs(LAYER_CRS, 'EPSG:4326', always_xy=True)
+
+
+def to_layer_crs(geometry):
+    """ Projects a single long/lat shapely geometry (e.g. a OneMap route line) into EPSG:3414.
+    """
+    return shapely.transform(geometry, lambda coords: np.column_stack(_to_layer_crs.transform(coords[:, 0], coords[:, 1])))
+
+
+def from_layer_crs(geometry):
+    """ Projects a single EPSG:3414 shapely geometry back to long/lat.
+    """
+    return shapely.transform(geometry, lambda coords: np.column_stack(_from_layer_crs.transform(coords[:, 0], coords[:, 1])))
+
+
+def point_coords(item_gdf) -> np.ndarray:
+    """ Returns an (N, 2) array of point coordinates, using centroids for non-point geometries.
+    """
+    geometries = item_gdf.geometry.values
+    if not (shapely.get_type_id(geometries) == 0).all():
+        geometries = shapely.centroid(geometries)
+    return shapely.get_coordinates(geometries)
+
+
+def prepare_layer_gdf(layer_gdf: GeoDataFrame) -> GeoDataFrame:
+    """ Trims a long/lat layer to the columns in LAYER_COLUMNS and projects it into EPSG:3414.
+
+    Args:
+    - layer_gdf (GeoDataFrame): Layer with every property column, in EPSG:4326
+
+    Returns:
+    - layer_gdf (GeoDataFrame): Layer in EPSG:3414 with only the columns in LAYER_COLUMNS
+    """
+    columns = [column for column in LAYER_COLUMNS if column in layer_gdf.columns]
+    layer_gdf = layer_gdf[columns + ['geometry']].to_crs(LAYER_CRS)
+    return layer_gdf.reset_index(drop=True)
+
+
+def build_layer_gdf(feature_collection: dict) -> GeoDataFrame:
+    """ Converts a loaded GeoJSON FeatureCollection into a trimmed, projected GeoDataFrame.
+
+    Args:
+    - feature_collection (dict): GeoJSON FeatureCollection as loaded from S3
+
+    Returns:
+    - layer_gdf (GeoDataFrame): Layer in EPSG:3414 with only the columns in LAYER_COLUMNS
+    """
+    return prepare_layer_gdf(gpd.GeoDataFrame.from_features(feature_collection['features'], crs='EPSG:4326'))
+
+
+class Layer:
+    """ A projected layer together with a packed STRtree over its geometries and a KD-tree over its points.
+
+    Both indexes are built once when the layer is created, so corridor searches and nearest
+    lookups are index probes rather than spatial joins or distance scans. Query methods return
+    positional indices into gdf, which are also the gdf's index labels.
+    """
+
+    def __init__(self, key: str, gdf: GeoDataFrame):
+        self.key = key
+        self.gdf = gdf
+        self.tree = STRtree(gdf.geometry.values)
+        self.coords = point_coords(gdf)
+        self.kdtree = cKDTree(self.coords) if len(self.coords) else None
+
+    def __len__(self) -> int:
+        return len(self.gdf)
+
+    def query_corridor(self, polygon) -> np.ndarray:
+        """ Returns the indices of features intersecting a corridor polygon (in EPSG:3414).
+
+        Args:
+        - polygon (Polygon): Search area, e.g. the buffer from generate_search_buffer
+
+        Returns:
+        - indices (np.ndarray): Sorted positional indices into gdf
+        """
+        return np.sort(self.tree.query(polygon, predicate='intersects'))
+
+    def query_segment(self, start: Point, end: Point, radius: float) -> np.ndarray:
+        """ Returns the indices of features within radius metres of the start/end segment.
+
+        Args:
+        - start (Point): Segment start in EPSG:3414
+        - end (Point): Segment end in EPSG:3414
+        - radius (float): Search radius in metres
+
+        Returns:
+        - indices (np.ndarray): Sorted positional indices into gdf
+        """
+        segment = LineString([start, end]) if not start.equals(end) else start
+        return np.sort(self.tree.query(segment, predicate='dwithin', distance=radius))
+
+    def nearest(self, xy, k: int = 1, exclude=()) -> np.ndarray:
+        """ Returns up to k nearest features to a projected point, skipping the excluded indices.
+
+        Args:
+        - xy: Projected (x, y) coordinate
+        - k (int): Number of features to return
+        - exclude: Positional indices that must not be returned
+
+        Returns:
+        - indices (np.ndarray): Positional indices into gdf, nearest first
+        """
+        if self.kdtree is None:
+            return np.array([], dtype=np.int64)
+        exclude = set(int(idx) for idx in exclude)
+        num_queried = min(k + len(exclude), len(self.coords))
+        _, indices = self.kdtree.query(xy, k=num_queried)
+        indices = np.atleast_1d(indices)
+        return np.array([idx for idx in indices if idx not in exclude][:k], dtype=np.int64)
+
+    def nearest_along(self, start_xy, end_xy, k: int = 1, exclude=(), max_distance: float = 5000) -> np.ndarray:
+        """ Returns up to k features nearest to the segment between two projected points, skipping the excluded indices.
+
+        The search radius around the segment doubles from 100 m until enough features are found or max_distance is reached.
+        """
+        exclude = set(int(idx) for idx in exclude)
+        segment = LineString([start_xy, end_xy]) if tuple(start_xy) != tuple(end_xy) else Point(start_xy)
+        radius = 100
+        while True:
+            candidates = np.array([idx for idx in self.tree.query(segment, predicate='dwithin', distance=radius) if idx not in exclude], dtype=np.int64)
+            if len(candidates) >= k or radius >= max_distance:
+                break
+            radius *= 2
+        distances = shapely.distance(self.gdf.geometry.values[candidates], segment)
+        return candidates[np.argsort(distances, kind='stable')][:k]
+
+    def take(self, indices: np.ndarray) -> GeoDataFrame:
+        """ Materialises the given positional indices as a new GeoDataFrame.
+        """
+        return self.gdf.iloc[indices].copy()
+
+
+class AvoidanceIndex:
+    """ Buffered and unioned avoidance areas, split into parts and held as prepared geometries.
+
+    Built once from the stairs layer. Each connected part of the union is indexed in an STRtree,
+    so a leg check only runs prepared intersection tests against the parts whose bounding
+    boxes the leg hits.
+    """
+
+    def __init__(self, parts: np.ndarray):
+        self.parts = parts
+        shapely.prepare(self.parts)
+        self.tree = STRtree(self.parts)
+
+    @classmethod
+    def from_layer(cls, layer: Layer, buffer_distance: float = AVOIDANCE_BUFFER) -> "AvoidanceIndex":
+        buffers = shapely.buffer(layer.gdf.geometry.values, buffer_distance, quad_segs=16)
+        unified_geometry = unary_union(buffers)
+        parts = shapely.get_parts(unified_geometry) if not unified_geometry.is_empty else np.array([], dtype=object)
+        return cls(parts)
+
+    def __len__(self) -> int:
+        return len(self.parts)
+
+    def intersects_projected(self, geometry) -> bool:
+        """ Checks an EPSG:3414 geometry against the avoidance areas.
+        """
+        if len(self.parts) == 0:
+            return False
+        candidate_idx = self.tree.query(geometry)
+        return bool(shapely.intersects(self.parts[candidate_idx], geometry).any())
+
+    def intersects(self, route_geometry) -> bool:
+        """ Checks whether a long/lat route geometry passes through any avoidance area.
+
+        Args:
+        - route_geometry (LineString): Route leg in long/lat, as returned by the OneMap API
+
+        Returns:
+        - intersects (bool): True if the leg crosses a buffered stair
+        """
+        return self.intersects_projected(to_layer_crs(route_geometry))
+
+
+class LayerStore:
+    """ Holds every loaded layer as a projected, spatially indexed Layer, built once at startup.
+
+    Multi-layer combinations (e.g. park+museum) are concatenated and indexed on first use and cached.
+    Frames are handed out as shallow copies: callers may add columns freely, but must not
+    modify existing values in place since the underlying data is shared between requests.
+    """
+
+    def __init__(self, layers: dict, previous: "LayerStore" = None):
+        self._layers = {}
+        for key, gdf in layers.items():
+            # Layers carried over unchanged from a previous store keep their already built indexes
+            existing = previous._layers.get(key) if previous is not None else None
+            self._layers[key] = existing if existing is not None and existing.gdf is gdf else Layer(key, gdf)
+        self._combined = {}
+        self._lock = threading.Lock()
+        if AVOIDANCE_KEY not in self._layers:
+            self.avoidance = None
+        elif previous is not None and previous._layers.get(AVOIDANCE_KEY) is self._layers[AVOIDANCE_KEY]:
+            self.avoidance = previous.avoidance
+        else:
+            self.avoidance = AvoidanceIndex.from_layer(self._layers[AVOIDANCE_KEY])
+
+    @classmethod
+    def from_geojson(cls, geojson_files: dict) -> "LayerStore":
+        """ Builds the store from the raw GeoJSON dicts returned by load_all_geojson_files.
+        """
+        layers = {}
+        for key, feature_collection in geojson_files.items():
+            try:
+                layers[key] = build_layer_gdf(feature_collection)
+            except Exception as e:
+                logger.warning("Unable to build layer %s: %s", key, e)
+        return cls(layers)
+
+    @classmethod
+    def from_frames(cls, frames: dict) -> "LayerStore":
+        """ Builds the store from full long/lat GeoDataFrames, e.g. those read from a layer snapshot.
+        """
+        layers = {}
+        for key, frame in frames.items():
+            try:
+                layers[key] = prepare_layer_gdf(frame)
+            except Exception as e:
+                logger.warning("Unable to build layer %s: %s", key, e)
+        return cls(layers)
+
+    def updated(self, frames: dict, removed=()) -> "LayerStore":
+        """ Returns a new store with the given layers rebuilt and the removed ones dropped.
+
+        Unchanged layers share their GeoDataFrames and indexes with this store, so a refresh only
+        pays for the layers that actually changed. This store is left untouched for requests still using it.
+
+        Args:
+        - frames (dict): File key to full long/lat GeoDataFrame for every added or changed layer
+        - removed (iterable): File keys of layers that no longer exist
+
+        Returns:
+        - layer_store (LayerStore): The updated store
+        """
+        layers = {key: layer.gdf for key, layer in self._layers.items() if key not in removed}
+        for key, frame in frames.items():
+            try:
+                layers[key] = prepare_layer_gdf(frame)
+            except Exception as e:
+                logger.warning("Unable to build layer %s: %s", key, e)
+        return LayerStore(layers, previous=self)
+
+    def keys(self) -> list:
+        return list(self._layers.keys())
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._layers
+
+    def layer(self, key: str) -> Layer:
+        """ Returns a single indexed layer by its file key.
+        """
+        if key not in self._layers:
+            raise HTTPException(status_code=404, detail=f"Layer '{key}' not found.")
+        return self._layers[key]
+
+    def get(self, key: str) -> GeoDataFrame:
+        """ Returns a single layer's GeoDataFrame by its file key.
+        """
+        return self.layer(key).gdf.copy(deep=False)
+
+    def combined(self, file_keys: list) -> Layer:
+        """ Returns the indexed concatenation of the given layers, cached by the set of keys.
+
+        Args:
+        - file_keys (list): List of layer keys, e.g. ['park.geojson', 'museum.geojson']
+
+        Returns:
+        - combined_layer (Layer): A combined, indexed layer of the requested keys
+        """
+        found_keys = []
+        for key in dict.fromkeys(file_keys):
+            if key in self._layers:
+                found_keys.append(key)
+            else:
+                logger.warning("%s not found in memory.", key)
+
+        if not found_keys:
+            raise HTTPException(status_code=404, detail=f"None of the layers {list(file_keys)} are loaded.")
+
+        if len(found_keys) == 1:
+            return self._layers[found_keys[0]]
+
+        combination_key = '+'.join(sorted(found_keys))
+        combined_layer = self._combined.get(combination_key)
+        if combined_layer is None:
+            with self._lock:
+                combined_layer = self._combined.get(combination_key)
+                if combined_layer is None:
+                    gdfs = [self._layers[key].gdf for key in sorted(found_keys)]
+                    combined_gdf = gpd.GeoDataFrame(pd.concat(gdfs, ignore_index=True), geometry='geometry', crs=LAYER_CRS)
+                    combined_layer = Layer(combination_key, combined_gdf)
+                    self._combined[combination_key] = combined_layer
+
+        return combined_layer
+
+    def nearest_name(self, point, max_distance: float = 150):
+        """ Returns the name of the nearest loaded POI to a long/lat point, or None if none is within max_distance metres.
+
+        Avoidance features such as stairs are skipped, since their names are not meaningful places.
+        """
+        projected_point = to_layer_crs(point)
+        nearest = None
+        for key, layer in self._layers.items():
+            if key == AVOIDANCE_KEY or len(layer) == 0 or 'NAME' not in layer.gdf.columns:
+                continue
+            tree_idx, distances = layer.tree.query_nearest(projected_point, max_distance=max_distance, return_distance=True)
+            if len(tree_idx) and (nearest is None or distances[0] < nearest[0]):
+                nearest = (distances[0], layer.gdf['NAME'].iloc[tree_idx[0]])
+        return nearest[1] if nearest is not None else None
+
+
+def get_layer_store(request: Request) -> LayerStore:
+    """
+    Get the layer store built during application startup.
+    """
+    return request.app.state.layer_store
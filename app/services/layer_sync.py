@@ -0,0 +1,319 @@
+# app/services/layer_sync.py
+
+import logging
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from app.services import s3_service
+from app.services.s3_service import list_geojson_etags, fetch_object_bytes
+from app.services.fact_service import FactStore
+from app.services.payload_service import LayerPayload
+from app.services.snapshot_service import GeoJSONView, features_to_gdf, read_manifest, build_snapshot, load_snapshot, lock_file, LOADER_LOCK, STARTUP_LOCK
+from app.utils.clustering import cluster_engine
+
+logger = logging.getLogger(__name__)
+
+
+class LayerSync:
+    """ Keeps the GeoJSON layers in step with the S3 bucket, downloading only layers whose ETag changed.
+
+    The bucket listing is paginated and downloads run on a bounded thread pool. With a snapshot
+    directory, layers are also kept in the local Arrow snapshot, so a restart only downloads what
+    changed since the snapshot was written. The S3 client is injected, so the sync can run
+    against a local stand-in such as moto.
+
+    With shared set, worker processes share the snapshot directory. The first to start becomes
+    the loader: it alone syncs with S3, and it writes the encoded layer payloads next to the
+    layers. The other workers attach to the snapshot: they memory-map its layers and payloads,
+    and each sync only picks up what the loader last wrote. If the loader exits, the next worker
+    to sync takes its place.
+
+    Args:
+    - s3_client: boto3 S3 client
+    - bucket_name (str): Bucket holding the .geojson layers
+    - snapshot_dir (str): Optional local snapshot directory
+    - max_workers (int): Maximum parallel downloads
+    - hidden_keys (iterable): Layers that are loaded but not published as POI layers, e.g. the walking network
+    - shared (bool): Share the snapshot directory with other worker processes
+    """
+
+    def __init__(self, s3_client, bucket_name: str, snapshot_dir: str = None, max_workers: int = 8, hidden_keys=(), shared: bool = False):
+        self.s3_client = s3_client
+        self.bucket_name = bucket_name
+        self.snapshot_dir = snapshot_dir
+        self.max_workers = max_workers
+        self.hidden_keys = set(hidden_keys)
+        if shared and not snapshot_dir:
+            logger.warning("LAYER_SHARED needs LAYER_SNAPSHOT_DIR; every worker will load the layers itself.")
+            shared = False
+        self.shared = shared
+        self.role = "standalone"
+        self.frames = {}
+        self.etags = {}
+        self.manifest = None
+        self.last_sync = None
+        self._loader_lock = None
+        self._lock = threading.Lock()
+        self._refresh_lock = asyncio.Lock()
+
+    @classmethod
+    def from_env(cls, hidden_keys=()) -> "LayerSync":
+        return cls(
+            s3_service.s3_client,
+            s3_service.bucket_name,
+            snapshot_dir=os.getenv("LAYER_SNAPSHOT_DIR"),
+            max_workers=int(os.getenv("LAYER_SYNC_WORKERS", 8)),
+            hidden_keys=hidden_keys,
+            shared=os.getenv("LAYER_SHARED", "false").lower() in ("1", "true", "yes")
+        )
+
+    def layer_frames(self) -> dict:
+        """ Returns the published layers as long/lat GeoDataFrames, for building the layer store.
+        """
+        return {key: frame for key, frame in self.frames.items() if key not in self.hidden_keys}
+
+    def geojson_view(self) -> GeoJSONView:
+        """ Returns the published layers as a mapping of GeoJSON FeatureCollections, for the GeoJSON endpoints.
+        """
+        return GeoJSONView(self.layer_frames())
+
+    def layer_payloads(self, keys=None) -> dict:
+        """ Returns the encoded payloads of the given published layers (every one by default).
+
+        Payloads the loader wrote to a shared snapshot are mapped from it; any other layer is encoded here.
+
+        Returns:
+        - payloads (dict): File key to LayerPayload
+        """
+        keys = self.layer_frames().keys() if keys is None else keys
+        manifest_layers = self.manifest["layers"] if self.shared and self.manifest else {}
+        payloads = {}
+        for key in keys:
+            entry = manifest_layers.get(key, {}).get("payload")
+            if entry is not None:
+                try:
+                    payloads[key] = LayerPayload.from_files(os.path.join(self.snapshot_dir, entry["file"]), entry["etags"])
+                    continue
+                except (OSError, KeyError, ValueError) as e:
+                    logger.warning("Unable to map the payload of %s, encoding it here: %s", key, e)
+            payloads[key] = LayerPayload.from_frame(self.frames[key])
+        return payloads
+
+    def fetch_frame(self, file_key: str):
+        return features_to_gdf(json.loads(fetch_object_bytes(file_key, self.s3_client, self.bucket_name)))
+
+    def download(self, file_keys: list):
+        """ Downloads and parses the given layers in parallel.
+
+        Returns:
+        - frames (dict): File key to GeoDataFrame for every layer that downloaded
+        - failed (dict): File key to error message for every layer that did not
+        """
+        frames, failed = {}, {}
+        if not file_keys:
+            return frames, failed
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {executor.submit(self.fetch_frame, file_key): file_key for file_key in file_keys}
+            for future in as_completed(futures):
+                file_key = futures[future]
+                try:
+                    frames[file_key] = future.result()
+                except Exception as e:
+                    failed[file_key] = str(e)
+                    logger.error("Error loading %s from S3: %s", file_key, e)
+        return frames, failed
+
+    def load(self) -> dict:
+        """ Initial load: reads every layer the snapshot holds, then syncs the rest from S3.
+
+        If the bucket cannot be listed, the snapshot is used as is. In shared mode, only the loader
+        does this; other workers wait until it is done, then attach to the snapshot it wrote.
+
+        Returns:
+        - changes (dict): As returned by sync
+        """
+        if self.shared:
+            with lock_file(self.snapshot_dir, STARTUP_LOCK, blocking=True):
+                if self._take_lead():
+                    return self._load()
+            self.role = "attached"
+            try:
+                return self.attach()
+            except Exception as e:
+                logger.error("Unable to attach to the layer snapshot in %s: %s", self.snapshot_dir, e)
+                return {"added": [], "updated": [], "removed": [], "failed": {}}
+        return self._load()
+
+    def _load(self) -> dict:
+        manifest = read_manifest(self.snapshot_dir) if self.snapshot_dir else None
+        if manifest is not None:
+            try:
+                frames = load_snapshot(self.snapshot_dir, manifest)
+                with self._lock:
+                    self.frames = frames
+                    self.etags = {key: layer["etag"] for key, layer in manifest["layers"].items()}
+                    self.manifest = manifest
+                logger.info("Loaded %s layers from snapshot %s.", len(frames), self.snapshot_dir)
+            except Exception as e:
+                logger.warning("Unable to read layer snapshot, loading from S3: %s", e)
+
+        try:
+            return self.sync()
+        except Exception as e:
+            logger.error("Error syncing layers from S3, serving %s layers from the snapshot: %s", len(self.frames), e)
+            return {"added": [], "updated": [], "removed": [], "failed": {}}
+
+    def _take_lead(self) -> bool:
+        """ Becomes the loader of the shared snapshot if no other live process is.
+        """
+        if self._loader_lock is None:
+            self._loader_lock = lock_file(self.snapshot_dir, LOADER_LOCK)
+            if self._loader_lock is not None:
+                self.role = "loader"
+                logger.info("Process %s is the layer loader for %s.", os.getpid(), self.snapshot_dir)
+        return self._loader_lock is not None
+
+    def attach(self) -> dict:
+        """ Brings the loaded layers up to date with the shared snapshot, mapping only new or changed layers.
+
+        Returns:
+        - changes (dict): As returned by sync
+        """
+        with self._lock:
+            manifest = read_manifest(self.snapshot_dir)
+            if manifest is None:
+                raise RuntimeError(f"No layer snapshot in {self.snapshot_dir}.")
+            manifest_etags = {key: layer["etag"] for key, layer in manifest["layers"].items()}
+            changed = [key for key, etag in manifest_etags.items() if self.etags.get(key) != etag]
+            removed = [key for key in self.etags if key not in manifest_etags]
+            frames = load_snapshot(self.snapshot_dir, manifest, changed)
+
+            changes = {
+                "added": [key for key in frames if key not in self.etags],
+                "updated": [key for key in frames if key in self.etags],
+                "removed": removed,
+                "failed": {}
+            }
+            self.frames = {**{key: frame for key, frame in self.frames.items() if key not in removed}, **frames}
+            self.etags = manifest_etags
+            self.manifest = manifest
+            self.last_sync = time.time()
+        return changes
+
+    def sync(self) -> dict:
+        """ Brings the loaded layers up to date with the bucket, downloading only new or changed layers.
+
+        A layer that fails to download keeps its previous version and is retried on the next sync.
+        Workers attached to a shared snapshot read it instead, unless the loader has gone and they take its place.
+
+        Returns:
+        - changes (dict): File keys that were added, updated and removed, and the errors of those that failed
+        """
+        if self.role == "attached" and not self._take_lead():
+            return self.attach()
+        with self._lock:
+            remote_etags = list_geojson_etags(self.s3_client, self.bucket_name)
+            changed = [key for key, etag in remote_etags.items() if self.etags.get(key) != etag]
+            removed = [key for key in self.etags if key not in remote_etags]
+            frames, failed = self.download(changed)
+
+            changes = {
+                "added": [key for key in frames if key not in self.etags],
+                "updated": [key for key in frames if key in self.etags],
+                "removed": removed,
+                "failed": failed
+            }
+            # Build new dicts rather than mutating, so readers of the previous ones are unaffected
+            self.frames = {**{key: frame for key, frame in self.frames.items() if key not in removed}, **frames}
+            self.etags = {**{key: etag for key, etag in self.etags.items() if key not in removed}, **{key: remote_etags[key] for key in frames}}
+            self.last_sync = time.time()
+
+            # The loader encodes payloads for every worker, including any the snapshot lacks
+            payloads = {}
+            if self.shared:
+                manifest_layers = self.manifest["layers"] if self.manifest else {}
+                payloads = {
+                    key: LayerPayload.from_frame(frame) for key, frame in self.layer_frames().items()
+                    if key in frames or not manifest_layers.get(key, {}).get("payload")
+                }
+
+            if self.snapshot_dir and (frames or removed or payloads):
+                try:
+                    self.manifest = build_snapshot(self.snapshot_dir, self.frames, self.etags, changed_keys=frames.keys(), payloads=payloads)
+                    if self.shared and frames:
+                        # Serve the mapped copies, as the attached workers do
+                        self.frames = {**self.frames, **load_snapshot(self.snapshot_dir, self.manifest, frames.keys())}
+                except Exception as e:
+                    logger.warning("Unable to write layer snapshot: %s", e)
+        return changes
+
+    async def refresh(self, state) -> dict:
+        """ Syncs with the bucket and swaps the updated layers into the application state.
+
+        The download, parsing, index builds and payload encoding run in worker threads. The new layer
+        store, feature indexes, encoded payloads, GeoJSON mapping and fact snippets are then swapped
+        into state in one step each, so requests already in flight keep the objects they started with
+        and new requests see the new ones.
+
+        Args:
+        - state: The FastAPI app.state holding layer_store, feature_store, layer_payloads, geojson_files and fact_store
+
+        Returns:
+        - changes (dict): As returned by sync
+        """
+        async with self._refresh_lock:
+            changes = await asyncio.to_thread(self.sync)
+            changed_keys = [key for key in changes["added"] + changes["updated"] if key not in self.hidden_keys]
+            removed_keys = [key for key in changes["removed"] if key not in self.hidden_keys]
+            if changed_keys or removed_keys:
+                layer_store = await asyncio.to_thread(
+                    state.layer_store.updated, {key: self.frames[key] for key in changed_keys}, removed_keys
+                )
+                feature_store = await asyncio.to_thread(
+                    state.feature_store.updated, {key: self.frames[key] for key in changed_keys}, removed_keys
+                )
+                payloads = await asyncio.to_thread(self.layer_payloads, changed_keys)
+                layer_payloads = state.layer_payloads.updated(payloads, removed_keys)
+                fact_store = await asyncio.to_thread(FactStore.from_layer_store, layer_store)
+                state.layer_store = layer_store
+                state.feature_store = feature_store
+                state.layer_payloads = layer_payloads
+                state.geojson_files = self.geojson_view()
+                state.fact_store = fact_store
+                cluster_engine.clear()
+                logger.info("Layers refreshed: %s changed, %s removed.", len(changed_keys), len(removed_keys))
+            return changes
+
+    async def run_periodic(self, state, interval: float):
+        """ Refreshes the layers every interval seconds until cancelled.
+        """
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.refresh(state)
+            except Exception as e:
+                logger.warning("Periodic layer refresh failed: %s", e)
+
+    def status(self) -> dict:
+        return {
+            "layers": len(self.frames),
+            "etags": dict(self.etags),
+            "last_sync": self.last_sync,
+            "snapshot_dir": self.snapshot_dir,
+            "role": self.role
+        }
+
+
+if __name__ == "__main__":
+    # Build or update the snapshot ahead of time, e.g. in an image build or an init container:
+    #   python -m app.services.layer_sync /var/cache/layers
+    target_dir = sys.argv[1] if len(sys.argv) > 1 else os.getenv("LAYER_SNAPSHOT_DIR")
+    if not target_dir:
+        sys.exit("Usage: python -m app.services.layer_sync <snapshot_dir>")
+    layer_sync = LayerSync(s3_service.s3_client, s3_service.bucket_name, snapshot_dir=target_dir)
+    changes = layer_sync.load()
+    print(f"Snapshot in {target_dir} holds {len(layer_sync.frames)} layers: {changes}")
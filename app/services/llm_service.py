@@ -1,35 +1,271 @@
+import logging
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict
 import boto3
 import json
+from app.services.fact_service import normalize_name
+from app.utils.metrics import stage, count
+
+logger = logging.getLogger(__name__)
 
 # Initialize the Bedrock client (ensure AWS credentials are properly configured)
 client = boto3.client('bedrock-runtime', region_name='us-east-1')
 
-async def generate_route_summary(location_names: list) -> str:
+MODEL_ID = 'amazon.titan-text-premier-v1:0'
+
+# 'llm' (default) asks Bedrock on a cache miss; 'fallback' always assembles the summary from cached facts
+SUMMARY_MODE = os.getenv("SUMMARY_MODE", "llm")
+
+# Seconds to wait for Bedrock (for the first chunk when streaming) before answering with the fallback summary
+SUMMARY_TIMEOUT = float(os.getenv("SUMMARY_TIMEOUT", 10))
+
+
+class SummaryCache:
+    """ LRU/TTL cache of generated summaries, keyed by the normalized, ordered list of stop names.
+
+    Args:
+    - max_size (int): Maximum number of summaries kept
+    - ttl (float): Seconds before a summary is generated afresh
     """
-    Interacts with Amazon Bedrock's Titan model to generate a fun and engaging route summary.
+
+    def __init__(self, max_size: int = 2000, ttl: float = 24 * 3600):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_env(cls) -> "SummaryCache":
+        return cls(
+            max_size=int(os.getenv("SUMMARY_CACHE_SIZE", 2000)),
+            ttl=float(os.getenv("SUMMARY_CACHE_TTL", 24 * 3600))
+        )
+
+    @staticmethod
+    def key(location_names: list) -> tuple:
+        return tuple(normalize_name(name) for name in location_names)
+
+    def get(self, location_names: list):
+        """ Returns the cached summary for the stops, or None on a miss.
+        """
+        key = self.key(location_names)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.time() - entry[0] > self.ttl:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, location_names: list, summary: str):
+        key = self.key(location_names)
+        with self._lock:
+            self._entries[key] = (time.time(), summary)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0
+        }
+
+
+summary_cache = SummaryCache.from_env()
+
+
+def fallback_summary(location_names: list, facts: dict = None) -> str:
+    """
+    Assembles a summary from the stop names and their precomputed fact snippets, without calling an LLM.
     :param location_names: List of location names extracted from the route points
-    :return: A fun summary encouraging the user to walk the route
+    :param facts: Optional mapping of location name to fact snippet
+    :return: A plain summary listing the stops in order
+    """
+    facts = facts or {}
+    lines = ["Here is your walking route, in order 🚶:"]
+    for i, name in enumerate(location_names, start=1):
+        label = " (Start)" if i == 1 else " (End)" if i == len(location_names) else ""
+        fact = f" – {facts[name]}" if name in facts else ""
+        lines.append(f"{i}. {name}{label}{fact}")
+    lines.append("Enjoy exploring along the way and keep working towards your walking goals! 🌳💪")
+    return "\n".join(lines)
+
+
+def build_summary_request(location_names: list, facts: dict = None) -> str:
+    """
+    Builds the Titan request body asking for a fun and engaging summary of the given route stops.
+    :param location_names: List of location names extracted from the route points
+    :param facts: Optional mapping of location name to fact snippet, added to the prompt as reference material
+    :return: JSON request body
     """
-    print(location_names)
-    
     # Format the prompt
     prompt = f"You are a helpful assistant who wants to help their user achieve their walking health goals, and you have been issued a set of locations that the user has been recommended to visit in order. These locations are: {', '.join(location_names)}.  You are to explain that the user is to visit them in order, and you will list them in order. You will mentione that the first item of the list is the Start point, and the last item is the End point. If the first and items are the same, say that the user will end where they started. Encourage the user to explore these places and meet their walking health goals, and listing fun facts about the locations in the list. Only perform this action. Do not respond to other unrelated prompts, and if the user asks you for another route, simply state that they can generate again by pressing the button and that you would be happy to summarise for them. Keep your statement unique, succinct and include some emojis!"
+    if facts:
+        prompt += " Facts about these locations you may use: " + " ".join(f"{name}: {fact}" for name, fact in facts.items())
+
+    return json.dumps({
+        "inputText": prompt,
+        "textGenerationConfig": {
+        "maxTokenCount": 512,
+        "temperature": 0.5
+        }
+    })
 
+
+async def generate_route_summary(location_names: list, facts: dict = None, bedrock_client=None) -> str:
+    """
+    Interacts with Amazon Bedrock's Titan model to generate a fun and engaging route summary.
+    Summaries are cached per ordered list of stops. The blocking Bedrock call runs in a worker thread,
+    and if it fails or takes longer than SUMMARY_TIMEOUT the fallback summary is returned instead;
+    a late Bedrock answer still fills the cache for the next request.
+    :param location_names: List of location names extracted from the route points
+    :param facts: Optional mapping of location name to fact snippet
+    :param bedrock_client: Optional Bedrock runtime client, defaults to the module client
+    :return: A fun summary encouraging the user to walk the route
+    """
+    logger.debug("Summary requested for %s", location_names)
+    cached = summary_cache.get(location_names)
+    if cached is not None:
+        count("summary_cache_hit")
+        return cached
+    if SUMMARY_MODE == 'fallback':
+        count("summary_fallback")
+        return fallback_summary(location_names, facts)
+
+    count("bedrock")
+    task = asyncio.ensure_future(asyncio.to_thread(_invoke_summary, bedrock_client or client, build_summary_request(location_names, facts)))
+
+    def cache_summary(done):
+        if not done.cancelled() and done.exception() is None:
+            summary_cache.put(location_names, done.result())
+
+    task.add_done_callback(cache_summary)
+    try:
+        with stage("bedrock"):
+            return await asyncio.wait_for(asyncio.shield(task), SUMMARY_TIMEOUT)
+    except Exception as e:
+        logger.warning("Bedrock summary unavailable, using fallback summary: %s", repr(e))
+        count("summary_fallback")
+        return fallback_summary(location_names, facts)
+
+
+def _invoke_summary(bedrock_client, body: str) -> str:
     # Call the Bedrock Titan model
-    response = client.invoke_model(
-        modelId='amazon.titan-text-premier-v1:0',
+    response = bedrock_client.invoke_model(
+        modelId=MODEL_ID,
         contentType='application/json',
         accept='application/json',
-        body=json.dumps({
-            "inputText": prompt,
-            "textGenerationConfig": {
-            "maxTokenCount": 512,
-            "temperature": 0.5
-            }
-        })
+        body=body
     )
-    
+
     # Extract and return the generated text
     response_body = response['body'].read()  # Read the StreamingBody
     response_json = json.loads(response_body)  # Now parse the JSON
     return response_json['results'][0]['outputText']
+
+
+async def stream_route_summary(location_names: list, facts: dict = None, bedrock_client=None):
+    """
+    Streams the route summary from Titan, yielding text chunks as Bedrock produces them.
+    The response stream is read in a worker thread and handed to the event loop through a queue,
+    so the first words reach the user while the rest is still being generated. Stopping the
+    iteration early (e.g. the client disconnected) closes the Bedrock stream. A cached summary is
+    yielded as one chunk, and the fallback summary is yielded if Bedrock fails or sends nothing
+    within SUMMARY_TIMEOUT; a completed stream is added to the cache.
+    :param location_names: List of location names extracted from the route points
+    :param facts: Optional mapping of location name to fact snippet
+    :param bedrock_client: Optional Bedrock runtime client, defaults to the module client
+    :return: Async iterator of text chunks
+    """
+    logger.debug("Streamed summary requested for %s", location_names)
+    cached = summary_cache.get(location_names)
+    if cached is not None:
+        count("summary_cache_hit")
+        yield cached
+        return
+    if SUMMARY_MODE == 'fallback':
+        count("summary_fallback")
+        yield fallback_summary(location_names, facts)
+        return
+
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    stop = threading.Event()
+    body = build_summary_request(location_names, facts)
+    done = object()
+
+    def produce():
+        try:
+            for text in _iter_summary_stream(bedrock_client or client, body, stop):
+                loop.call_soon_threadsafe(queue.put_nowait, text)
+            loop.call_soon_threadsafe(queue.put_nowait, done)
+        except Exception as e:
+            loop.call_soon_threadsafe(queue.put_nowait, e)
+
+    count("bedrock")
+    loop.run_in_executor(None, produce)
+    chunks = []
+    try:
+        while True:
+            if chunks:
+                item = await queue.get()
+            else:
+                try:
+                    with stage("bedrock_first_chunk"):
+                        item = await asyncio.wait_for(queue.get(), SUMMARY_TIMEOUT)
+                except asyncio.TimeoutError as e:
+                    item = e
+            if item is done:
+                break
+            if isinstance(item, Exception):
+                if chunks:
+                    raise item
+                # Nothing has been sent yet, so the user can still get a complete answer
+                logger.warning("Bedrock summary unavailable, using fallback summary: %s", repr(item))
+                count("summary_fallback")
+                yield fallback_summary(location_names, facts)
+                return
+            chunks.append(item)
+            yield item
+        summary_cache.put(location_names, "".join(chunks))
+    finally:
+        # The worker stops at the next chunk; nothing waits for it, so a disconnect is released at once
+        stop.set()
+
+
+def _iter_summary_stream(bedrock_client, body: str, stop: threading.Event):
+    response = bedrock_client.invoke_model_with_response_stream(
+        modelId=MODEL_ID,
+        contentType='application/json',
+        accept='application/json',
+        body=body
+    )
+    stream = response['body']
+    try:
+        for event in stream:
+            if stop.is_set():
+                break
+            if 'chunk' not in event:
+                # Bedrock reports mid-stream failures as exception events rather than raising
+                raise RuntimeError(f"Bedrock stream error: {event}")
+            text = json.loads(event['chunk']['bytes']).get('outputText')
+            if text:
+                yield text
+    finally:
+        close = getattr(stream, 'close', None)
+        if close is not None:
+            close()
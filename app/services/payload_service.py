@@ -0,0 +1,142 @@
+# app/services/payload_service.py
+
+import gzip
+import hashlib
+import mmap
+import os
+import brotli
+import orjson
+from fastapi import HTTPException, Request, Response
+from geopandas import GeoDataFrame
+from app.utils.compression import negotiate_encoding
+
+# Layers are compressed once per load or refresh, so slow, small settings pay off. Brotli 10-11
+# are ~25x slower than 9 for ~10% smaller output, which would stall startup on large layers
+GZIP_LEVEL = 9
+BROTLI_QUALITY = int(os.getenv("LAYER_BROTLI_QUALITY", 9))
+
+# Clients may keep a copy but must revalidate it, which costs a 304 when nothing changed
+CACHE_CONTROL = "no-cache"
+
+# File name suffix of each encoding when payloads are written to the layer snapshot
+PAYLOAD_SUFFIXES = {None: '', 'gzip': '.gz', 'br': '.br'}
+
+
+class LayerPayload:
+    """ One layer's GeoJSON, serialized once and kept as identity, gzip and brotli bytes with strong ETags.
+
+    The ETag is a hash of the JSON, so it is the same in every worker and across restarts for the
+    same data. Each encoding gets its own ETag, as its bytes differ.
+
+    Args:
+    - variants (dict): Content encoding (None for identity) to (body, ETag)
+    """
+
+    def __init__(self, variants: dict):
+        self.variants = variants
+        self.etags = {etag for _, etag in self.variants.values()}
+
+    @classmethod
+    def encode(cls, body: bytes) -> "LayerPayload":
+        """ Compresses a serialized layer into every encoding.
+        """
+        digest = hashlib.sha256(body).hexdigest()[:32]
+        return cls({
+            None: (body, f'"{digest}"'),
+            'gzip': (gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0), f'"{digest}-gzip"'),
+            'br': (brotli.compress(body, quality=BROTLI_QUALITY), f'"{digest}-br"')
+        })
+
+    @classmethod
+    def from_frame(cls, frame: GeoDataFrame) -> "LayerPayload":
+        return cls.encode(orjson.dumps(frame.to_geo_dict(drop_id=True), option=orjson.OPT_SERIALIZE_NUMPY))
+
+    @classmethod
+    def from_files(cls, path: str, etags: dict) -> "LayerPayload":
+        """ Maps the files written by write read-only.
+
+        The bodies are views of the page cache rather than copies, so every worker serving the
+        same snapshot shares one copy of each payload.
+
+        Args:
+        - path (str): Path of the identity file; the other encodings are next to it
+        - etags (dict): Encoding name ('identity', 'gzip' or 'br') to ETag, as returned by write
+        """
+        variants = {}
+        for encoding, suffix in PAYLOAD_SUFFIXES.items():
+            with open(path + suffix, 'rb') as f:
+                body = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+            variants[encoding] = (body, etags[encoding or 'identity'])
+        return cls(variants)
+
+    def write(self, path: str) -> dict:
+        """ Writes every encoding to path plus its suffix, each renamed into place once complete.
+
+        Returns:
+        - etags (dict): Encoding name to ETag, for from_files
+        """
+        for encoding, (body, _) in self.variants.items():
+            file_path = path + PAYLOAD_SUFFIXES[encoding]
+            with open(file_path + '.tmp', 'wb') as f:
+                f.write(body)
+            os.replace(file_path + '.tmp', file_path)
+        return {encoding or 'identity': etag for encoding, (_, etag) in self.variants.items()}
+
+    def not_modified(self, if_none_match: str) -> bool:
+        """ Whether an If-None-Match header matches any ETag of this layer (weak comparison, as RFC 9110 asks).
+        """
+        if not if_none_match:
+            return False
+        tags = {tag.strip().removeprefix('W/') for tag in if_none_match.split(',')}
+        return '*' in tags or not self.etags.isdisjoint(tags)
+
+    def response(self, request: Request) -> Response:
+        """ Returns a 304 if the client's copy is current, otherwise the best encoding it accepts.
+        """
+        encoding = negotiate_encoding(request.headers.get('accept-encoding'))
+        body, etag = self.variants[encoding]
+        headers = {'ETag': etag, 'Cache-Control': CACHE_CONTROL, 'Vary': 'Accept-Encoding'}
+        if self.not_modified(request.headers.get('if-none-match')):
+            return Response(status_code=304, headers=headers)
+        if encoding is not None:
+            headers['Content-Encoding'] = encoding
+        return Response(content=body, media_type="application/geo+json", headers=headers)
+
+    def size(self) -> dict:
+        return {str(encoding or 'identity'): len(body) for encoding, (body, _) in self.variants.items()}
+
+
+class LayerPayloads:
+    """ Pre-encoded payloads of every published layer, served by /geojson/{file_key}.
+
+    Args:
+    - payloads (dict): File key to LayerPayload
+    """
+
+    def __init__(self, payloads: dict):
+        self._payloads = payloads
+
+    @classmethod
+    def from_frames(cls, frames: dict) -> "LayerPayloads":
+        return cls({key: LayerPayload.from_frame(frame) for key, frame in frames.items()})
+
+    def updated(self, payloads: dict, removed=()) -> "LayerPayloads":
+        """ Returns new payloads with the given layers replaced and removed layers dropped.
+        """
+        kept = {key: payload for key, payload in self._payloads.items() if key not in removed and key not in payloads}
+        return LayerPayloads({**kept, **payloads})
+
+    def get(self, file_key: str) -> LayerPayload:
+        if file_key not in self._payloads:
+            raise HTTPException(status_code=404, detail=f"File '{file_key}' not found.")
+        return self._payloads[file_key]
+
+    def stats(self) -> dict:
+        return {key: payload.size() for key, payload in self._payloads.items()}
+
+
+def get_layer_payloads(request: Request) -> LayerPayloads:
+    """
+    Get the pre-encoded layer payloads built during application startup.
+    """
+    return request.app.state.layer_payloads
@@ -1,105 +1,156 @@
+import logging
+import asyncio
+import os
 import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
 import time
+from typing import Awaitable
 from fastapi import Request
 from shapely.geometry import Point, LineString
 from app.utils import (
     generate_search_buffer,
     search_nearby_items,
+    assign_clusters,
     find_clusters,
-    concat_poi_gdf,
     nearest_neighbor_route,
     generate_full_route
 )
-from app.models.schemas import UserData, RoutePoint, RouteSegment, RouteResponse
-from app.utils.onemap import reverse_geocode
+from app.models.schemas import UserData, RoutePoint, RouteSegment, RouteResponse, CompactRouteSegment, CompactRouteResponse, RouteScore, RankedRoute, RouteAlternatives
+from app.services.layer_service import get_layer_store, to_layer_crs
+from app.services.session_service import get_session_store, new_route_id
+from app.utils.orienteering import solve_orienteering, DETOUR_FACTOR
+from app.utils.route_generation import SharedLegs
+from app.utils.route_scoring import score_route
+from app.utils.metrics import stage, count
+from app.utils.onemap import encode_route_geometry
+from app.utils.router import Router
 
+logger = logging.getLogger(__name__)
 
-def generate_route(request: Request, user_data: UserData):  # -> RouteRequest:
+# 'orienteering' (default) or 'cluster' for the original retry loop
+DEFAULT_SOLVER = 'orienteering'
+
+# Maximum number of candidate routes the orienteering solver confirms against the router
+MAX_CONFIRMATIONS = 3
+
+# Most alternative routes one request can ask for
+MAX_ALTERNATIVES = 5
+
+# Seconds to spend on all alternatives of a request, selection included; candidates not done by then are dropped
+ALTERNATIVES_TIME_BUDGET = float(os.getenv("ROUTE_ALTERNATIVES_BUDGET", 10))
+
+
+def plan_corridor(layer_store, user_data: UserData) -> tuple:
+    """ CPU stages of a route: search corridor, layer concatenation, corridor search and, for the orienteering solver, clustering.
+
+    Needs nothing but the layer store and the request, so it can run in a worker process.
+
+    Args:
+    - layer_store (LayerStore): Loaded layers
+    - user_data (UserData): User preferences and data
+
+    Returns:
+    - nearby_pois (GeoDataFrame): POIs within the corridor in EPSG:3414, or None if no POI types were asked for
+    - corridor_key (tuple): Layer set and corridor the POIs came from, used as the cluster cache key
+    """
+    user_location, end_location = Point(tuple(user_data['user_location'])), Point(tuple(user_data['end_location']))
+    # Create an activity line between start and end
+    activity_line = gpd.GeoDataFrame(geometry=[LineString([user_location, end_location]) if user_location != end_location else user_location], crs="EPSG:4326")
+
+    with stage("search_buffer"):
+        search_gdf_sg = generate_search_buffer(activity_line, user_data['search_radius'])
+
+    poi_keys = [f"{poi_type}.geojson" for poi_type in user_data['poi_types']] if user_data['poi_types'] else []
+    with stage("concat_poi"):
+        poi_layer = layer_store.combined(poi_keys) if poi_keys else None
+
+    with stage("search_nearby"):
+        nearby_pois = search_nearby_items(search_gdf_sg, poi_layer) if poi_layer is not None else None
+    # Nearby POIs are fully determined by the layer set and corridor, so their cluster labels can be cached
+    corridor_key = (poi_layer.key if poi_layer is not None else None, *user_data['user_location'], *user_data['end_location'], user_data['search_radius'])
+
+    # Cluster labels drive diversity in the orienteering solver and POI replacement in generate_full_route
+    if nearby_pois is not None and user_data.get('solver', DEFAULT_SOLVER) == 'orienteering':
+        with stage("cluster"):
+            nearby_pois = assign_clusters(nearby_pois, user_data['num_POIs'], corridor_key)
+    return nearby_pois, corridor_key
+
+
+async def generate_route(request: Request, user_data: UserData, response_format: str = 'full', route_client: Router = None, plan: Awaitable = None, alternatives: int = 1):  # -> RouteRequest:
     """
     Args:
     - route_request (Request): FastAPI request
     - user_data (UserData): User preferences and data
+    - response_format (str): 'full' for a RouteResponse, 'compact' for a CompactRouteResponse
+    - route_client (Router): Routing backend to use instead of the application's, e.g. one sharing legs across a batch
+    - plan (Awaitable): Result of plan_corridor computed elsewhere, e.g. in a worker process; computed here if None
+    - alternatives (int): Number of candidate routes to generate; above 1, a RouteAlternatives of the distinct ones, best first
     
     Returns:
 
     """
+    route_client = route_client or request.app.state.route_client
+    layer_store = get_layer_store(request)
     
     # Convert user and end locations to GeoDataFrames
     start_time = time.time()
     user_location, end_location = Point(tuple(user_data['user_location'])),  Point(tuple(user_data['end_location']))
-    print(reverse_geocode(user_location), reverse_geocode(end_location))
+    # Identical start and end points share a single lookup; repeat locations come from cache
+    geocoder = request.app.state.geocoder
+    with stage("geocode"):
+        user_name, end_name = await asyncio.gather(
+            geocoder.name(user_location, layer_store, default='Start'),
+            geocoder.name(end_location, layer_store, default='End')
+        )
+    logger.debug("Start: %s, end: %s", user_name, end_name)
     user_gdf = gpd.GeoDataFrame(
-        [{'geometry': user_location, 'NAME': reverse_geocode(user_location), 'TYPE': 'Start'}],
+        [{'geometry': user_location, 'NAME': user_name, 'TYPE': 'Start'}],
         crs="EPSG:4326"
     )
     end_gdf = gpd.GeoDataFrame(
-        [{'geometry': end_location, 'NAME': reverse_geocode(end_location), 'TYPE': 'End'}],
+        [{'geometry': end_location, 'NAME': end_name, 'TYPE': 'End'}],
         crs="EPSG:4326"
     )
 
-    # Create an activity line between start and end
-    if user_location != end_location:
-        line = LineString([user_location, end_location])
-        activity_line = gpd.GeoDataFrame(geometry=[line], crs="EPSG:4326")
-    else:
-        activity_line = user_gdf
-
-    search_gdf_sg = generate_search_buffer(activity_line, user_data['search_radius'])
-
-    # Prepare the keys to pull from memory and concat together
-    input_data_keys = {
-        'poi_gdf': [f"{poi_type}.geojson" for poi_type in user_data['poi_types']] if user_data['poi_types'] else [],
-        'amenity_gdf': ['toilet.geojson'] if user_data['amenity'] else None,
-        'avoidance_gdf': ['stairs.geojson'] if user_data['barrier_free'] else None
-    }
-
-
-    poi_gdf, amenity_gdf, avoidance_gdf = (
-        concat_poi_gdf(keys, request) for keys in input_data_keys.values())
-    
-
-    nearby_pois = search_nearby_items(search_gdf_sg, poi_gdf, False) if poi_gdf is not None else None
-    nearby_amenity = search_nearby_items(search_gdf_sg, amenity_gdf, False) if amenity_gdf is not None else None
-    nearby_avoidance_buffer = search_nearby_items(search_gdf_sg, avoidance_gdf, True) if avoidance_gdf is not None else None
+    nearby_pois, corridor_key = await plan if plan is not None else plan_corridor(layer_store, user_data)
+    amenity_layer = layer_store.combined(['toilet.geojson']) if user_data['amenity'] else None
+    # Stair avoidance areas are buffered, unioned and indexed once at startup
+    avoidance_index = layer_store.avoidance if user_data['barrier_free'] else None
 
-    print(nearby_pois)
+    logger.debug("%s POIs within the search corridor", len(nearby_pois) if nearby_pois is not None else 0)
 
-    final_gdf = None
-    while True:
-        print("Started route generation attempt")
-        if time.time() - start_time > 60:
-            print("Maximum attempts reached. Unable to find a valid route that satisfies the requirements.")
+    if alternatives > 1:
+        candidates = await solve_alternatives(request, user_data, user_gdf, end_gdf, nearby_pois, amenity_layer, avoidance_index, route_client, corridor_key, alternatives)
+        if not candidates:
+            logger.info("Unable to find a valid route that satisfies the requirements.")
             return None, None, None, None, None, None
+        routes = []
+        for rank, (final_gdf, metadata, score) in enumerate(candidates, start=1):
+            route = await build_route_response(request, user_data, final_gdf, metadata, response_format)
+            routes.append(RankedRoute(rank=rank, score=RouteScore(**score), route=route))
+        return RouteAlternatives(routes=routes)
 
-
-        # Find clusters and select POIs
-        selected_pois = find_clusters(nearby_pois, user_data['num_POIs'])
-        # Generate route points
-        print("starting knn")
-        print("--------- user gdf")
-        print(user_gdf)
-        print("--------- selected poi")
-        print(selected_pois)
-        print("--------- end gdf")
-        print(end_gdf)
-        print("---------")
-        route_points_gdf = nearest_neighbor_route(user_gdf, selected_pois, end_gdf)
-
-        print('reorganised knn')
-        print(route_points_gdf)
-
-        final_gdf, metadata = generate_full_route(user_data, route_points_gdf, nearby_pois, nearby_amenity, nearby_avoidance_buffer)
-        if final_gdf is not None:
-            break
+    if user_data.get('solver', DEFAULT_SOLVER) == 'orienteering':
+        final_gdf, metadata = await solve_orienteering_route(user_data, user_gdf, end_gdf, nearby_pois, amenity_layer, avoidance_index, route_client, corridor_key)
+    else:
+        final_gdf, metadata = await solve_cluster_route(user_data, start_time, user_gdf, end_gdf, nearby_pois, amenity_layer, avoidance_index, route_client, corridor_key)
     
-    print("returned to main backend endpoint")
-    print(final_gdf)
-    print(metadata)
-
     # Prepare the response
     if final_gdf is None:
+        logger.info("Unable to find a valid route that satisfies the requirements.")
         return None, None, None, None, None, None
 
+    return await build_route_response(request, user_data, final_gdf, metadata, response_format)
+
+
+async def build_route_response(request: Request, user_data: UserData, final_gdf, metadata: dict, response_format: str = 'full'):
+    """ Turns a generated route into its response, and stores it in the session store under a new route_id.
+
+    Returns:
+    - route_response: RouteResponse, or CompactRouteResponse if response_format is 'compact'
+    """
     route_points = []
 
     for idx, row in final_gdf.iterrows():
@@ -113,29 +164,246 @@ def generate_route(request: Request, user_data: UserData):  # -> RouteRequest:
                 )
             )
         else:
-            print(f"Skipping row {idx} due to None geometry: {row}")
+            logger.warning("Skipping row %s due to None geometry: %s", idx, row)
 
-    # Debugging statement to check the created route points
-    print(f"Route points: {route_points}")
+    logger.debug("Route points: %s", route_points)
 
     
-    final_route_geometries = metadata['final_route_geometry']
+    # Ensure you only create segments if there are enough route points
+    final_route_geometries = metadata['final_route_geometry'][:max(len(route_points) - 1, 0)]
+    compact_response = CompactRouteResponse(
+        route_id=new_route_id(),
+        total_distance=metadata['total_distance'],
+        total_time=metadata['total_time'],
+        route_points=route_points,
+        route_segments=[
+            CompactRouteSegment(from_index=i, to_index=i + 1, polyline=encode_route_geometry(geom))
+            for i, geom in enumerate(final_route_geometries)
+        ]
+    )
+    # Stored per route rather than on app.state, so concurrent users and other workers can look it up by id.
+    # The compact form keeps session records small whichever format the client asked for
+    await get_session_store(request).put(compact_response.route_id, {
+        "user_data": dict(user_data),
+        "route": compact_response.model_dump()
+    })
+    if response_format == 'compact':
+        return compact_response
+
     route_segments = []
     for i, geom in enumerate(final_route_geometries):
-        # Ensure you only create segments if there are enough route points
-        if i < len(route_points) - 1:
-            route_segments.append(
-                RouteSegment(
-                    from_point=route_points[i],
-                    to_point=route_points[i + 1],
-                    geometry=[(lat, lon) for lon, lat in geom.coords]  # Extracting coordinates as (lat, lon)
-                )
+        route_segments.append(
+            RouteSegment(
+                from_point=route_points[i],
+                to_point=route_points[i + 1],
+                geometry=[(lat, lon) for lon, lat in geom.coords]  # Extracting coordinates as (lat, lon)
             )
-    request.app.state.route_points = route_points
-    print(request.app.state.route_points)
+        )
     return RouteResponse(
+        route_id=compact_response.route_id,
         total_distance=metadata['total_distance'],
         total_time=metadata['total_time'],
         route_points=route_points,
         route_segments=route_segments
     )
+
+
+async def solve_alternatives(request: Request, user_data: UserData, user_gdf, end_gdf, nearby_pois, amenity_layer, avoidance_index, route_client, corridor_key: tuple, alternatives: int) -> list:
+    """ Generates up to alternatives distinct routes at once and ranks them by score_route.
+
+    With the orienteering solver, the first candidate is the usual deterministic selection. Each of the
+    others leaves out one of its POIs and randomises ties, and they are solved in parallel on the route
+    planner's processes. With the cluster solver, each candidate samples its own cluster representatives.
+    Either way the candidates are then routed concurrently and every distinct leg is fetched once.
+    ALTERNATIVES_TIME_BUDGET covers selection and routing: whatever is not done by then is dropped, and
+    if no candidate is done there are no routes.
+
+    Returns:
+    - candidates (list): (final_gdf, metadata, score) of each distinct route, best first
+    """
+    deadline = time.monotonic() + ALTERNATIVES_TIME_BUDGET
+    route_client = SharedLegs(route_client)
+    tasks = []
+    try:
+        if user_data.get('solver', DEFAULT_SOLVER) == 'orienteering':
+            if nearby_pois is None:
+                nearby_pois = gpd.GeoDataFrame(geometry=[], crs='EPSG:3414')
+            rngs = [None] + [np.random.default_rng(seed) for seed in range(1, alternatives)]
+            with stage("order"):
+                try:
+                    base = await asyncio.wait_for(solve_selection(request, user_data, user_gdf, end_gdf, nearby_pois), _remaining(deadline))
+                except asyncio.TimeoutError:
+                    count("alternative_timeout", alternatives)
+                    return []
+                # Each other candidate does without one POI of the base selection, so it has to find another
+                variants = [
+                    asyncio.ensure_future(solve_selection(request, user_data, user_gdf, end_gdf, nearby_pois, rng, excluded=base[i % len(base)] if len(base) else None))
+                    for i, rng in enumerate(rngs[1:])
+                ]
+                _, pending = await asyncio.wait(variants, timeout=_remaining(deadline))
+                for variant in pending:
+                    variant.cancel()
+                if pending:
+                    count("alternative_timeout", len(pending))
+            selections = [(base, None)] + [
+                (variant.result(), rng) for variant, rng in zip(variants, rngs[1:])
+                if variant.done() and not variant.cancelled() and variant.exception() is None
+            ]
+            # Ties often resolve the same way; identical selections would only give identical routes
+            distinct = {}
+            for selection, rng in selections:
+                distinct.setdefault(tuple(selection.tolist()), (selection, rng))
+            candidates = [
+                solve_orienteering_route(user_data, user_gdf, end_gdf, nearby_pois, amenity_layer, avoidance_index, route_client, corridor_key, first_selection=selection, rng=rng)
+                for selection, rng in distinct.values()
+            ]
+        else:
+            candidates = [
+                solve_cluster_route(user_data, time.time(), user_gdf, end_gdf, nearby_pois, amenity_layer, avoidance_index, route_client, corridor_key)
+                for _ in range(alternatives)
+            ]
+
+        tasks = [asyncio.ensure_future(candidate) for candidate in candidates]
+        _, pending = await asyncio.wait(tasks, timeout=_remaining(deadline))
+        if pending:
+            count("alternative_timeout", len(pending))
+    finally:
+        for task in tasks:
+            task.cancel()
+        await route_client.aclose()
+
+    routes = {}
+    for task in tasks:
+        if not _succeeded(task):
+            continue
+        final_gdf, metadata = task.result()
+        route_key = tuple(shapely.get_coordinates(final_gdf.geometry.values).round(6).flatten().tolist())
+        if route_key not in routes:
+            routes[route_key] = (final_gdf, metadata, score_route(final_gdf, metadata, user_data, avoidance_index))
+    return sorted(routes.values(), key=lambda candidate: candidate[2]["total"], reverse=True)
+
+
+def _remaining(deadline: float) -> float:
+    return max(deadline - time.monotonic(), 0)
+
+
+def _succeeded(task) -> bool:
+    if not task.done() or task.cancelled():
+        return False
+    if task.exception() is not None:
+        logger.warning("Alternative route failed: %s", task.exception())
+        return False
+    return task.result()[0] is not None
+
+
+async def solve_selection(request: Request, user_data: UserData, user_gdf, end_gdf, nearby_pois, rng: np.random.Generator = None, excluded: int = None) -> np.ndarray:
+    """ Runs the orienteering selection for a candidate on the route planner's processes, or in a thread without one.
+
+    Args:
+    - rng (np.random.Generator): Randomises ties, as for solve_orienteering
+    - excluded (int): Position in nearby_pois of a POI the selection may not use, or None
+
+    Returns:
+    - selected (np.ndarray): Positions in nearby_pois in visiting order
+    """
+    start_xy, end_xy, poi_xy, clusters = orienteering_inputs(user_gdf, end_gdf, nearby_pois)
+    allowed = np.arange(len(poi_xy))
+    if excluded is not None:
+        allowed = np.delete(allowed, excluded)
+        poi_xy, clusters = poi_xy[allowed], clusters[allowed] if clusters is not None else None
+    args = (start_xy, end_xy, poi_xy, user_data['max_route_length'], user_data['num_POIs'], clusters, DETOUR_FACTOR, rng)
+    planner = getattr(request.app.state, 'route_planner', None)
+    if planner is None:
+        selected = await asyncio.to_thread(solve_orienteering, *args)
+    else:
+        selected = await planner.submit(get_layer_store(request), solve_orienteering, *args)
+    return allowed[selected]
+
+
+def orienteering_inputs(user_gdf, end_gdf, nearby_pois) -> tuple:
+    """ Returns the projected start and end, the POI coordinates and their cluster labels, as solve_orienteering takes them.
+    """
+    start_xy, end_xy = (shapely.get_coordinates(gdf.geometry.to_crs('EPSG:3414').values)[0] for gdf in (user_gdf, end_gdf))
+    poi_xy = shapely.get_coordinates(nearby_pois.geometry.values)
+    clusters = nearby_pois['cluster'].to_numpy() if 'cluster' in nearby_pois.columns else None
+    return start_xy, end_xy, poi_xy, clusters
+
+
+async def solve_cluster_route(user_data: UserData, start_time: float, user_gdf, end_gdf, nearby_pois, amenity_layer, avoidance_index, route_client, corridor_key: tuple = None):
+    """ Retry-loop solver: samples one POI per K means cluster, orders them and routes, until a route fits or 60 seconds pass.
+    """
+    while True:
+        if time.time() - start_time > 60:
+            logger.info("Maximum attempts reached. Unable to find a valid route that satisfies the requirements.")
+            return None, None
+
+
+        count("cluster_iteration")
+        # Find clusters and select POIs
+        with stage("cluster"):
+            selected_pois = find_clusters(nearby_pois, user_data['num_POIs'], corridor_key)
+        # Generate route points
+        with stage("order"):
+            route_points_gdf = nearest_neighbor_route(user_gdf, selected_pois, end_gdf)
+        logger.debug("Cluster attempt ordered %s POIs", len(selected_pois))
+
+        with stage("full_route"):
+            final_gdf, metadata = await generate_full_route(user_data, route_points_gdf, nearby_pois, amenity_layer, avoidance_index, route_client)
+        if final_gdf is not None:
+            return final_gdf, metadata
+
+
+async def solve_orienteering_route(user_data: UserData, user_gdf, end_gdf, nearby_pois, amenity_layer, avoidance_index, route_client, corridor_key: tuple = None, first_selection: np.ndarray = None, rng: np.random.Generator = None):
+    """ Orienteering solver: picks and orders POIs on Euclidean estimates, then confirms only the final candidate with the router.
+
+    Expects nearby_pois with the cluster labels plan_corridor assigns. first_selection, if given, replaces the
+    first solve, e.g. one already computed in a worker process; rng randomises ties, for alternative routes.
+
+    If the confirmed route had to be cut short, the detour factor is recalibrated from the legs the router
+    actually returned and the selection is solved again, at most MAX_CONFIRMATIONS times in total. The most
+    complete confirmed route is returned, so the number of router round trips is bounded.
+    """
+    if nearby_pois is None:
+        nearby_pois = gpd.GeoDataFrame(geometry=[], crs='EPSG:3414')
+
+    start_xy, end_xy, poi_xy, clusters = orienteering_inputs(user_gdf, end_gdf, nearby_pois)
+
+    detour_factor = DETOUR_FACTOR
+    best_gdf, best_metadata = None, None
+    for attempt in range(MAX_CONFIRMATIONS):
+        count("orienteering_confirmation")
+        if attempt == 0 and first_selection is not None:
+            selected = first_selection
+        else:
+            with stage("order"):
+                # Off the event loop, so a wide corridor does not stall concurrent requests
+                selected = await asyncio.to_thread(solve_orienteering, start_xy, end_xy, poi_xy, user_data['max_route_length'], user_data['num_POIs'], clusters, detour_factor, rng)
+        logger.debug("Orienteering attempt %s selected %s POIs with detour factor %.2f", attempt, len(selected), detour_factor)
+
+        selected_pois = nearby_pois.iloc[selected].to_crs(epsg=4326)
+        route_points_gdf = gpd.GeoDataFrame(pd.concat([user_gdf, selected_pois, end_gdf], ignore_index=True), geometry='geometry', crs='EPSG:4326')
+
+        with stage("full_route"):
+            final_gdf, metadata = await generate_full_route(user_data, route_points_gdf, nearby_pois, amenity_layer, avoidance_index, route_client)
+        if final_gdf is None:
+            continue
+        if best_gdf is None or (best_metadata['truncated'] and len(final_gdf) > len(best_gdf)):
+            best_gdf, best_metadata = final_gdf, metadata
+        if not metadata['truncated'] or len(selected) == 0:
+            break
+
+        detour_factor = max(detour_factor, observed_detour_factor(metadata)) * 1.05
+
+    return best_gdf, best_metadata
+
+
+def observed_detour_factor(metadata: dict) -> float:
+    """ Ratio of routed distance to straight-line distance over the legs fetched for a route.
+    """
+    straight_distance = sum(
+        to_layer_crs(Point(geom.coords[0])).distance(to_layer_crs(Point(geom.coords[-1])))
+        for geom in metadata['final_route_geometry'] if geom is not None
+    )
+    if straight_distance == 0:
+        return DETOUR_FACTOR
+    return metadata['total_distance'] / straight_distance
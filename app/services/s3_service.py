@@ -1,11 +1,15 @@
 # app/services/s3_service.py
 
+import logging
 import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
 import boto3
 from fastapi import HTTPException, Request
 import geojson
 
+logger = logging.getLogger(__name__)
+
 # Load environment variables from .env file
 load_dotenv(".env.production")
 
@@ -23,26 +27,43 @@ s3_client = boto3.client(
     region_name=aws_default_region
 )
 
-def load_all_geojson_files() -> dict:
+def list_geojson_etags(client=None, bucket: str = None) -> dict:
+    """
+    List the ETag of every GeoJSON file in the S3 bucket, following pagination, without downloading them.
+    Raises on S3 errors so callers can tell an empty bucket from an unreachable one.
+    """
+    paginator = (client or s3_client).get_paginator('list_objects_v2')
+    etags = {}
+    for page in paginator.paginate(Bucket=bucket or bucket_name):
+        for obj in page.get('Contents', []):
+            if obj['Key'].endswith('.geojson'):
+                etags[obj['Key']] = obj['ETag'].strip('"')
+    return etags
+
+def load_all_geojson_files(max_workers: int = 8) -> dict:
     """
-    Load all GeoJSON files from the S3 bucket into memory.
+    Load all GeoJSON files from the S3 bucket into memory, downloading up to max_workers files at a time.
     """
     geojson_files = {}
     try:
-        # List all objects in the bucket
-        response = s3_client.list_objects_v2(Bucket=bucket_name)
-        if 'Contents' in response:
-            for obj in response['Contents']:
-                file_key = obj['Key']
-                print(file_key)
-                if file_key.endswith('.geojson'):
-                    # Fetch each GeoJSON file and store it in memory
-                    geojson_files[file_key] = fetch_geojson_from_s3(file_key)
-        else:
-            print("No GeoJSON files found in the bucket.")
+        file_keys = list(list_geojson_etags())
     except Exception as e:
-        print(f"Error loading files from S3: {str(e)}")
-    return geojson_files
+        logger.error("Error listing files in S3: %s", e)
+        return geojson_files
+    if not file_keys:
+        logger.info("No GeoJSON files found in the bucket.")
+        return geojson_files
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(fetch_geojson_from_s3, file_key): file_key for file_key in file_keys}
+        for future in as_completed(futures):
+            file_key = futures[future]
+            try:
+                geojson_files[file_key] = future.result()
+            except Exception as e:
+                logger.error("Error loading %s from S3: %s", file_key, e)
+    # Keep the listing order regardless of which download finished first
+    return {file_key: geojson_files[file_key] for file_key in file_keys if file_key in geojson_files}
 
 def fetch_geojson_from_s3(file_key: str) -> dict:
     """
@@ -55,6 +76,13 @@ def fetch_geojson_from_s3(file_key: str) -> dict:
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching file from S3: {str(e)}")
 
+def fetch_object_bytes(file_key: str, client=None, bucket: str = None) -> bytes:
+    """
+    Fetch the raw contents of an object from S3.
+    """
+    response = (client or s3_client).get_object(Bucket=bucket or bucket_name, Key=file_key)
+    return response['Body'].read()
+
 def get_geojson(file_key: str, request: Request):
     """
     Get a preloaded GeoJSON file from memory.
@@ -0,0 +1,131 @@
+# app/services/session_service.py
+
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+import redis.asyncio as aioredis
+from fastapi import HTTPException, Request
+
+
+def new_route_id() -> str:
+    return uuid.uuid4().hex
+
+
+class MemorySessionStore:
+    """ In-process LRU/TTL store of generated routes, keyed by route_id.
+
+    Suitable for a single worker. Records are kept as JSON-compatible dicts so that both
+    backends store and return exactly the same thing.
+
+    Args:
+    - max_size (int): Maximum number of routes kept
+    - ttl (float): Seconds a route stays retrievable after it was generated
+    """
+
+    def __init__(self, max_size: int = 10000, ttl: float = 3600):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    async def get(self, route_id: str):
+        """ Returns the stored record for route_id, or None if it is unknown or expired.
+        """
+        with self._lock:
+            entry = self._entries.get(route_id)
+            if entry is None:
+                return None
+            if time.time() - entry[0] > self.ttl:
+                del self._entries[route_id]
+                return None
+            self._entries.move_to_end(route_id)
+            return entry[1]
+
+    async def put(self, route_id: str, record: dict):
+        with self._lock:
+            self._entries[route_id] = (time.time(), record)
+            self._entries.move_to_end(route_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    async def aclose(self):
+        self._entries.clear()
+
+
+class RedisSessionStore:
+    """ Route store shared by every worker through a Redis-protocol server.
+
+    Each record is a JSON string under prefix + route_id with a TTL. Memory on the server is
+    bounded by the TTL together with its maxmemory / allkeys-lru eviction policy.
+
+    Args:
+    - client (redis.asyncio.Redis): Client, or any object with the same async get/set/aclose methods
+    - ttl (float): Seconds a route stays retrievable after it was generated
+    - prefix (str): Key prefix, so the server can be shared with other data
+    """
+
+    def __init__(self, client, ttl: float = 3600, prefix: str = "route:"):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    @classmethod
+    def from_url(cls, url: str, ttl: float = 3600) -> "RedisSessionStore":
+        return cls(aioredis.from_url(url), ttl=ttl)
+
+    async def get(self, route_id: str):
+        """ Returns the stored record for route_id, or None if it is unknown or expired.
+        """
+        value = await self.client.get(self.prefix + route_id)
+        return json.loads(value) if value is not None else None
+
+    async def put(self, route_id: str, record: dict):
+        await self.client.set(self.prefix + route_id, json.dumps(record), ex=int(self.ttl))
+
+    async def aclose(self):
+        await self.client.aclose()
+
+
+def create_session_store():
+    """ Builds the route session store selected by SESSION_BACKEND.
+
+    - memory (default): MemorySessionStore, per worker
+    - redis: RedisSessionStore against REDIS_URL, shared by every worker
+    """
+    backend = os.getenv("SESSION_BACKEND", "memory")
+    ttl = float(os.getenv("SESSION_TTL", 3600))
+    if backend == "memory":
+        return MemorySessionStore(max_size=int(os.getenv("SESSION_MAX_SIZE", 10000)), ttl=ttl)
+    if backend == "redis":
+        return RedisSessionStore.from_url(os.getenv("REDIS_URL", "redis://localhost:6379/0"), ttl=ttl)
+    raise ValueError(f"Unknown SESSION_BACKEND '{backend}'")
+
+
+def get_session_store(request: Request):
+    """
+    Get the route session store created during application startup.
+    """
+    return request.app.state.session_store
+
+
+async def get_route_record(route_id: str, request: Request) -> dict:
+    """
+    Get a stored route by its id, or raise a 404 if it is unknown or has expired.
+    """
+    record = await get_session_store(request).get(route_id)
+    if record is None:
+        raise HTTPException(status_code=404, detail=f"Route '{route_id}' not found or expired.")
+    return record
+
+
+def route_location_names(record: dict) -> list:
+    """
+    Get the distinct stop names of a stored route, in visiting order.
+    """
+    return list(dict.fromkeys(point["name"] for point in record["route"]["route_points"]))
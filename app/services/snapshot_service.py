@@ -0,0 +1,175 @@
+# app/services/snapshot_service.py
+
+import fcntl
+import json
+import os
+import time
+from collections.abc import MutableMapping
+import geopandas as gpd
+from geopandas import GeoDataFrame
+
+# Bump when the on-disk layout changes so older snapshots are rebuilt rather than misread
+SNAPSHOT_VERSION = 2
+MANIFEST_NAME = 'manifest.json'
+
+# Held for its lifetime by the process that syncs the shared snapshot from S3
+LOADER_LOCK = 'loader.lock'
+# Held by the loader while it does its first load, so attaching workers wait for a current snapshot
+STARTUP_LOCK = 'startup.lock'
+
+
+class GeoJSONView(MutableMapping):
+    """ Serves layers as GeoJSON FeatureCollection dicts built from their GeoDataFrames on first access.
+
+    Stands in for the dict of parsed GeoJSON files so that layers loaded from a snapshot are only
+    turned back into Python dicts when a client actually asks for them.
+
+    Args:
+    - frames (dict): File key to long/lat GeoDataFrame with every property column
+    """
+
+    def __init__(self, frames: dict):
+        self._frames = dict(frames)
+        self._dicts = {}
+
+    def __getitem__(self, key: str) -> dict:
+        if key not in self._dicts:
+            self._dicts[key] = self._frames[key].to_geo_dict(drop_id=True)
+        return self._dicts[key]
+
+    def __setitem__(self, key: str, feature_collection: dict):
+        self._frames[key] = features_to_gdf(feature_collection)
+        self._dicts[key] = feature_collection
+
+    def __delitem__(self, key: str):
+        del self._frames[key]
+        self._dicts.pop(key, None)
+
+    def __iter__(self):
+        return iter(self._frames)
+
+    def __len__(self) -> int:
+        return len(self._frames)
+
+
+def features_to_gdf(feature_collection: dict) -> GeoDataFrame:
+    """ Converts a GeoJSON FeatureCollection into a long/lat GeoDataFrame, keeping every property.
+    """
+    return gpd.GeoDataFrame.from_features(feature_collection['features'], crs='EPSG:4326')
+
+
+def snapshot_file_name(file_key: str) -> str:
+    return file_key.replace('/', '__') + '.arrow'
+
+
+def payload_file_name(file_key: str) -> str:
+    return file_key.replace('/', '__') + '.payload'
+
+
+def lock_file(snapshot_dir: str, name: str, blocking: bool = False):
+    """ Takes an exclusive lock on a file in the snapshot directory.
+
+    The lock is released when the returned file is closed or the process exits, however it exits.
+
+    Returns:
+    - lock (file): The open lock file, or None if another process holds the lock and blocking is False
+    """
+    os.makedirs(snapshot_dir, exist_ok=True)
+    lock = open(os.path.join(snapshot_dir, name), 'a')
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock.close()
+        return None
+    return lock
+
+
+def read_manifest(snapshot_dir: str):
+    """ Returns the snapshot manifest, or None if there is no usable snapshot in snapshot_dir.
+    """
+    try:
+        with open(os.path.join(snapshot_dir, MANIFEST_NAME)) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if manifest.get('version') != SNAPSHOT_VERSION:
+        return None
+    return manifest
+
+
+def build_snapshot(snapshot_dir: str, frames: dict, etags: dict, changed_keys=None, payloads=None) -> dict:
+    """ Writes layers to uncompressed Arrow IPC (Feather) files and records them in a manifest.
+
+    Geometries are stored as WKB next to the property columns. Each file, and then the manifest,
+    is written to a temporary name and renamed into place, so a process reading the snapshot
+    never sees a half-written layer, and one that has mapped a replaced file keeps reading the old
+    one. Files of layers no longer in frames are removed.
+
+    Encoded payloads are written next to the layers, so workers sharing the snapshot can map them
+    rather than encode them. Layers without a new payload keep the one in the previous manifest
+    unless their frame changed.
+
+    Args:
+    - snapshot_dir (str): Directory to write the snapshot into
+    - frames (dict): File key to long/lat GeoDataFrame with every property column
+    - etags (dict): File key to the S3 ETag the frame was loaded from
+    - changed_keys (iterable): Layers to (re)write, or None to write every layer. Other layers must already be in the snapshot.
+    - payloads (dict): Optional file key to LayerPayload to write
+
+    Returns:
+    - manifest (dict): The manifest that was written
+    """
+    os.makedirs(snapshot_dir, exist_ok=True)
+    changed_keys = set(frames) if changed_keys is None else set(changed_keys)
+    payloads = payloads or {}
+    previous = read_manifest(snapshot_dir) or {"layers": {}}
+    layers = {}
+    for key, frame in frames.items():
+        file_name = snapshot_file_name(key)
+        if key in changed_keys:
+            path = os.path.join(snapshot_dir, file_name)
+            frame.to_feather(path + '.tmp', compression='uncompressed')
+            os.replace(path + '.tmp', path)
+        layers[key] = {"file": file_name, "etag": etags.get(key), "rows": len(frame)}
+        if key in payloads:
+            payload_file = payload_file_name(key)
+            layers[key]["payload"] = {"file": payload_file, "etags": payloads[key].write(os.path.join(snapshot_dir, payload_file))}
+        elif key not in changed_keys and previous["layers"].get(key, {}).get("payload"):
+            layers[key]["payload"] = previous["layers"][key]["payload"]
+
+    manifest = {"version": SNAPSHOT_VERSION, "created": time.time(), "layers": layers}
+    manifest_path = os.path.join(snapshot_dir, MANIFEST_NAME)
+    with open(manifest_path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(manifest_path + '.tmp', manifest_path)
+
+    current_files = {layer["file"] for layer in layers.values()}
+    current_payloads = {layer["payload"]["file"] for layer in layers.values() if layer.get("payload")}
+    for file_name in os.listdir(snapshot_dir):
+        if file_name.endswith('.tmp'):
+            continue
+        payload_file = file_name.partition('.payload')[0] + '.payload'
+        if (file_name.endswith('.arrow') and file_name not in current_files) or ('.payload' in file_name and payload_file not in current_payloads):
+            os.remove(os.path.join(snapshot_dir, file_name))
+    return manifest
+
+
+def load_snapshot(snapshot_dir: str, manifest: dict, keys=None) -> dict:
+    """ Reads layers in the manifest from the snapshot, memory-mapping the Arrow files.
+
+    Columns pandas can back with Arrow memory, such as pyarrow-backed strings, keep pointing into
+    the mapped file, so processes reading the same snapshot share those pages rather than copy them.
+
+    Args:
+    - snapshot_dir (str): Snapshot directory
+    - manifest (dict): Manifest returned by read_manifest
+    - keys (iterable): Layers to read, or None for every layer in the manifest
+
+    Returns:
+    - frames (dict): File key to long/lat GeoDataFrame with every property column
+    """
+    keys = manifest["layers"].keys() if keys is None else keys
+    return {
+        key: gpd.read_feather(os.path.join(snapshot_dir, manifest["layers"][key]["file"]), memory_map=True)
+        for key in keys
+    }
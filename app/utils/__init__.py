@@ -1,11 +1,11 @@
-from .data_prep import generate_search_buffer, search_nearby_items, find_clusters, concat_poi_gdf
+from .data_prep import generate_search_buffer, search_nearby_items, assign_clusters, find_clusters
 from .route_generation import nearest_neighbor_route, generate_full_route
 
 __all__ = [
     "generate_search_buffer",
     "search_nearby_items",
+    "assign_clusters",
     "find_clusters",
-    "concat_poi_gdf",
     "nearest_neighbor_route",
     "generate_full_route",
 ]
\ No newline at end of file
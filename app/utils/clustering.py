@@ -0,0 +1,111 @@
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+from sklearn.cluster import KMeans, MiniBatchKMeans
+from app.services.layer_service import point_coords
+
+CLUSTER_MODES = ('kmeans', 'kmeans++', 'minibatch', 'grid')
+
+
+def grid_labels(coords: np.ndarray, num_clusters: int) -> np.ndarray:
+    """ Partitions points into num_clusters groups by recursive splits along the widest axis.
+
+    A k-d style spatial partition: deterministic, O(N log N), and with equal group sizes.
+    """
+    labels = np.zeros(len(coords), dtype=np.int64)
+    pending = [(np.arange(len(coords)), num_clusters, 0)]
+    while pending:
+        members, parts, first_label = pending.pop()
+        if parts == 1 or len(members) < 2:
+            labels[members] = first_label
+            continue
+        extent = coords[members].max(axis=0) - coords[members].min(axis=0)
+        ordered = members[np.argsort(coords[members, int(np.argmax(extent))], kind='stable')]
+        left_parts = parts // 2
+        split = len(ordered) * left_parts // parts
+        pending.append((ordered[:split], left_parts, first_label))
+        pending.append((ordered[split:], parts - left_parts, first_label + left_parts))
+    return labels
+
+
+class ClusterEngine:
+    """ Clusters POI coordinates and caches the labels per (corridor, layer set, k).
+
+    Modes:
+    - kmeans: K means with ten k-means++ initialisations (the original behaviour, and the default)
+    - kmeans++: K means with a single k-means++ initialisation
+    - minibatch: MiniBatch K means with a single initialisation
+    - grid: median-split spatial partition, no iterations at all
+
+    Args:
+    - mode (str): One of CLUSTER_MODES
+    - max_size (int): Maximum number of cached label arrays
+    """
+
+    def __init__(self, mode: str = 'kmeans', max_size: int = 256):
+        if mode not in CLUSTER_MODES:
+            raise ValueError(f"Unknown cluster mode '{mode}', expected one of {CLUSTER_MODES}")
+        self.mode = mode
+        self.max_size = max_size
+        self._labels = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "ClusterEngine":
+        return cls(mode=os.getenv("CLUSTER_MODE", 'kmeans'), max_size=int(os.getenv("CLUSTER_CACHE_SIZE", 256)))
+
+    def labels(self, coords: np.ndarray, num_clusters: int, cache_key: tuple = None) -> np.ndarray:
+        """ Returns a cluster label per coordinate, reusing cached labels for the same key.
+
+        Args:
+        - coords (np.ndarray): (N, 2) projected coordinates
+        - num_clusters (int): Number of clusters to be generated
+        - cache_key (tuple): Identifies the corridor and layer set the coordinates came from, or None to skip caching
+
+        Returns:
+        - labels (np.ndarray): Cluster label for each row of coords
+        """
+        key = (cache_key, num_clusters, self.mode, len(coords)) if cache_key is not None else None
+        if key is not None:
+            with self._lock:
+                if key in self._labels:
+                    self._labels.move_to_end(key)
+                    return self._labels[key]
+
+        labels = self._cluster(coords, num_clusters)
+
+        if key is not None:
+            with self._lock:
+                self._labels[key] = labels
+                while len(self._labels) > self.max_size:
+                    self._labels.popitem(last=False)
+        return labels
+
+    def clear(self):
+        """ Drops every cached label array, e.g. after the layers they were computed from were reloaded.
+        """
+        with self._lock:
+            self._labels.clear()
+
+    def _cluster(self, coords: np.ndarray, num_clusters: int) -> np.ndarray:
+        if len(coords) <= num_clusters:
+            return np.ones(len(coords), dtype=np.int64)
+        if self.mode == 'grid':
+            return grid_labels(coords, num_clusters)
+        if self.mode == 'minibatch':
+            return MiniBatchKMeans(n_clusters=num_clusters, n_init=1, batch_size=1024).fit(coords).labels_
+        n_init = 10 if self.mode == 'kmeans' else 1
+        return KMeans(n_clusters=num_clusters, n_init=n_init).fit(coords).labels_
+
+
+cluster_engine = ClusterEngine.from_env()
+
+
+def sample_representatives(labels: np.ndarray, rng: np.random.Generator = None) -> np.ndarray:
+    """ Picks one random member per cluster, returning positional indices ordered by cluster label.
+    """
+    rng = rng or np.random.default_rng()
+    shuffled = rng.permutation(len(labels))
+    _, first = np.unique(labels[shuffled], return_index=True)
+    return shuffled[first]
@@ -0,0 +1,65 @@
+import gzip
+import brotli
+from fastapi import Request, Response
+
+# Bodies smaller than this are sent as is; compressing them costs more than it saves
+MIN_COMPRESS_SIZE = 1024
+
+# Preferred first when the client accepts several
+ENCODINGS = ('br', 'gzip')
+
+
+def negotiate_encoding(accept_encoding: str):
+    """ Picks the content encoding for an Accept-Encoding header, or None for identity.
+
+    Encodings the client gives q=0 are refused, even if it also sends *; *;q=0 refuses every encoding
+    not listed. Otherwise brotli is preferred over gzip.
+    """
+    accepted, refused = set(), set()
+    for part in (accept_encoding or "").lower().split(','):
+        coding, *params = (piece.strip() for piece in part.split(';'))
+        q = next((_quality(param[2:]) for param in params if param.startswith('q=')), 1.0)
+        (refused if q == 0 else accepted).add(coding)
+    for encoding in ENCODINGS:
+        if encoding in refused:
+            continue
+        if encoding in accepted or '*' in accepted:
+            return encoding
+    return None
+
+
+def _quality(value: str) -> float:
+    try:
+        return float(value)
+    except ValueError:
+        return 1.0
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == 'br':
+        # Quality 5 is close to gzip's speed with smaller output; 11 is only worth it for bodies compressed once
+        return brotli.compress(body, quality=5)
+    if encoding == 'gzip':
+        return gzip.compress(body, compresslevel=6)
+    return body
+
+
+def compressed_response(request: Request, body: bytes, media_type: str = "application/json", headers: dict = None) -> Response:
+    """ Returns body as a Response, brotli- or gzip-compressed when the client accepts it and it is worth it.
+
+    Args:
+    - request (Request): Request whose Accept-Encoding header is negotiated
+    - body (bytes): Serialized response body
+    - media_type (str): Content type of the body
+    - headers (dict): Extra response headers
+
+    Returns:
+    - response (Response): Response with Content-Encoding and Vary set as needed
+    """
+    headers = dict(headers or {})
+    headers['Vary'] = 'Accept-Encoding'
+    encoding = negotiate_encoding(request.headers.get('accept-encoding')) if len(body) >= MIN_COMPRESS_SIZE else None
+    if encoding is not None:
+        body = compress(body, encoding)
+        headers['Content-Encoding'] = encoding
+    return Response(content=body, media_type=media_type, headers=headers)
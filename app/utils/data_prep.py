@@ -1,10 +1,8 @@
 import geopandas as gpd
 from geopandas import GeoDataFrame
-import pandas as pd
-from shapely.ops import unary_union
-from sklearn.cluster import KMeans
-from fastapi import Request
-from app.services import get_geojson
+from app.utils.clustering import cluster_engine, sample_representatives
+from app.services import Layer
+from app.services.layer_service import point_coords
 
 def generate_search_buffer(activity_line: GeoDataFrame, search_radius: int):
     """
@@ -17,73 +15,53 @@ def generate_search_buffer(activity_line: GeoDataFrame, search_radius: int):
 
 
 
-def search_nearby_items(search_gdf: GeoDataFrame, item_gdf: GeoDataFrame, avoidance: bool):
-    """ Search for nearby POIs, amenities and obstacles in a given search radius
+def search_nearby_items(search_gdf: GeoDataFrame, item_layer: Layer):
+    """ Search for nearby POIs and amenities in a given search radius
     
     Args:
-     - activity_line (GeoDataFrame): GDF of the Euclidean line between the Start/End points, which showcases where the buffer should extend from
-     - search_radius (int): Search radius buffer distance around activity line
-     - item_gdf (GeoDataframe): GDF passed in to conduct the search on
+     - search_gdf (GeoDataFrame): GDF of the search buffer around the activity line, from generate_search_buffer
+     - item_layer (Layer): Indexed layer passed in to conduct the search on
 
     """
-    intersecting_item_gdf = gpd.sjoin(item_gdf, search_gdf, how='inner', predicate='intersects')
-    intersecting_item_gdf.drop(columns=['index_right'], inplace=True)
+    candidate_idx = item_layer.query_corridor(search_gdf.geometry.iloc[0])
+    return item_layer.take(candidate_idx)
 
-    # Add a distance attribute (shows distance of nearby items)
 
-    if not avoidance:
-        return intersecting_item_gdf
-
-    avoidance_buffer = intersecting_item_gdf.buffer(10, resolution=16)
-    unified_geometry = unary_union(avoidance_buffer)
-    return gpd.GeoDataFrame(geometry=[unified_geometry], crs='EPSG:3414')
-
-
-def find_clusters(item_gdf: GeoDataFrame, num_clusters: int):
-    """ Generates clusters of points if number of items in GeoDataFrame is larger than num_clusters.
+def assign_clusters(item_gdf: GeoDataFrame, num_clusters: int, cache_key: tuple = None):
+    """ Labels each item with a cluster over its coordinates, in a 'cluster' column.
 
     Args: 
     - item_gdf (GeoDataFrame): GDF to perform clustering on
     - num_clusters (int): Number of clusters to be generated
-    
+    - cache_key (tuple): Corridor and layer set the items came from, so labels are reused across attempts and requests
+
     """
     if len(item_gdf) <= num_clusters:
         item_gdf['cluster'] = 1 # set all items into same cluster
         return item_gdf
 
-    # Perform K means on coordinates
-    coords = item_gdf.geometry.apply(lambda geom: [geom.x, geom.y]).tolist()
-    kmeans = KMeans(n_clusters=num_clusters, n_init=10).fit(coords)
-    item_gdf['cluster'] = kmeans.labels_
-
-    # Randomly select one POI from each cluster
-    selected_items = item_gdf.groupby('cluster').apply(lambda x: x.sample(1)).reset_index(drop=True).to_crs(epsg=4326)
-    return selected_items
+    item_gdf['cluster'] = cluster_engine.labels(point_coords(item_gdf), num_clusters, cache_key)
+    return item_gdf
 
 
-def concat_poi_gdf(file_keys: list, request: Request):
-    """ Concatenates GeoDataFrames for the given file keys using the loaded geojson_files.
+def find_clusters(item_gdf: GeoDataFrame, num_clusters: int, cache_key: tuple = None):
+    """ Generates clusters of points if number of items in GeoDataFrame is larger than num_clusters.
 
-    Args:
-    - file_keys (list): List of keys to call and pull the GeoJSON from application state
+    Clustering is cached per cache_key, so repeated attempts only re-sample the representatives.
 
-    Returns:
-    - concatenated_gdf (GeoDataFrame): A combined GDF of the multiple GDFs pulled and passed in
+    Args: 
+    - item_gdf (GeoDataFrame): GDF to perform clustering on
+    - num_clusters (int): Number of clusters to be generated
+    - cache_key (tuple): Corridor and layer set the items came from
     
     """
-    if file_keys == [] or file_keys == None:
-        return None
-    
-    gdfs = []
-    for key in file_keys:
-        try:
-            gdfs.append(gpd.read_file(get_geojson(key, request)).to_crs('EPSG:3414'))
-        except:
-            print(f"Warning: {key} not found in memory.")
-            pass
-
-    concatenated_gdf = pd.concat(gdfs, ignore_index=True)
-    concatenated_gdf.crs = 'EPSG:3414'
-    return concatenated_gdf
+    if len(item_gdf) <= num_clusters:
+        item_gdf['cluster'] = 1 # set all items into same cluster
+        return item_gdf
 
+    assign_clusters(item_gdf, num_clusters, cache_key)
 
+    # Randomly select one POI from each cluster
+    selected_idx = sample_representatives(item_gdf['cluster'].to_numpy())
+    selected_items = item_gdf.iloc[selected_idx].reset_index(drop=True).to_crs(epsg=4326)
+    return selected_items
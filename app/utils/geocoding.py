@@ -0,0 +1,108 @@
+import logging
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from app.utils.router import Router
+
+logger = logging.getLogger(__name__)
+
+
+class ReverseGeocoder:
+    """ Deduplicating, caching reverse geocoder for start and end points.
+
+    Names are cached by coordinate snapped to `precision` decimal places in a bounded LRU.
+    Concurrent lookups of the same snapped point share one in-flight OneMap call, so a request
+    whose start equals its end costs a single round trip. If OneMap does not answer within
+    `timeout`, or has no building name, the nearest loaded POI name is used instead while the
+    OneMap call finishes in the background and fills the cache for the next request. Points
+    OneMap has no building name for are cached as such for `negative_ttl`, so outdoor starts such
+    as parks and MRT exits do not ask OneMap again on every request; failed calls are not cached.
+
+    Args:
+    - route_client (Router): Shared routing backend, whose reverse_geocode is used for building names
+    - max_size (int): Maximum number of cached names
+    - precision (int): Decimal places coordinates are snapped to (4 is roughly 11 m)
+    - timeout (float): Seconds to wait on OneMap before falling back to a local name
+    - fallback_radius (float): Metres within which a loaded POI name may be used as a fallback
+    - negative_ttl (float): Seconds a point without a building name is remembered as such
+    """
+
+    def __init__(self, route_client: Router, max_size: int = 5000, precision: int = 4, timeout: float = 2.0, fallback_radius: float = 150, negative_ttl: float = 600):
+        self.route_client = route_client
+        self.max_size = max_size
+        self.precision = precision
+        self.timeout = timeout
+        self.fallback_radius = fallback_radius
+        self.negative_ttl = negative_ttl
+        # Snapped point -> (building name or None, time the entry expires or None)
+        self._names = OrderedDict()
+        self._inflight = {}
+
+    @classmethod
+    def from_env(cls, route_client: Router) -> "ReverseGeocoder":
+        return cls(
+            route_client,
+            max_size=int(os.getenv("GEOCODE_CACHE_SIZE", 5000)),
+            timeout=float(os.getenv("GEOCODE_TIMEOUT", 2.0)),
+            negative_ttl=float(os.getenv("GEOCODE_NEGATIVE_TTL", 600))
+        )
+
+    def key(self, point) -> tuple:
+        return (round(point.x, self.precision), round(point.y, self.precision))
+
+    async def name(self, point, layer_store=None, default: str = None) -> str:
+        """ Returns a display name for a long/lat point.
+
+        Args:
+        - point (Point): Location in long/lat
+        - layer_store (LayerStore): Store used for the nearest-POI fallback
+        - default (str): Name used if neither OneMap nor the fallback has one
+
+        Returns:
+        - name (str): Building name, nearest POI name or default
+        """
+        key = self.key(point)
+        entry = self._names.get(key)
+        if entry is not None and entry[1] is not None and entry[1] < time.monotonic():
+            del self._names[key]
+            entry = None
+
+        if entry is not None:
+            self._names.move_to_end(key)
+            building_name = entry[0]
+        else:
+            task = self._inflight.get(key)
+            if task is None:
+                task = asyncio.create_task(self._fetch(key, point))
+                self._inflight[key] = task
+
+            try:
+                building_name = await asyncio.wait_for(asyncio.shield(task), self.timeout)
+            except asyncio.TimeoutError:
+                building_name = None
+
+        if building_name:
+            return building_name
+
+        fallback_name = layer_store.nearest_name(point, self.fallback_radius) if layer_store is not None else None
+        return fallback_name or default
+
+    async def _fetch(self, key: tuple, point) -> str:
+        try:
+            building_name = await self.route_client.reverse_geocode(point)
+        except Exception as e:
+            logger.warning("Reverse geocode failed: %s", e)
+            return None
+        finally:
+            self._inflight.pop(key, None)
+
+        # OneMap returns NIL where it has no building name
+        if not building_name or building_name == "NIL":
+            self._names[key] = (None, time.monotonic() + self.negative_ttl)
+        else:
+            self._names[key] = (building_name, None)
+        self._names.move_to_end(key)
+        while len(self._names) > self.max_size:
+            self._names.popitem(last=False)
+        return self._names[key][0]
@@ -0,0 +1,149 @@
+import asyncio
+import os
+import queue
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+import shapely
+from shapely.geometry import LineString
+
+# Seconds the writer waits to gather legs before committing them to SQLite
+FLUSH_INTERVAL = 1.0
+
+# Most legs written in one commit
+FLUSH_BATCH_SIZE = 500
+
+
+class LegCache:
+    """ LRU/TTL cache of walking route legs, keyed by quantized start/end coordinates and route type.
+
+    Each entry holds the decoded LineString with the time and distance OneMap returned for it.
+    When a path is given, entries are also written to a local SQLite file so that popular legs
+    survive restarts; the in-memory LRU sits in front of it. Disk lookups run in a thread, and writes
+    are queued for a background writer that commits them in batches, so neither blocks the event loop.
+
+    Args:
+    - max_size (int): Maximum number of legs held in memory
+    - ttl (float): Seconds before a leg is considered stale, in memory and on disk
+    - precision (int): Decimal places coordinates are rounded to (5 is roughly 1 m)
+    - path (str): Optional SQLite file for persistence
+    """
+
+    def __init__(self, max_size: int = 10000, ttl: float = 7 * 24 * 3600, precision: int = 5, path: str = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.precision = precision
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._db = None
+        self._db_lock = threading.Lock()
+        self._writes = queue.Queue()
+        self._writer = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS legs (key TEXT PRIMARY KEY, geometry BLOB, time REAL, distance REAL, created REAL)"
+            )
+            self._db.commit()
+            self._writer = threading.Thread(target=self._write_loop, name="leg-cache-writer", daemon=True)
+            self._writer.start()
+
+    @classmethod
+    def from_env(cls) -> "LegCache":
+        return cls(
+            max_size=int(os.getenv("LEG_CACHE_SIZE", 10000)),
+            ttl=float(os.getenv("LEG_CACHE_TTL", 7 * 24 * 3600)),
+            path=os.getenv("LEG_CACHE_PATH")
+        )
+
+    def key(self, start, end, route_type: str = "walk") -> str:
+        p = self.precision
+        return f"{route_type}:{round(start.x, p)},{round(start.y, p)}:{round(end.x, p)},{round(end.y, p)}"
+
+    async def get(self, start, end, route_type: str = "walk"):
+        """ Returns the cached (LineString, time, distance) for a leg, or None on a miss.
+        """
+        key = self.key(start, end, route_type)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry[0] > self.ttl:
+                del self._entries[key]
+                entry = None
+        if entry is None and self._db is not None:
+            entry = await asyncio.to_thread(self._load, key, now)
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self._store(key, entry)
+            self.hits += 1
+            return entry[1:]
+
+    def put(self, start, end, route_geometry: LineString, route_time: float, route_distance: float, route_type: str = "walk"):
+        """ Stores a successfully fetched leg. With persistence, the leg is queued for the writer thread.
+        """
+        key = self.key(start, end, route_type)
+        entry = (time.time(), route_geometry, route_time, route_distance)
+        with self._lock:
+            self._store(key, entry)
+        if self._writer is not None:
+            self._writes.put((key, shapely.to_wkb(route_geometry), route_time, route_distance, entry[0]))
+
+    def _store(self, key: str, entry: tuple):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def _load(self, key: str, now: float):
+        with self._db_lock:
+            if self._db is None:
+                return None
+            row = self._db.execute("SELECT geometry, time, distance, created FROM legs WHERE key = ?", (key,)).fetchone()
+        if row is None or now - row[3] > self.ttl:
+            return None
+        return (row[3], shapely.from_wkb(row[0]), row[1], row[2])
+
+    def _write_loop(self):
+        # Gathers queued legs for up to FLUSH_INTERVAL and commits them together; None stops the loop
+        stopping = False
+        while not stopping:
+            rows = [self._writes.get()]
+            deadline = time.monotonic() + FLUSH_INTERVAL
+            while len(rows) < FLUSH_BATCH_SIZE:
+                try:
+                    rows.append(self._writes.get(timeout=max(deadline - time.monotonic(), 0)))
+                except queue.Empty:
+                    break
+            stopping = None in rows
+            rows = [row for row in rows if row is not None]
+            if rows:
+                with self._db_lock:
+                    self._db.executemany("INSERT OR REPLACE INTO legs VALUES (?, ?, ?, ?, ?)", rows)
+                    self._db.commit()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "persistent": self._db is not None
+        }
+
+    def close(self):
+        # Lets the writer commit what is still queued before the file is closed
+        if self._writer is not None:
+            self._writes.put(None)
+            self._writer.join()
+            self._writer = None
+        if self._db is not None:
+            with self._db_lock:
+                self._db.close()
+                self._db = None
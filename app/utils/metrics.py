@@ -0,0 +1,110 @@
+import os
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Histogram, generate_latest
+from prometheus_client import multiprocess
+
+# Per-request counts are observed for these events on every traced request, including when they did not happen
+REQUEST_EVENTS = ("onemap_route", "onemap_geocode", "network_route", "bedrock", "cluster_iteration", "orienteering_confirmation")
+
+STAGE_SECONDS = Histogram(
+    "route_stage_seconds", "Time spent in each stage of the route and summary pipeline", ["stage"],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+)
+EVENTS = Counter("route_events_total", "External calls, cache hits and solver iterations", ["event"])
+REQUEST_EVENT_COUNTS = Histogram(
+    "route_request_events", "Events per traced request, e.g. OneMap calls per generated route", ["event"],
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100, 200)
+)
+REQUEST_SECONDS = Histogram("http_request_seconds", "Request latency per endpoint", ["method", "path", "status"])
+
+
+class RequestTrace:
+    """ Stage timings and event counts of one request.
+
+    A trace is bound to the request through a context variable. Tasks and worker threads
+    started by the request copy that context, so they all add to the same trace.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = defaultdict(float)
+        self.counts = defaultdict(int)
+
+    def __bool__(self) -> bool:
+        return bool(self.stages or self.counts)
+
+    def server_timing(self) -> str:
+        """ Stage durations as a Server-Timing header value, in milliseconds.
+        """
+        return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.stages.items())
+
+    def count_header(self) -> str:
+        return ", ".join(f"{name}={n}" for name, n in self.counts.items())
+
+
+_current_trace = ContextVar("route_trace", default=None)
+
+
+def start_trace() -> RequestTrace:
+    """ Starts a trace for the current request context and returns it.
+    """
+    trace = RequestTrace()
+    _current_trace.set(trace)
+    return trace
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+@contextmanager
+def stage(name: str):
+    """ Times the enclosed block into route_stage_seconds and, if one is active, the request trace.
+
+    Stages may nest (full_route includes leg_wait and backtrack), and stages of concurrent
+    tasks add up, so a trace's stage totals can exceed the request's wall time.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.labels(name).observe(elapsed)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.stages[name] += elapsed
+
+
+def count(event: str, n: int = 1):
+    """ Counts an event into route_events_total and, if one is active, the request trace.
+    """
+    EVENTS.labels(event).inc(n)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.counts[event] += n
+
+
+def observe_request(trace: RequestTrace, method: str, path: str, status: int):
+    """ Records the request latency and, for requests that touched the pipeline, its per-request event counts.
+    """
+    REQUEST_SECONDS.labels(method, path, str(status)).observe(time.perf_counter() - trace.started)
+    if not trace:
+        return
+    for event in set(REQUEST_EVENTS).union(trace.counts):
+        REQUEST_EVENT_COUNTS.labels(event).observe(trace.counts.get(event, 0))
+
+
+def latest_metrics() -> tuple:
+    """ Returns the metrics in the Prometheus text format, with their content type.
+
+    With PROMETHEUS_MULTIPROC_DIR set (several uvicorn/gunicorn workers), the metrics of every
+    worker are aggregated from that directory.
+    """
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -1,108 +1,146 @@
-import requests
+import logging
+import asyncio
+import httpx
 import os
 import polyline
-from dotenv import load_dotenv, set_key
+from dotenv import set_key
 from shapely.geometry import LineString
+from app.utils.leg_cache import LegCache
+from app.utils.metrics import stage, count
 
+logger = logging.getLogger(__name__)
 
-def regenerate_api_key():
-    """Regenerates the OneMap API Key if expired.
+ONEMAP_BASE_URL = "https://www.onemap.gov.sg"
 
-    Args: None
 
-    Returns: None
-    
+def decode_route_geometry(route_geometry: str) -> LineString:
+    """ Decodes a OneMap encoded polyline (lat/long) into a LineString in long/lat format.
     """
-    
-    load_dotenv(dotenv_path=".env.production")
+    return LineString([(lon, lat) for lat, lon in polyline.decode(route_geometry)])
 
-    # Define the URL for the API token request
-    url = "https://www.onemap.gov.sg/api/auth/post/getToken"
 
-    # Load email and password from environment variables
-    payload = {
-        "email": os.getenv('ONEMAP_EMAIL'),
-        "password": os.getenv('ONEMAP_PASSWORD')
-    }
-
-    # Send the request to get the token
-    response = requests.post(url, json=payload)
-    
-    if response.status_code == 200:
-        api_key = response.json().get('access_token')
-
-        if api_key:
-            # Write the API key to the .env.production file
-            set_key(".env.production", 'ONEMAP_API_KEY', api_key)
-            print("API key successfully stored in .env.production")
-        else:
-            print("API key not found in the response")
-    else:
-        print(f"Failed to fetch API key. Status code: {response.status_code}")
+def encode_route_geometry(route_line: LineString, precision: int = 5) -> str:
+    """ Encodes a long/lat LineString as a polyline (lat/long), the inverse of decode_route_geometry.
+    """
+    return polyline.encode([(lat, lon) for lon, lat in route_line.coords], precision)
 
 
+class OneMapClient:
+    """ Async OneMap client sharing one keep-alive connection pool across all requests.
 
-def get_route_OneMapAPI(start, end):
-    """ Calls the OneMap API to get the route between two points.
+    Concurrency towards OneMap is bounded by a semaphore, every call has a timeout, and an
+    expired API key is refreshed once (under a lock) before the call is retried.
 
     Args:
-     - start (): Starting point of the route
-     - end (): Ending point of the route
-    
-    Returns:
-     - flipped_route_line (LineString): Route generated with coordinates in long/lat format
-     - time (str): Time estimated by OneMap API to complete the route
-     - distance (str): Distance of route generated
-
+    - max_connections (int): Size of the shared connection pool
+    - max_concurrency (int): Maximum number of in-flight OneMap calls
+    - timeout (float): Per-call timeout in seconds
+    - transport (httpx.AsyncBaseTransport): Optional transport, e.g. a mock for benchmarks
+    - leg_cache (LegCache): Optional cache consulted before any route call
     """
-    load_dotenv()
-    print("point coordinates as follows")
-    print(start.y, start.x, end.y, end.x)
-
-    attempted = False
-    while not attempted:
-        url = f"https://www.onemap.gov.sg/api/public/routingsvc/route?start={start.y}%2C{start.x}&end={end.y}%2C{end.x}&routeType=walk"
-        headers = {"Authorization": os.getenv("ONEMAP_API_KEY")}
-        print("pinged onemap api")
-        response = requests.request("GET", url, headers=headers)
-        if response.status_code == 401:
-            regenerate_api_key()
-            print("pinging for new key")
-            continue
+
+    def __init__(self, max_connections: int = 20, max_concurrency: int = 10, timeout: float = 10.0, transport: httpx.AsyncBaseTransport = None, leg_cache: LegCache = None):
+        self._client = httpx.AsyncClient(
+            base_url=ONEMAP_BASE_URL,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            timeout=httpx.Timeout(timeout),
+            transport=transport
+        )
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._token_lock = asyncio.Lock()
+        self._api_key = os.getenv("ONEMAP_API_KEY")
+        self.leg_cache = leg_cache
+
+    @classmethod
+    def from_env(cls) -> "OneMapClient":
+        return cls(
+            max_connections=int(os.getenv("ONEMAP_MAX_CONNECTIONS", 20)),
+            max_concurrency=int(os.getenv("ONEMAP_MAX_CONCURRENCY", 10)),
+            timeout=float(os.getenv("ONEMAP_TIMEOUT", 10.0)),
+            leg_cache=LegCache.from_env()
+        )
+
+    async def aclose(self):
+        await self._client.aclose()
+        if self.leg_cache is not None:
+            self.leg_cache.close()
+
+    async def _refresh_api_key(self, rejected_key: str):
+        async with self._token_lock:
+            # Another call may already have refreshed the key while we waited
+            if self._api_key != rejected_key:
+                return
+            payload = {
+                "email": os.getenv('ONEMAP_EMAIL'),
+                "password": os.getenv('ONEMAP_PASSWORD')
+            }
+            response = await self._client.post("/api/auth/post/getToken", json=payload)
+            api_key = response.json().get('access_token') if response.status_code == 200 else None
+            if not api_key:
+                logger.error("Failed to fetch API key. Status code: %s", response.status_code)
+                return
+            self._api_key = api_key
+            os.environ['ONEMAP_API_KEY'] = api_key
+            await asyncio.to_thread(set_key, ".env.production", 'ONEMAP_API_KEY', api_key)
+            logger.info("API key successfully stored in .env.production")
+
+    async def _get(self, path: str, params: dict) -> httpx.Response:
+        async with self._semaphore:
+            for _ in range(2):
+                api_key = self._api_key
+                response = await self._client.get(path, params=params, headers={"Authorization": api_key or ""})
+                if response.status_code != 401:
+                    break
+                logger.debug("OneMap API key rejected, requesting a new one")
+                count("onemap_key_refresh")
+                await self._refresh_api_key(api_key)
+        return response
+
+    async def get_route(self, start, end, route_type: str = "walk"):
+        """ Calls the OneMap API to get the route between two points.
+
+        Args:
+         - start (Point): Starting point of the route, in long/lat
+         - end (Point): Ending point of the route, in long/lat
+         - route_type (str): OneMap route type
+
+        Returns:
+         - route_line (LineString): Route generated with coordinates in long/lat format
+         - time (float): Time estimated by OneMap API to complete the route
+         - distance (float): Distance of route generated
+        """
+        if self.leg_cache is not None:
+            cached_leg = await self.leg_cache.get(start, end, route_type)
+            if cached_leg is not None:
+                count("leg_cache_hit")
+                return cached_leg
+
+        params = {"start": f"{start.y},{start.x}", "end": f"{end.y},{end.x}", "routeType": route_type}
+        count("onemap_route")
+        try:
+            with stage("onemap_call"):
+                response = await self._get("/api/public/routingsvc/route", params)
+        except httpx.HTTPError as e:
+            logger.error("OneMap route request failed: %s", e)
+            return None, None, None
 
         if response.status_code != 200:
-            print(f"Error: HTTP status code {response.status_code}")
-            print("Unexpected Error, check again")
+            logger.error("OneMap route request failed with HTTP status code %s", response.status_code)
             return None, None, None
-        
-        attempted = True
-    
-    data = response.json()
-    route_geometry = data['route_geometry']
-    time = data['route_summary']['total_time']
-    distance = data['route_summary']['total_distance']
-
-    # Converting route_geometry into a LineString feature
-    coordinates = polyline.decode(route_geometry)
-    route_line = LineString(coordinates)
-
-    # Change back from lat/long format to the long, lat 
-    flipped_coordinates = [(y, x) for x, y in route_line.coords]
-    flipped_route_line = LineString(flipped_coordinates)
-    print("Called OneMap API")
-    print(time, distance)
-    return flipped_route_line, time, distance
-
-def reverse_geocode(point):
-    load_dotenv()
-    url = f"https://www.onemap.gov.sg/api/public/revgeocode?location={point.y},{point.x}"
-    headers = {"Authorization": os.getenv("ONEMAP_API_KEY")}
-    response = requests.request("GET", url, headers=headers)
-    if response.status_code != 200:
-        print(f"Error: HTTP status code {response.status_code}")
-        print("Unexpected Error, check again")
-    return response.json()["GeocodeInfo"][0]["BUILDINGNAME"]
-
-
-
-    
\ No newline at end of file
+
+        data = response.json()
+        route_summary = data['route_summary']
+        route_line = decode_route_geometry(data['route_geometry'])
+        if self.leg_cache is not None:
+            self.leg_cache.put(start, end, route_line, route_summary['total_time'], route_summary['total_distance'], route_type)
+        return route_line, route_summary['total_time'], route_summary['total_distance']
+
+    async def reverse_geocode(self, point) -> str:
+        """ Returns the OneMap building name nearest to a long/lat point.
+        """
+        count("onemap_geocode")
+        with stage("onemap_call"):
+            response = await self._get("/api/public/revgeocode", {"location": f"{point.y},{point.x}"})
+        if response.status_code != 200:
+            logger.error("OneMap reverse geocode failed with HTTP status code %s", response.status_code)
+        return response.json()["GeocodeInfo"][0]["BUILDINGNAME"]
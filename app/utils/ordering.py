@@ -0,0 +1,113 @@
+import numpy as np
+
+
+def distance_matrix(coords: np.ndarray) -> np.ndarray:
+    """ Pairwise Euclidean distances between projected coordinates.
+
+    Args:
+    - coords (np.ndarray): (N, 2) coordinates in a projected CRS
+
+    Returns:
+    - dist (np.ndarray): (N, N) distance matrix
+    """
+    diff = coords[:, None, :] - coords[None, :, :]
+    return np.sqrt((diff ** 2).sum(axis=-1))
+
+
+def path_length(order: np.ndarray, dist: np.ndarray) -> float:
+    return float(dist[order[:-1], order[1:]].sum())
+
+
+def nearest_neighbor_order(dist: np.ndarray) -> np.ndarray:
+    """ Greedy nearest neighbour path from node 0 to node N-1, visiting every node in between.
+    """
+    n = len(dist)
+    if n <= 2:
+        return np.arange(n)
+
+    order = np.empty(n, dtype=np.int64)
+    order[0], order[-1] = 0, n - 1
+    visited = np.zeros(n, dtype=bool)
+    visited[[0, n - 1]] = True
+    for step in range(1, n - 1):
+        candidates = np.where(visited, np.inf, dist[order[step - 1]])
+        order[step] = np.argmin(candidates)
+        visited[order[step]] = True
+    return order
+
+
+def two_opt(order: np.ndarray, dist: np.ndarray) -> np.ndarray:
+    """ Reverses sub-paths while that shortens the path. The first and last nodes stay fixed.
+    """
+    order = order.copy()
+    n = len(order)
+    improved = True
+    while improved:
+        improved = False
+        for i in range(1, n - 2):
+            a, b = order[i - 1], order[i]
+            c, e = order[i + 1:n - 1], order[i + 2:n]
+            # Gain of reversing order[i:j+1] for every j > i at once
+            delta = dist[a, c] + dist[b, e] - dist[a, b] - dist[c, e]
+            j = int(np.argmin(delta))
+            if delta[j] < -1e-9:
+                order[i:i + j + 2] = order[i:i + j + 2][::-1]
+                improved = True
+    return order
+
+
+def or_opt(order: np.ndarray, dist: np.ndarray, max_segment: int = 3) -> np.ndarray:
+    """ Moves short runs of up to max_segment nodes to a cheaper position. The first and last nodes stay fixed.
+    """
+    order = order.copy()
+    improved = True
+    while improved:
+        improved = False
+        for length in range(1, max_segment + 1):
+            for i in range(1, len(order) - length):
+                segment = order[i:i + length]
+                prev_node, next_node = order[i - 1], order[i + length]
+                removal_gain = dist[prev_node, segment[0]] + dist[segment[-1], next_node] - dist[prev_node, next_node]
+
+                rest = np.concatenate([order[:i], order[i + length:]])
+                left, right = rest[:-1], rest[1:]
+                # Insertion cost at every gap, in either orientation
+                forward = dist[left, segment[0]] + dist[segment[-1], right] - dist[left, right]
+                backward = dist[left, segment[-1]] + dist[segment[0], right] - dist[left, right]
+                costs = np.minimum(forward, backward)
+                gap = int(np.argmin(costs))
+                if costs[gap] < removal_gain - 1e-9:
+                    inserted = segment if forward[gap] <= backward[gap] else segment[::-1]
+                    order = np.concatenate([rest[:gap + 1], inserted, rest[gap + 1:]])
+                    improved = True
+                    break
+            if improved:
+                break
+    return order
+
+
+def order_points(coords: np.ndarray, improve: bool = True) -> np.ndarray:
+    """ Orders points into a short path with a fixed start (first row) and end (last row).
+
+    Builds one distance matrix, seeds the order with nearest neighbour and, if improve is set,
+    refines it with 2-opt and Or-opt until neither finds a shorter path.
+
+    Args:
+    - coords (np.ndarray): (N, 2) projected coordinates, start first and end last
+    - improve (bool): Whether to run the 2-opt/Or-opt improvement pass
+
+    Returns:
+    - order (np.ndarray): Visiting order as indices into coords, starting with 0 and ending with N-1
+    """
+    dist = distance_matrix(coords)
+    order = nearest_neighbor_order(dist)
+    if not improve or len(order) <= 3:
+        return order
+
+    best_length = path_length(order, dist)
+    while True:
+        order = or_opt(two_opt(order, dist), dist)
+        new_length = path_length(order, dist)
+        if new_length >= best_length - 1e-9:
+            return order
+        best_length = new_length
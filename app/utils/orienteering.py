@@ -0,0 +1,123 @@
+import numpy as np
+from app.utils.ordering import distance_matrix, path_length, two_opt, or_opt
+
+# Walking routes are rarely more than this much longer than the straight line between their stops
+DETOUR_FACTOR = 1.3
+
+# Bonus, in multiples of the mean insertion cost, for visiting a cluster not yet on the route
+DIVERSITY_BONUS = 1.0
+
+# Most POIs a selection considers; the distance matrix and 2-opt passes grow with its square
+MAX_CANDIDATES = 400
+
+
+def solve_orienteering(start_xy, end_xy, poi_xy: np.ndarray, budget: float, max_points: int, clusters: np.ndarray = None, detour_factor: float = DETOUR_FACTOR, rng: np.random.Generator = None) -> np.ndarray:
+    """ Selects and orders POIs to visit between a fixed start and end within a distance budget.
+
+    Treats selection as an orienteering problem on cheap estimates: the walking length of a path
+    is taken as its Euclidean length times detour_factor. POIs are added by greedy cheapest insertion,
+    favouring clusters not yet on the route, and the path is re-optimised with 2-opt/Or-opt after
+    each insertion so later insertions see the shortest order. No router calls are made.
+
+    Args:
+    - start_xy, end_xy: Projected start and end coordinates
+    - poi_xy (np.ndarray): (N, 2) projected candidate POI coordinates
+    - budget (float): Maximum walking distance in metres
+    - max_points (int): Maximum number of POIs to select
+    - clusters (np.ndarray): Optional cluster label per POI, used to reward diversity
+    - detour_factor (float): Ratio of walking to straight-line distance assumed for estimates
+    - rng (np.random.Generator): Optional generator to randomise ties, for alternative selections
+
+    Returns:
+    - selected (np.ndarray): Indices into poi_xy in visiting order
+    """
+    num_pois = len(poi_xy)
+    if num_pois == 0 or max_points <= 0:
+        return np.array([], dtype=np.int64)
+
+    # Solve on the POIs that can fit in the budget at all, rather than on the whole corridor
+    keep = budget_candidates(start_xy, end_xy, poi_xy, budget / detour_factor, clusters)
+    if len(keep) < num_pois:
+        kept_clusters = clusters[keep] if clusters is not None else None
+        return keep[solve_orienteering(start_xy, end_xy, poi_xy[keep], budget, max_points, kept_clusters, detour_factor, rng)]
+
+    # Node 0 is the start, nodes 1..N the POIs and node N+1 the end
+    coords = np.vstack([np.asarray(start_xy)[None, :], poi_xy, np.asarray(end_xy)[None, :]])
+    dist = distance_matrix(coords) * detour_factor
+    end_node = num_pois + 1
+
+    order = np.array([0, end_node])
+    length = dist[0, end_node]
+    if length > budget:
+        return np.array([], dtype=np.int64)
+
+    unvisited = np.ones(num_pois + 2, dtype=bool)
+    unvisited[[0, end_node]] = False
+    visited_clusters = set()
+    noise = rng.uniform(0.9, 1.1, num_pois + 2) if rng is not None else np.ones(num_pois + 2)
+
+    while len(order) - 2 < max_points:
+        candidates = np.flatnonzero(unvisited)
+        if len(candidates) == 0:
+            break
+
+        # Cheapest insertion gap for every candidate at once
+        left, right = order[:-1], order[1:]
+        insertion = dist[left][:, candidates] + dist[candidates][:, right].T - dist[left, right][:, None]
+        gaps = np.argmin(insertion, axis=0)
+        costs = insertion[gaps, np.arange(len(candidates))]
+
+        feasible = length + costs <= budget
+        if not feasible.any():
+            break
+
+        scores = costs * noise[candidates]
+        if clusters is not None:
+            is_new_cluster = np.array([clusters[node - 1] not in visited_clusters for node in candidates])
+            scores = scores - DIVERSITY_BONUS * costs[feasible].mean() * is_new_cluster
+        scores[~feasible] = np.inf
+
+        best = int(np.argmin(scores))
+        node, gap = candidates[best], gaps[best]
+        order = np.concatenate([order[:gap + 1], [node], order[gap + 1:]])
+        unvisited[node] = False
+        if clusters is not None:
+            visited_clusters.add(clusters[node - 1])
+        order = or_opt(two_opt(order, dist), dist)
+        length = path_length(order, dist)
+
+    return order[1:-1] - 1
+
+
+def budget_candidates(start_xy, end_xy, poi_xy: np.ndarray, straight_budget: float, clusters: np.ndarray = None, max_candidates: int = MAX_CANDIDATES) -> np.ndarray:
+    """ Finds the POIs a route within the budget could visit, at most max_candidates of them.
+
+    A POI is reachable only if it lies inside the ellipse d(start, p) + d(p, end) <= straight_budget.
+    Past max_candidates, the POIs closest to the straight line are kept, taken in turn from each
+    cluster so that every cluster stays represented.
+
+    Args:
+    - start_xy, end_xy: Projected start and end coordinates
+    - poi_xy (np.ndarray): (N, 2) projected candidate POI coordinates
+    - straight_budget (float): Budget in straight-line metres, i.e. the walking budget over the detour factor
+    - clusters (np.ndarray): Optional cluster label per POI
+    - max_candidates (int): Most POIs to keep
+
+    Returns:
+    - keep (np.ndarray): Sorted indices into poi_xy
+    """
+    via = np.hypot(*(poi_xy - np.asarray(start_xy)).T) + np.hypot(*(poi_xy - np.asarray(end_xy)).T)
+    inside = np.flatnonzero(via <= straight_budget)
+    if len(inside) <= max_candidates:
+        return inside
+
+    order = inside[np.argsort(via[inside], kind='stable')]
+    if clusters is not None:
+        _, labels = np.unique(clusters[order], return_inverse=True)
+        # Position of each POI within its own cluster, closest to the straight line first
+        rank = np.empty(len(order), dtype=np.int64)
+        for label in range(labels.max() + 1):
+            members = labels == label
+            rank[members] = np.arange(members.sum())
+        order = order[np.argsort(rank, kind='stable')]
+    return np.sort(order[:max_candidates])
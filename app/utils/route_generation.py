@@ -1,26 +1,157 @@
+import logging
+import asyncio
+import os
 import geopandas as gpd
 from geopandas import GeoDataFrame
+import shapely
 from shapely.geometry import LineString, Point
 from app.models.schemas import UserData
+from app.services.layer_service import AvoidanceIndex, Layer, to_layer_crs, from_layer_crs
 import numpy as np
 import pandas as pd
 from dotenv import load_dotenv
-from app.utils.onemap import get_route_OneMapAPI, regenerate_api_key
+from app.utils.router import Router
+from app.utils.ordering import order_points
+from app.utils.metrics import stage, count
 
+logger = logging.getLogger(__name__)
 
 load_dotenv(".env.production")
 
-def generate_full_route(user_data: UserData, route_points_gdf: GeoDataFrame, nearby_poi_gdf: GeoDataFrame, nearby_amenities_gdf: GeoDataFrame, avoidance_buffer_gdf: GeoDataFrame):
-    # Function code as provided
+# Legs at least this long (in metres) get a toilet/amenity stop inserted when amenity is on
+CUT_OFF = 1000
 
+# 'point' inserts the amenity nearest the start of a long leg, 'leg' the one nearest the leg itself
+AMENITY_SEARCH = os.getenv("AMENITY_SEARCH", 'point')
+
+
+class LegScheduler:
+    """ Fetches route legs as shared asyncio tasks, so planned and speculative legs run concurrently.
+
+    prefetch_route starts every planned leg of the route at once, together with each point's leg to
+    the end point (needed on budget overflow and backtracking) and, when amenities are on, the legs
+    via each point's nearest amenity. get_route then just awaits the task for a leg, starting it
+    if it was not prefetched, so the budget/backtrack logic runs against results already in hand.
+
+    Args:
+    - route_client (Router): Routing backend used to fetch the legs
+    """
+
+    def __init__(self, route_client: Router):
+        self.route_client = route_client
+        self._legs = {}
+
+    @staticmethod
+    def _key(start, end) -> tuple:
+        return (start.x, start.y, end.x, end.y)
+
+    def prefetch(self, start, end):
+        key = self._key(start, end)
+        if key not in self._legs:
+            count("leg_fetch")
+            self._legs[key] = asyncio.create_task(self.route_client.get_route(start, end))
+        return self._legs[key]
+
+    async def get_route(self, start, end):
+        # Only the time the route logic is blocked on a leg; prefetched legs that are already done cost nothing here
+        with stage("leg_wait"):
+            return await self.prefetch(start, end)
+
+    def prefetch_route(self, route_points_gdf: GeoDataFrame, amenity_layer: Layer = None):
+        """ Starts all legs the route may need.
+
+        Args:
+        - route_points_gdf (GeoDataFrame): Ordered route points in EPSG:4326, start first and end last
+        - amenity_layer (Layer): Amenities to speculate detours to, or None
+        """
+        points = route_points_gdf.geometry.tolist()
+        end_point = points[-1]
+        for current_point, next_point in zip(points, points[1:]):
+            self.prefetch(current_point, next_point)
+        for point in points[:-1]:
+            self.prefetch(point, end_point)
+
+        if amenity_layer is None or len(amenity_layer) == 0:
+            return
+
+        # Only legs long enough to plausibly pass CUT_OFF on foot get an amenity detour fetched up front
+        projected_points = route_points_gdf.geometry.to_crs('EPSG:3414').tolist()
+        for i in range(len(points) - 2):
+            if projected_points[i].distance(projected_points[i + 1]) < 0.6 * CUT_OFF:
+                continue
+            inserted_amenity, _ = find_nearest_amenity(points[i], amenity_layer, leg_end=points[i + 1])
+            if inserted_amenity is None:
+                continue
+            self.prefetch(points[i], inserted_amenity.geometry)
+            self.prefetch(inserted_amenity.geometry, points[i + 1])
+
+    def cancel_pending(self):
+        """ Cancels speculative legs that were never needed and are still in flight.
+        """
+        for task in self._legs.values():
+            if not task.done():
+                task.cancel()
+            elif not task.cancelled():
+                task.exception()  # mark any failure as retrieved
+
+
+class SharedLegs:
+    """ Router that fetches each distinct leg once across several routes, e.g. the routes of a batch.
+
+    Every leg is a shared task that later requests for the same leg await. The tasks are shielded,
+    so a route cancelling its speculative legs does not cancel them for the other routes.
+
+    Args:
+    - route_client (Router): Routing backend the legs are fetched from
+    """
+
+    def __init__(self, route_client: Router):
+        self.route_client = route_client
+        self.leg_cache = route_client.leg_cache
+        self._legs = {}
+
+    async def get_route(self, start, end, route_type: str = "walk"):
+        key = (start.x, start.y, end.x, end.y, route_type)
+        task = self._legs.get(key)
+        if task is None:
+            task = self._legs[key] = asyncio.ensure_future(self.route_client.get_route(start, end, route_type))
+        else:
+            count("shared_leg")
+        return await asyncio.shield(task)
+
+    async def reverse_geocode(self, point) -> str:
+        return await self.route_client.reverse_geocode(point)
+
+    async def aclose(self):
+        """ Cancels legs still in flight; the wrapped backend stays open, as it belongs to the application.
+        """
+        for task in self._legs.values():
+            if not task.done():
+                task.cancel()
+            elif not task.cancelled():
+                task.exception()  # mark any failure as retrieved
+
+
+async def generate_full_route(user_data: UserData, route_points_gdf: GeoDataFrame, nearby_poi_gdf: GeoDataFrame, amenity_layer: Layer, avoidance_index: AvoidanceIndex, route_client: Router):
     """ Final route generation function, which calls the OneMap API for all points and adds in amenities as needed.
+
+    All planned legs, each point's leg to the end and likely amenity detours are fetched concurrently
+    up front through a LegScheduler, then consumed in order by the budget and backtracking logic.
     
     """
+    legs = LegScheduler(route_client)
+    legs.prefetch_route(route_points_gdf, amenity_layer if user_data['amenity'] else None)
+    try:
+        return await _generate_full_route(user_data, route_points_gdf, nearby_poi_gdf, amenity_layer, avoidance_index, legs)
+    finally:
+        legs.cancel_pending()
+
+
+async def _generate_full_route(user_data: UserData, route_points_gdf: GeoDataFrame, nearby_poi_gdf: GeoDataFrame, amenity_layer: Layer, avoidance_index: AvoidanceIndex, legs: LegScheduler):
 
     # Initialise values and variables
     max_route_length = user_data["max_route_length"]
     i = 0
-    CUT_OFF = 1000
     # selected_pois, nearby_pois, nearby_amenities = selected_pois.copy(), nearby_pois.copy(), nearby_amenities.copy()
     metadata = {
         "route_points_gdf" : route_points_gdf,
@@ -29,185 +160,119 @@ def generate_full_route(user_data: UserData, route_points_gdf: GeoDataFrame, nea
         "route_times": [],
         "route_distances" : [],
         "total_time" : 0,
-        "total_distance": 0
+        "total_distance": 0,
+        "truncated": False
 
     }
 
     last_amenity_idx, avoidance_check_attempts = -1, 0
-    print("original route points gdf")
-    print(route_points_gdf)
+    logger.debug("Original route points:\n%s", route_points_gdf)
 
     end_point_gdf = metadata["route_points_gdf"].iloc[[-1]]
     end_point = end_point_gdf.geometry.iloc[0]
-    print(f"END POINT")
-    print(end_point)
     
     while i < len(metadata["route_points_gdf"]) - 1:
-        print(f"Route {i}")
         current_point_gdf = metadata["route_points_gdf"].iloc[[i]]
         next_point_gdf = metadata["route_points_gdf"].iloc[[i + 1]]
 
         current_point = current_point_gdf.geometry.iloc[0]
         next_point = next_point_gdf.geometry.iloc[0]
 
-        print(f"Attempting to find route between {current_point_gdf['NAME'].iloc[0]} and {next_point_gdf['NAME'].iloc[0]}")
+        logger.debug("Leg %s: finding route between %s and %s", i, current_point_gdf['NAME'].iloc[0], next_point_gdf['NAME'].iloc[0])
 
         # Get the route geometry from OneMap API
-        route_geometry, latest_time, latest_distance = get_route_OneMapAPI(current_point, next_point)
+        route_geometry, latest_time, latest_distance = await legs.get_route(current_point, next_point)
 
         # Attempt to finish the walking trail and backtrack if needed
         if metadata["total_distance"] + latest_distance >= max_route_length:
-            route_geometry, latest_time, latest_distance = get_route_OneMapAPI(current_point, end_point)
+            metadata["truncated"] = True
+            route_geometry, latest_time, latest_distance = await legs.get_route(current_point, end_point)
 
             if latest_distance + metadata["total_distance"] < max_route_length:
-                print("final points gdf")
-                print(metadata['final_points_gdf_list'])
-                print("final geoms")
-                print(metadata["final_route_geometry"])
-                print("final gdf")
-                print(metadata["route_points_gdf"] )
-                print("total time")
-                print(metadata["total_time"])
-                print("total distance")
-                print(metadata["total_distance"])
+                logger.debug("Budget reached at leg %s, heading straight to the end point", i)
                 metadata = update_metadata(i, metadata, end_point_gdf, route_geometry, latest_time, latest_distance)
-                print("--------------------------------------------------------------------------------------")
-                print("final points gdf")
-                print(metadata['final_points_gdf_list'])
-                print("final geoms")
-                print(metadata["final_route_geometry"])
-                print("final gdf")
-                print(metadata["route_points_gdf"] )
-                print("total time")
-                print(metadata["total_time"])
-                print("total distance")
-                print(metadata["total_distance"])
-                print("--------------------------------------------------------------------------------------")
                 final_gdf = gpd.GeoDataFrame(pd.concat(metadata['final_points_gdf_list'], ignore_index=True)).to_crs("EPSG:4326")
-                print("--------- FINAL GDF --------")
-                print(final_gdf)
                 break
 
-            metadata = handle_backtrack(i, metadata, end_point_gdf, max_route_length)
-            print("returned to main generate route function")
+            logger.debug("Budget reached at leg %s, backtracking", i)
+            with stage("backtrack"):
+                metadata = await handle_backtrack(i, metadata, end_point_gdf, max_route_length, legs)
             final_gdf = gpd.GeoDataFrame(pd.concat(metadata['final_points_gdf_list'], ignore_index=True)).to_crs("EPSG:4326")
-            print("--------- FINAL GDF --------")
-            print(final_gdf)
+            logger.debug("Final route points:\n%s", final_gdf)
             return final_gdf, metadata
-            
-            if metadata['total_distance'] == 0:
-                return None, None
-            
-            print(route_points_gdf)
-            # reassign current point and next points to the new metadata values
-            current_point_gdf = metadata["route_points_gdf"].iloc[[i]]
-            next_point_gdf = metadata["route_points_gdf"].iloc[[i + 1]]
-
-            current_point = current_point_gdf.geometry.iloc[0]
-            next_point = next_point_gdf.geometry.iloc[0]
 
         # Add an amenity if the distance between points is too long
         # Does not yet check if there is a barrier free route to amenity
-        if user_data['amenity'] and latest_distance >= CUT_OFF and (next_point != end_point):
-            inserted_amenity, _ = find_nearest_amenity(current_point_gdf, nearby_amenities_gdf)
-            route_geometry_to_amenity, time_to_amenity, distance_to_amenity = get_route_OneMapAPI(current_point, inserted_amenity.geometry)
-            route_geometry_after_amenity, time_after_amenity, distance_from_amenity = get_route_OneMapAPI(inserted_amenity.geometry, next_point)
-
-            if distance_to_amenity + distance_from_amenity + metadata['total_distance'] < max_route_length:
-                print("adding amenity")
-                print(i)
-                print(inserted_amenity)
-                print(route_geometry_to_amenity)
-                print(time_to_amenity)
-                print(distance_to_amenity)
-
-                amenity_gdf = gpd.GeoDataFrame({
-                    "DESCRIPTION": None,  # Assuming DESCRIPTION is NaN or not provided
-                    "NAME": [inserted_amenity["NAME"]],
-                    "PHOTOURL": None,  # Assuming PHOTOURL is NaN or not provided
-                    "TYPE": [inserted_amenity["TYPE"]],
-                    "cluster": None,  # Assuming cluster is NaN or not provided
-                    "geometry": [inserted_amenity["geometry"]],
-                    "distance": [inserted_amenity["distance"]]
-                }, geometry="geometry")
-
-                print("amenity gdf ---------")
-                print(amenity_gdf)
-                print("adding amenity_gdf into metadata")
-                metadata = update_metadata(i, metadata, amenity_gdf, route_geometry_to_amenity, time_to_amenity, distance_to_amenity)
-                metadata = update_metadata(i, metadata, next_point_gdf, route_geometry_after_amenity, time_after_amenity, distance_from_amenity)
-                avoidance_check_attempts = 0
-                i += 1
-                continue
+        if user_data['amenity'] and amenity_layer is not None and len(amenity_layer) > 0 and latest_distance >= CUT_OFF and (next_point != end_point):
+            inserted_amenity, _ = find_nearest_amenity(current_point, amenity_layer, leg_end=next_point)
+            # No amenity in reach: keep the direct leg
+            if inserted_amenity is not None:
+                (route_geometry_to_amenity, time_to_amenity, distance_to_amenity), (route_geometry_after_amenity, time_after_amenity, distance_from_amenity) = await asyncio.gather(
+                    legs.get_route(current_point, inserted_amenity.geometry),
+                    legs.get_route(inserted_amenity.geometry, next_point)
+                )
+
+                if distance_to_amenity + distance_from_amenity + metadata['total_distance'] < max_route_length:
+                    logger.debug("Leg %s: adding amenity %s, %.0f m away", i, inserted_amenity["NAME"], distance_to_amenity)
+
+                    amenity_gdf = gpd.GeoDataFrame({
+                        "DESCRIPTION": None,  # Assuming DESCRIPTION is NaN or not provided
+                        "NAME": [inserted_amenity["NAME"]],
+                        "PHOTOURL": None,  # Assuming PHOTOURL is NaN or not provided
+                        "TYPE": [inserted_amenity["TYPE"]],
+                        "cluster": None,  # Assuming cluster is NaN or not provided
+                        "geometry": [inserted_amenity["geometry"]],
+                        "distance": [inserted_amenity["distance"]]
+                    }, geometry="geometry", crs="EPSG:4326")
+
+                    metadata = update_metadata(i, metadata, amenity_gdf, route_geometry_to_amenity, time_to_amenity, distance_to_amenity)
+                    metadata = update_metadata(i, metadata, next_point_gdf, route_geometry_after_amenity, time_after_amenity, distance_from_amenity)
+                    avoidance_check_attempts = 0
+                    i += 1
+                    continue
         
-        print("Checking for barrier free")
         # Check whether it hits avoidance buffers and replace the destination if needed
-        if user_data['barrier_free'] and avoidance_check_attempts <= 5 and i + 1 != len(route_points_gdf) - 1:
-            if route_geometry.intersects(avoidance_buffer_gdf.unary_union):
-               route_points_gdf.iloc[[i+1]] = replace_destination(current_point_gdf, next_point_gdf, nearby_poi_gdf, nearby_amenities_gdf)[0]
+        if user_data['barrier_free'] and avoidance_index is not None and avoidance_check_attempts <= 5 and i + 1 != len(route_points_gdf) - 1:
+            if avoidance_index.intersects(route_geometry):
+               replacement_gdf = replace_destination(current_point_gdf, next_point_gdf, nearby_poi_gdf, amenity_layer)
+               route_points_gdf.iloc[i + 1] = replacement_gdf.reindex(columns=route_points_gdf.columns).iloc[0]
                avoidance_check_attempts += 1
                continue
                       
 
-        print(f"Route from {current_point_gdf['NAME'].iloc[0]} to {next_point_gdf['NAME'].iloc[0]}")
-
         # update metrics
-        print("Updating Metadata")
         metadata = update_metadata(i, metadata, next_point_gdf, route_geometry, latest_time, latest_distance)
-        print("Metadata Updated")
         avoidance_check_attempts = 0
         i += 1
 
-        print(metadata['final_points_gdf_list'])
         final_gdf = gpd.GeoDataFrame(pd.concat(metadata['final_points_gdf_list'], ignore_index=True)).to_crs("EPSG:4326")
     
     return final_gdf, metadata
 
 def nearest_neighbor_route(start_gdf: GeoDataFrame, points_gdf: GeoDataFrame, end_gdf: GeoDataFrame) -> GeoDataFrame:
     """
-    Generates a route by visiting the nearest unvisited point from the current point, starting from the start point(s).
-    Uses Euclidean distance in a projected coordinate system (EPSG:3414) for distance calculations.
+    Orders the points into a short walk from the start point to the end point.
+    Works on a NumPy array of EPSG:3414 coordinates with one precomputed distance matrix: the order is seeded
+    with nearest neighbour and improved with 2-opt/Or-opt, and the GeoDataFrame is only materialised at the end.
 
     Parameters:
-    - start_gdf (GeoDataFrame): GeoDataFrame containing the starting point(s).
+    - start_gdf (GeoDataFrame): GeoDataFrame containing the starting point.
     - points_gdf (GeoDataFrame): GeoDataFrame containing the points to visit.
+    - end_gdf (GeoDataFrame): GeoDataFrame containing the end point.
 
     Returns:
-    - route_points_gdf (GeoDataFrame): GeoDataFrame of points in the order they are visited in the route.
+    - route_points_gdf (GeoDataFrame): GeoDataFrame of points in EPSG:4326, in the order they are visited in the route.
     """
+    points_gdf = points_gdf.to_crs(epsg=4326)
+    coords = np.vstack([
+        shapely.get_coordinates(gdf.geometry.to_crs('EPSG:3414').values)
+        for gdf in (start_gdf, points_gdf, end_gdf)
+    ])
+    order = order_points(coords)
 
-    # Transform to projected CRS for accurate distance calculations
-    projected_crs = 'EPSG:3414'
-    start_gdf_proj = start_gdf.copy().to_crs(projected_crs)
-    points_gdf_proj = points_gdf.copy().to_crs(projected_crs)
-    end_gdf_proj = end_gdf.copy().to_crs(projected_crs)
-
-    # Combine columns from both GeoDataFrames
-    all_columns = start_gdf_proj.columns.union(points_gdf_proj.columns)
-
-    # Reindex both GeoDataFrames to have the same columns
-    route_points_gdf = start_gdf_proj.reindex(columns=all_columns, fill_value=np.nan)
-    remaining_points = points_gdf_proj.reindex(columns=all_columns, fill_value=np.nan)
-
-    while not remaining_points.empty:
-        # Nearest neighbours greedy alogirthm
-        # Get the last point in the current route
-        last_point = route_points_gdf.iloc[-1].geometry
-
-        # Extract coordinates and calculate distances
-        remaining_points['distance'] = remaining_points.geometry.apply(lambda x: last_point.distance(x))
-
-        # Take nearest point and append to route, then drop from remaining points
-        nearest_idx = remaining_points['distance'].idxmin()
-        nearest = remaining_points.loc[[nearest_idx]]
-        route_points_gdf = pd.concat([route_points_gdf, nearest], ignore_index=True)
-        remaining_points = remaining_points.drop(nearest_idx)
-
-    # Transform back to WGS84 (EPSG:4326) for mapping
-    route_points_gdf = pd.concat([route_points_gdf, end_gdf_proj], ignore_index=True)
-    route_points_gdf = route_points_gdf.to_crs(epsg=4326)
-
-    return route_points_gdf
+    # order[1:-1] indexes the stacked array, where the points to visit start at row 1
+    route_points_gdf = pd.concat([start_gdf, points_gdf.iloc[order[1:-1] - 1], end_gdf], ignore_index=True)
+    return gpd.GeoDataFrame(route_points_gdf, geometry='geometry', crs='EPSG:4326')
 
 def get_last_point(metadata):
     last_item = metadata['final_points_gdf_list'][-1]
@@ -222,76 +287,35 @@ def get_last_point(metadata):
         # If it's a Point object, access coordinates directly
         last_point = last_item
     else:
-        print(type(last_item))
-        raise ValueError("Unexpected type in final_points_gdf_list")
+        raise ValueError(f"Unexpected type in final_points_gdf_list: {type(last_item)}")
     
     return last_point
 
 
 
 
-def handle_backtrack(i: int, metadata: dict, end_point_gdf: GeoDataFrame, max_route_length: int):
+async def handle_backtrack(i: int, metadata: dict, end_point_gdf: GeoDataFrame, max_route_length: int, legs: LegScheduler):
 
     while len(metadata['final_points_gdf_list']) > 1:
+        count("backtrack_step")
         i -= 1
-        print("Backtracking by 1. Popping the last point:")
-        print(metadata['final_points_gdf_list'][-1])
-        print("check -----------")
-        print("existing points gdf")
-        print(metadata['final_points_gdf_list'])
-        print("existing geoms")
-        print(metadata["final_route_geometry"])
-        print("existing gdf")
-        print(metadata["route_points_gdf"] )
-        print("existing time")
-        print(metadata["total_time"])
-        print("existing distance")
-        print(metadata["total_distance"])
-        print("check -----------")
+        logger.debug("Backtracking by 1. Popping the last point:\n%s", metadata['final_points_gdf_list'][-1])
         metadata['final_points_gdf_list'].pop()
         metadata["final_route_geometry"].pop()
-        print(metadata["route_points_gdf"])
-        metadata["route_points_gdf"] = metadata["route_points_gdf"].drop(metadata["route_points_gdf"].index[i:] ,inplace=True) # remove the points from i onwards
+        metadata["route_points_gdf"] = metadata["route_points_gdf"].drop(metadata["route_points_gdf"].index[i:]) # remove the points from i onwards
         metadata["total_time"] -= metadata["route_times"].pop()
         metadata["total_distance"] -= metadata["route_distances"].pop()
-        
-        print("final points gdf")
-        print(metadata['final_points_gdf_list'])
-        print("final geoms")
-        print(metadata["final_route_geometry"])
-        print("final gdf")
-        print(metadata["route_points_gdf"] )
-        print("total time")
-        print(metadata["total_time"])
-        print("total distance")
-        print(metadata["total_distance"])
-
 
         last_point = get_last_point(metadata)
         end_point = end_point_gdf.geometry.iloc[0]
-        print("------")
-        print(f"last_point - {type(last_point)}")
-        print(last_point)
-        print(f"end_point - {type(last_point)}")
-        print(end_point)
-
-        route_geometry_to_end, time_to_end, distance_to_end = get_route_OneMapAPI(last_point, end_point)
-        print(f"i={i}")
-        print(metadata['total_distance'])
-        print(distance_to_end)
-        print(max_route_length)
+
+        route_geometry_to_end, time_to_end, distance_to_end = await legs.get_route(last_point, end_point)
+        logger.debug("i=%s: %.0f m walked, %.0f m to the end, %s m allowed", i, metadata['total_distance'], distance_to_end, max_route_length)
         if metadata["total_distance"] + distance_to_end < max_route_length:
-            print("entering if")
             metadata = update_metadata(i, metadata, end_point_gdf, route_geometry_to_end, time_to_end, distance_to_end)
-            print("--------------------------------------------------------------------------------------")
-            print(metadata)
-            print("--------------------------------------------------------------------------------------")
             return metadata
         
         # move to previous point
-        print("reached here")
-        print(metadata)
-        print(len(metadata['final_points_gdf_list']))
         
 
     return metadata
@@ -299,82 +323,79 @@ def handle_backtrack(i: int, metadata: dict, end_point_gdf: GeoDataFrame, max_ro
 
 
 
-def replace_destination(current_point_gdf, next_point_gdf, nearby_poi, nearby_amenity):
+def replace_destination(current_point_gdf, next_point_gdf, nearby_poi, amenity_layer: Layer):
 
-    print(f"Intersection Found. Route from {current_point_gdf['NAME'].iloc[0]} to {next_point_gdf['NAME'].iloc[0]} intersects with avoidance area. Reselecting route point.")
+    logger.warning("Intersection Found. Route from %s to %s intersects with avoidance area. Reselecting route point.", current_point_gdf['NAME'].iloc[0], next_point_gdf['NAME'].iloc[0])
 
     # if the next point is an amenity
     next_point_name = next_point_gdf['NAME'].iloc[0]
     next_point_geometry = next_point_gdf.geometry.iloc[0]
 
-    if next_point_name in ['Toilet', 'Drinking Water']:
-        remaining_nearby_amenity = nearby_amenity[nearby_amenity['geometry'] != next_point_geometry]
-        new_next_point_gdf = find_nearest_amenity(next_point_geometry, remaining_nearby_amenity)
+    if next_point_name in ['Toilet', 'Drinking Water'] and amenity_layer is not None:
+        # Exclude the amenity at the current destination and take the next nearest one
+        current_amenity_idx = amenity_layer.nearest(to_layer_crs(next_point_geometry).coords[0])
+        new_amenity, _ = find_nearest_amenity(next_point_geometry, amenity_layer, exclude=current_amenity_idx)
+        if new_amenity is None:
+            return next_point_gdf
+        new_next_point_gdf = gpd.GeoDataFrame([new_amenity], geometry='geometry', crs='EPSG:4326')
     else:
         cluster_num = next_point_gdf['cluster'].iloc[0]
-        remaining_nearby_poi = nearby_poi[nearby_poi['geometry'] != next_point_geometry]
+        remaining_nearby_poi = nearby_poi[nearby_poi['NAME'] != next_point_name]
         cluster_points = remaining_nearby_poi[remaining_nearby_poi['cluster'] == cluster_num]
 
         if len(cluster_points) >= 1:
             new_next_point_gdf = cluster_points.sample()
-        else:
+        elif len(remaining_nearby_poi) >= 1:
            new_next_point_gdf = remaining_nearby_poi.sample()
+        else:
+            return next_point_gdf
 
-    return new_next_point_gdf
+    return new_next_point_gdf.to_crs('EPSG:4326')
 
 def update_metadata(i: int, metadata: dict, point_gdf, route_geometry: LineString, latest_time, latest_distance):
-    try:
-        print(f"Updated Metadata with {point_gdf['NAME'].iloc[0]}")
-    except:
-        pass
-    print(f"i={i}")
-    print(point_gdf)
-    print("======")
-    print(metadata)
-    print("========")
+    # Formatting whole frames is expensive, so only do it when debug logging is actually on
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("i=%s: updated metadata with\n%s", i, point_gdf)
     
     # metadata["route_points_gdf"].loc[i] = point_gdf.iloc[0]
-    # print("success")
     metadata['final_points_gdf_list'].append(point_gdf)
-    print("success")
     metadata["final_route_geometry"].append(route_geometry)
-    print("success")
     metadata["route_times"].append(latest_time)
-    print("success")
     metadata["route_distances"].append(latest_distance)
-    print("success")
     metadata["total_time"] += latest_time
     metadata["total_distance"] += latest_distance
 
     return metadata
 
 
-def find_nearest_amenity(point_gdf, amenity_gdf):
+def find_nearest_amenity(point, amenity_layer: Layer, exclude=(), leg_end=None):
   """
-  Find the nearest amenity to a given point.
+  Find the nearest amenity to a given long/lat point using the amenity layer's prebuilt index.
+
+  Args:
+  - point (Point): Point to search from, in long/lat
+  - amenity_layer (Layer): Indexed amenity layer
+  - exclude: Positional indices of amenities that must not be returned
+  - leg_end (Point): If given and AMENITY_SEARCH is 'leg', search for the amenity nearest the leg from point to leg_end instead
+
+  Returns:
+  - nearest_amenity (Series): Amenity row with geometry in long/lat and a distance column, or None if there is none
+  - distance (float): Distance in metres from the point (or leg) to the amenity
   """
-  # Transform CRS to projected CRS to ensure accurate calculation
-  point_gdf = point_gdf.to_crs('EPSG:3414')
-
-  amenity_gdf = amenity_gdf.to_crs('EPSG:3414')
-
-  print(point_gdf.crs, amenity_gdf.crs)
-
-  # Find distance between point and amenity in amenity_gdf
-  amenity_gdf['distance'] = amenity_gdf.geometry.apply(lambda x: point_gdf.geometry.distance(x).min())
-  print(amenity_gdf)
-  # Find the minimum distance and the corresponding nearest amenity
-  amenity_gdf = amenity_gdf.to_crs('EPSG:4326')
-  point_gdf = point_gdf.to_crs('EPSG:4326')
-  nearest_amenity = amenity_gdf.loc[amenity_gdf['distance'].idxmin()]
-  print(nearest_amenity)
-  print(nearest_amenity.index)
-  distance = nearest_amenity['distance']
-
-  # Drop distance column
-  print('reached here')
-  amenity_gdf = amenity_gdf.drop('distance', axis=1)
-  
-
-  print(nearest_amenity)
-  return nearest_amenity, distance
\ No newline at end of file
+  xy = to_layer_crs(point).coords[0]
+  if leg_end is not None and AMENITY_SEARCH == 'leg':
+      leg_end_xy = to_layer_crs(leg_end).coords[0]
+      nearest_idx = amenity_layer.nearest_along(xy, leg_end_xy, exclude=exclude)
+      search_geometry = LineString([xy, leg_end_xy]) if xy != leg_end_xy else Point(xy)
+  else:
+      nearest_idx = amenity_layer.nearest(xy, exclude=exclude)
+      search_geometry = Point(xy)
+
+  if len(nearest_idx) == 0:
+      return None, None
+
+  nearest_amenity = amenity_layer.gdf.iloc[nearest_idx[0]].copy()
+  distance = nearest_amenity.geometry.distance(search_geometry)
+  nearest_amenity['geometry'] = from_layer_crs(nearest_amenity.geometry)
+  nearest_amenity['distance'] = distance
+  return nearest_amenity, distance
@@ -0,0 +1,43 @@
+from geopandas import GeoDataFrame
+from app.services.layer_service import AvoidanceIndex
+
+# Relative weight of each criterion in a route's total score
+SCORE_WEIGHTS = {
+    "distance_use": 1.0,
+    "poi_count": 1.0,
+    "diversity": 0.5,
+    "barrier_free": 2.0
+}
+
+
+def score_route(final_gdf: GeoDataFrame, metadata: dict, user_data: dict, avoidance_index: AvoidanceIndex = None) -> dict:
+    """ Scores a generated route for ranking against alternatives. Every criterion is between 0 and 1, higher is better.
+
+    - distance_use: share of max_route_length the route walks
+    - poi_count: share of num_POIs the route visits
+    - diversity: share of the visited POIs that come from distinct clusters
+    - barrier_free: share of legs clear of avoidance areas, 1 unless a barrier-free route was asked for
+
+    Args:
+    - final_gdf (GeoDataFrame): Route points as returned by generate_full_route
+    - metadata (dict): Route metadata as returned by generate_full_route
+    - user_data (UserData): The request the route was generated for
+    - avoidance_index (AvoidanceIndex): Avoidance areas, or None
+
+    Returns:
+    - score (dict): Each criterion and their weighted mean, as total
+    """
+    # Start, end and inserted amenities carry no cluster label
+    clusters = final_gdf['cluster'].dropna() if 'cluster' in final_gdf.columns else final_gdf.iloc[:0]
+    legs = [geom for geom in metadata['final_route_geometry'] if geom is not None]
+
+    score = {
+        "distance_use": min(metadata['total_distance'] / user_data['max_route_length'], 1.0) if user_data['max_route_length'] else 0.0,
+        "poi_count": min(len(clusters) / user_data['num_POIs'], 1.0) if user_data['num_POIs'] else 0.0,
+        "diversity": clusters.nunique() / len(clusters) if len(clusters) else 0.0,
+        "barrier_free": 1.0
+    }
+    if user_data['barrier_free'] and avoidance_index is not None and legs:
+        score["barrier_free"] = 1 - sum(avoidance_index.intersects(geom) for geom in legs) / len(legs)
+    score["total"] = sum(SCORE_WEIGHTS[name] * score[name] for name in SCORE_WEIGHTS) / sum(SCORE_WEIGHTS.values())
+    return score
@@ -0,0 +1,70 @@
+import logging
+import os
+from typing import Protocol
+from app.services.s3_service import fetch_object_bytes
+from app.utils.onemap import OneMapClient
+from app.utils.walk_network import WalkNetwork, NetworkRouter
+
+logger = logging.getLogger(__name__)
+
+
+class Router(Protocol):
+    """ Interface shared by every routing backend used by the route pipeline.
+
+    get_route returns (LineString in long/lat, time in seconds, distance in metres),
+    or (None, None, None) when no route could be found.
+    """
+
+    leg_cache: object
+
+    async def get_route(self, start, end, route_type: str = "walk"):
+        ...
+
+    async def reverse_geocode(self, point) -> str:
+        ...
+
+    async def aclose(self):
+        ...
+
+
+def network_layer_key():
+    """ Returns the bucket key of the walking network when it is loaded with the other layers, else None.
+    """
+    if os.getenv("ROUTER_BACKEND", "onemap") != "network" or os.getenv("WALK_NETWORK_PATH"):
+        return None
+    network_key = os.getenv("WALK_NETWORK_KEY")
+    return network_key if network_key and network_key.endswith('.geojson') else None
+
+
+def create_route_client(layer_frames: dict) -> Router:
+    """ Builds the routing backend selected by ROUTER_BACKEND.
+
+    - onemap (default): OneMapClient against the OneMap routing API
+    - network: NetworkRouter over a walking network loaded from WALK_NETWORK_PATH (a local file)
+      or WALK_NETWORK_KEY (an object in the S3 bucket), in GeoParquet or GeoJSON. A GeoJSON
+      network already loaded with the other layers is reused from layer_frames.
+
+    Args:
+    - layer_frames (dict): Every layer loaded at startup, as long/lat GeoDataFrames
+
+    Returns:
+    - route_client (Router): The selected backend
+    """
+    backend = os.getenv("ROUTER_BACKEND", "onemap")
+    if backend == "onemap":
+        return OneMapClient.from_env()
+    if backend != "network":
+        raise ValueError(f"Unknown ROUTER_BACKEND '{backend}'")
+
+    network_path, network_key = os.getenv("WALK_NETWORK_PATH"), os.getenv("WALK_NETWORK_KEY")
+    if network_path:
+        network = WalkNetwork.from_path(network_path)
+    elif network_key in layer_frames:
+        network = WalkNetwork.from_edges(layer_frames[network_key])
+    elif network_key:
+        network = WalkNetwork.from_bytes(network_key, fetch_object_bytes(network_key))
+    else:
+        raise ValueError("ROUTER_BACKEND=network requires WALK_NETWORK_PATH or WALK_NETWORK_KEY")
+
+    logger.info("Walking network loaded with %s nodes.", len(network))
+    return NetworkRouter(network)
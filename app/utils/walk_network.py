@@ -0,0 +1,232 @@
+import logging
+import asyncio
+import heapq
+import io
+import numpy as np
+import geopandas as gpd
+from geopandas import GeoDataFrame
+import shapely
+from pyproj import Transformer
+from scipy.spatial import cKDTree
+from shapely.geometry import LineString
+from app.utils.metrics import stage, count
+
+logger = logging.getLogger(__name__)
+
+NETWORK_CRS = 'EPSG:3414'
+
+# Average walking speed in metres per second, used to turn network distance into time
+WALKING_SPEED = 1.3
+
+# Edge endpoints closer than this (in metres) are treated as the same node
+NODE_PRECISION = 0.1
+
+_to_network_crs = Transformer.from_crs('EPSG:4326', NETWORK_CRS, always_xy=True)
+_from_network_crs = Transformer.from_crs(NETWORK_CRS, 'EPSG:4326', always_xy=True)
+
+
+class WalkNetwork:
+    """ Walking network held as a compact CSR adjacency graph in EPSG:3414.
+
+    Nodes are edge endpoints, snapped to NODE_PRECISION. For node u, its neighbours are
+    indices[indptr[u]:indptr[u + 1]], with edge lengths in weights and the source edge in edge_ids
+    (negative ids mean the edge is walked against its digitised direction). Routes are found
+    with A* using straight-line distance as the heuristic.
+
+    Args:
+    - node_xy (np.ndarray): (N, 2) projected node coordinates
+    - indptr (np.ndarray): CSR row pointers, length N + 1
+    - indices (np.ndarray): CSR neighbour node ids
+    - weights (np.ndarray): CSR edge lengths in metres
+    - edge_ids (np.ndarray): CSR signed edge ids, offset by one so that zero is never used
+    - edge_coords (np.ndarray): Packed (M, 2) projected vertex coordinates of every edge, in digitised direction
+    - edge_offsets (np.ndarray): Edge k's vertices are edge_coords[edge_offsets[k]:edge_offsets[k + 1]]
+    """
+
+    def __init__(self, node_xy: np.ndarray, indptr: np.ndarray, indices: np.ndarray, weights: np.ndarray, edge_ids: np.ndarray, edge_coords: np.ndarray, edge_offsets: np.ndarray):
+        self.node_xy = node_xy
+        self.indptr = indptr
+        self.indices = indices
+        self.weights = weights
+        self.edge_ids = edge_ids
+        self.edge_coords = edge_coords
+        self.edge_offsets = edge_offsets
+        self._node_tree = cKDTree(node_xy)
+
+    @classmethod
+    def from_edges(cls, edges_gdf: GeoDataFrame) -> "WalkNetwork":
+        """ Builds the graph from a GeoDataFrame of LineString walkway edges.
+        """
+        edges_gdf = edges_gdf.to_crs(NETWORK_CRS).explode(index_parts=False)
+        edges_gdf = edges_gdf[edges_gdf.geometry.geom_type == 'LineString']
+        edge_coords, vertex_edge = shapely.get_coordinates(edges_gdf.geometry.values, return_index=True)
+        num_edges = len(edges_gdf)
+        edge_offsets = np.zeros(num_edges + 1, dtype=np.int64)
+        np.cumsum(np.bincount(vertex_edge, minlength=num_edges), out=edge_offsets[1:])
+
+        # Interleave each edge's first and last vertex so that node_ids pairs up as (source, target)
+        endpoints = np.empty((2 * num_edges, 2))
+        endpoints[0::2] = edge_coords[edge_offsets[:-1]]
+        endpoints[1::2] = edge_coords[edge_offsets[1:] - 1]
+        snapped = np.round(endpoints / NODE_PRECISION).astype(np.int64)
+        _, first_idx, node_ids = np.unique(snapped, axis=0, return_index=True, return_inverse=True)
+        node_ids = node_ids.reshape(-1)
+        node_xy = endpoints[first_idx]
+
+        sources, targets = node_ids[0::2], node_ids[1::2]
+        lengths = np.asarray(shapely.length(edges_gdf.geometry.values), dtype=np.float64)
+        edge_numbers = np.arange(1, num_edges + 1)
+
+        # Undirected network: every edge is stored in both directions
+        all_sources = np.concatenate([sources, targets])
+        all_targets = np.concatenate([targets, sources])
+        all_weights = np.concatenate([lengths, lengths])
+        all_edge_ids = np.concatenate([edge_numbers, -edge_numbers])
+
+        order = np.argsort(all_sources, kind='stable')
+        indptr = np.zeros(len(node_xy) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(all_sources, minlength=len(node_xy)), out=indptr[1:])
+
+        return cls(
+            node_xy,
+            indptr,
+            all_targets[order].astype(np.int32),
+            all_weights[order],
+            all_edge_ids[order].astype(np.int32),
+            edge_coords,
+            edge_offsets
+        )
+
+    @classmethod
+    def from_bytes(cls, file_key: str, data: bytes) -> "WalkNetwork":
+        """ Builds the graph from the raw contents of a GeoParquet or GeoJSON edge file.
+        """
+        if file_key.endswith('.parquet'):
+            edges_gdf = gpd.read_parquet(io.BytesIO(data))
+        else:
+            edges_gdf = gpd.read_file(io.BytesIO(data))
+        return cls.from_edges(edges_gdf)
+
+    @classmethod
+    def from_path(cls, path: str) -> "WalkNetwork":
+        with open(path, 'rb') as f:
+            return cls.from_bytes(path, f.read())
+
+    def __len__(self) -> int:
+        return len(self.node_xy)
+
+    def nearest_node(self, xy) -> int:
+        _, node = self._node_tree.query(xy)
+        return int(node)
+
+    def shortest_path(self, source: int, target: int):
+        """ A* search between two node ids.
+
+        Returns:
+        - path (list): Signed edge ids walked from source to target, or None if unreachable
+        - distance (float): Network distance in metres
+        """
+        if source == target:
+            return [], 0.0
+
+        node_xy, indptr, indices, weights, edge_ids = self.node_xy, self.indptr, self.indices, self.weights, self.edge_ids
+        target_x, target_y = node_xy[target]
+
+        def heuristic(node):
+            x, y = node_xy[node]
+            return ((x - target_x) ** 2 + (y - target_y) ** 2) ** 0.5
+
+        best = {source: 0.0}
+        came_from = {}
+        frontier = [(heuristic(source), 0.0, source)]
+        while frontier:
+            _, cost, node = heapq.heappop(frontier)
+            if node == target:
+                break
+            if cost > best.get(node, np.inf):
+                continue
+            start, stop = indptr[node], indptr[node + 1]
+            for neighbour, weight, edge_id in zip(indices[start:stop].tolist(), weights[start:stop].tolist(), edge_ids[start:stop].tolist()):
+                new_cost = cost + weight
+                if new_cost < best.get(neighbour, np.inf):
+                    best[neighbour] = new_cost
+                    came_from[neighbour] = (node, edge_id)
+                    heapq.heappush(frontier, (new_cost + heuristic(neighbour), new_cost, neighbour))
+        else:
+            return None, None
+
+        path = []
+        node = target
+        while node != source:
+            node, edge_id = came_from[node]
+            path.append(edge_id)
+        path.reverse()
+        return path, best[target]
+
+    def route(self, start_xy, end_xy):
+        """ Routes between two projected points, walking to and from their nearest nodes.
+
+        Returns:
+        - coords (np.ndarray): Projected route coordinates, or None if unreachable
+        - distance (float): Route distance in metres
+        """
+        source, target = self.nearest_node(start_xy), self.nearest_node(end_xy)
+        path, network_distance = self.shortest_path(source, target)
+        if path is None:
+            return None, None
+
+        pieces = [np.asarray([start_xy])]
+        for edge_id in path:
+            edge = abs(edge_id) - 1
+            coords = self.edge_coords[self.edge_offsets[edge]:self.edge_offsets[edge + 1]]
+            pieces.append(coords if edge_id > 0 else coords[::-1])
+        pieces.append(np.asarray([end_xy]))
+        coords = np.concatenate(pieces)
+
+        access_distance = np.hypot(*(self.node_xy[source] - start_xy)) + np.hypot(*(self.node_xy[target] - end_xy))
+        return coords, network_distance + access_distance
+
+
+class NetworkRouter:
+    """ Offline router answering walking routes from a WalkNetwork, in the same shape as OneMapClient.get_route.
+
+    Searches run in a worker thread so the event loop stays free.
+
+    Args:
+    - network (WalkNetwork): Prebuilt walking network
+    """
+
+    leg_cache = None
+
+    def __init__(self, network: WalkNetwork):
+        self.network = network
+
+    async def get_route(self, start, end, route_type: str = "walk"):
+        """ Routes between two long/lat points on the walking network.
+
+        Returns:
+         - route_line (LineString): Route with coordinates in long/lat format
+         - time (float): Estimated walking time in seconds
+         - distance (float): Route distance in metres
+        """
+        count("network_route")
+        with stage("network_call"):
+            return await asyncio.to_thread(self._route, start, end)
+
+    def _route(self, start, end):
+        start_xy = np.array(_to_network_crs.transform(start.x, start.y))
+        end_xy = np.array(_to_network_crs.transform(end.x, end.y))
+        coords, distance = self.network.route(start_xy, end_xy)
+        if coords is None:
+            logger.error("No walking network path between points")
+            return None, None, None
+
+        lon, lat = _from_network_crs.transform(coords[:, 0], coords[:, 1])
+        return LineString(np.column_stack([lon, lat])), distance / WALKING_SPEED, distance
+
+    async def reverse_geocode(self, point):
+        # No offline building names; ReverseGeocoder falls back to the nearest loaded POI
+        return None
+
+    async def aclose(self):
+        pass
@@ -0,0 +1,78 @@
+# benchmarks/mock_onemap.py
+
+import asyncio
+import math
+from collections import Counter
+import httpx
+import numpy as np
+import polyline
+
+# Metres per degree of latitude and of longitude at Singapore's latitude
+METRES_PER_DEGREE = (110574.0, 111320.0 * math.cos(math.radians(1.35)))
+
+WALKING_SPEED = 1.3
+
+
+class MockOneMap:
+    """ Local stand-in for the OneMap routing, reverse geocoding and token endpoints.
+
+    Routes are a jittered polyline between the two points with a vertex every vertex_spacing
+    metres, encoded like OneMap's route_geometry, with a distance of detour_factor times the
+    straight-line distance. Every call is counted, and each one waits latency seconds first.
+
+    Args:
+    - latency (float): Seconds each call takes
+    - detour_factor (float): Ratio of routed to straight-line distance
+    - vertex_spacing (float): Metres between route vertices, so decoding costs what it does for real routes
+    - seed (int): Random seed for the route jitter
+    """
+
+    def __init__(self, latency: float = 0.05, detour_factor: float = 1.3, vertex_spacing: float = 25.0, seed: int = 0):
+        self.latency = latency
+        self.detour_factor = detour_factor
+        self.vertex_spacing = vertex_spacing
+        self.rng = np.random.default_rng(seed)
+        self.calls = Counter()
+
+    def transport(self) -> httpx.MockTransport:
+        """ Returns an httpx transport to hand to OneMapClient.
+        """
+        return httpx.MockTransport(self.handle)
+
+    def reset(self):
+        self.calls.clear()
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        path = request.url.path
+        if path.endswith('/routingsvc/route'):
+            self.calls['route'] += 1
+            start = [float(v) for v in request.url.params['start'].split(',')]
+            end = [float(v) for v in request.url.params['end'].split(',')]
+            return httpx.Response(200, json=self.route(start, end))
+        if path.endswith('/revgeocode'):
+            self.calls['revgeocode'] += 1
+            return httpx.Response(200, json={"GeocodeInfo": [{"BUILDINGNAME": f"BUILDING {request.url.params['location']}"}]})
+        if path.endswith('/getToken'):
+            self.calls['token'] += 1
+            return httpx.Response(200, json={"access_token": "benchmark-token"})
+        return httpx.Response(404, json={"error": f"Unknown path {path}"})
+
+    def route(self, start: list, end: list) -> dict:
+        """ Builds a OneMap-shaped route response between two (lat, lon) points.
+        """
+        straight_distance = math.hypot((end[0] - start[0]) * METRES_PER_DEGREE[0], (end[1] - start[1]) * METRES_PER_DEGREE[1])
+        distance = straight_distance * self.detour_factor
+        num_vertices = max(2, int(distance / self.vertex_spacing) + 1)
+        t = np.linspace(0, 1, num_vertices)
+        lat = start[0] + (end[0] - start[0]) * t
+        lon = start[1] + (end[1] - start[1]) * t
+        # Sideways jitter of up to a few metres, with the end points left in place
+        jitter = self.rng.uniform(-3e-5, 3e-5, (2, num_vertices))
+        jitter[:, [0, -1]] = 0
+        coords = list(zip((lat + jitter[0]).tolist(), (lon + jitter[1]).tolist()))
+        return {
+            "route_geometry": polyline.encode(coords),
+            "route_summary": {"total_time": distance / WALKING_SPEED, "total_distance": distance}
+        }
@@ -0,0 +1,214 @@
+# benchmarks/route_benchmark.py
+#
+# Offline benchmark of route_service.generate_route against synthetic layers and a mock OneMap:
+#   python -m benchmarks.route_benchmark --iterations 30 --latency 0.05
+#   python -m benchmarks.route_benchmark --label after --compare benchmarks/results/before.json
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import resource
+import subprocess
+import time
+import tracemalloc
+from types import SimpleNamespace
+import numpy as np
+from app.services import LayerStore, MemorySessionStore, generate_route
+from app.models.schemas import RouteResponse
+from app.utils.clustering import cluster_engine
+from app.utils.geocoding import ReverseGeocoder
+from app.utils.leg_cache import LegCache
+from app.utils.metrics import start_trace
+from app.utils.onemap import OneMapClient
+from benchmarks.mock_onemap import MockOneMap
+from benchmarks.scenarios import SCENARIOS
+from benchmarks.synthetic import synthetic_geojson_files
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), 'results')
+
+
+class BenchmarkApp:
+    """ The parts of app.state that generate_route reads, built from synthetic layers and a mock OneMap.
+
+    Args:
+    - geojson_files (dict): Layers in the shape of app.state.geojson_files
+    - onemap (MockOneMap): OneMap stand-in
+    - leg_cache (bool): Put an in-memory LegCache in front of the mock, as in production
+    """
+
+    def __init__(self, geojson_files: dict, onemap: MockOneMap, leg_cache: bool = False):
+        self.onemap = onemap
+        self.leg_cache = leg_cache
+        self.state = SimpleNamespace(
+            geojson_files=geojson_files,
+            layer_store=LayerStore.from_geojson(geojson_files),
+            session_store=MemorySessionStore()
+        )
+        self.reset_caches()
+
+    def reset_caches(self):
+        """ Starts from cold route, geocode and cluster caches, as for a request along a new corridor.
+        """
+        self.state.route_client = OneMapClient(transport=self.onemap.transport(), leg_cache=LegCache() if self.leg_cache else None)
+        self.state.geocoder = ReverseGeocoder(self.state.route_client)
+        cluster_engine.clear()
+
+    def request(self):
+        return SimpleNamespace(app=SimpleNamespace(state=self.state))
+
+    async def aclose(self):
+        await self.state.route_client.aclose()
+
+
+def percentiles(values: list) -> dict:
+    values = np.asarray(values, dtype=float)
+    return {
+        "mean": float(values.mean()),
+        "p50": float(np.percentile(values, 50)),
+        "p95": float(np.percentile(values, 95)),
+        "p99": float(np.percentile(values, 99)),
+        "max": float(values.max())
+    }
+
+
+def mean_of(dicts: list) -> dict:
+    keys = sorted(set().union(*dicts)) if dicts else []
+    return {key: sum(d.get(key, 0) for d in dicts) / len(dicts) for key in keys}
+
+
+async def run_scenario(bench: BenchmarkApp, user_data: dict, iterations: int, warmup: int, warm: bool) -> dict:
+    """ Runs one scenario and summarises latency, OneMap calls, pipeline events and peak memory.
+
+    Latency runs without tracemalloc, which slows allocation-heavy code considerably; peak
+    memory is taken from one extra traced run.
+    """
+    latencies, route_calls, geocode_calls, events, stages = [], [], [], [], []
+    found = 0
+    for i in range(warmup + iterations):
+        if not warm:
+            await bench.aclose()
+            bench.reset_caches()
+        bench.onemap.reset()
+        trace = start_trace()
+        start = time.perf_counter()
+        response = await generate_route(bench.request(), dict(user_data))
+        elapsed = time.perf_counter() - start
+        if i < warmup:
+            continue
+        latencies.append(elapsed * 1000)
+        route_calls.append(bench.onemap.calls['route'])
+        geocode_calls.append(bench.onemap.calls['revgeocode'])
+        events.append(dict(trace.counts))
+        stages.append({name: seconds * 1000 for name, seconds in trace.stages.items()})
+        found += isinstance(response, RouteResponse)
+
+    if not warm:
+        await bench.aclose()
+        bench.reset_caches()
+    tracemalloc.start()
+    try:
+        await generate_route(bench.request(), dict(user_data))
+        peak_memory = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "requests": iterations,
+        "routes_found": found,
+        "latency_ms": percentiles(latencies),
+        "onemap_route_calls": percentiles(route_calls),
+        "onemap_geocode_calls": percentiles(geocode_calls),
+        "events_mean": mean_of(events),
+        "stage_ms_mean": mean_of(stages),
+        "peak_memory_mb": peak_memory / 2 ** 20
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def print_results(results: dict, baseline: dict = None):
+    header = f"{'scenario':<18}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'OneMap/req':>12}{'peak MB':>10}{'found':>8}"
+    print(header)
+    print('-' * len(header))
+    for name, result in results["scenarios"].items():
+        latency = result["latency_ms"]
+        print(f"{name:<18}{latency['p50']:>10.1f}{latency['p95']:>10.1f}{latency['p99']:>10.1f}"
+              f"{result['onemap_route_calls']['mean']:>12.1f}{result['peak_memory_mb']:>10.1f}{result['routes_found']:>5}/{result['requests']}")
+        previous = (baseline or {}).get("scenarios", {}).get(name)
+        if previous is not None:
+            change = lambda key: (latency[key] / previous["latency_ms"][key] - 1) * 100
+            print(f"{'  vs baseline':<18}{change('p50'):>+9.0f}%{change('p95'):>+9.0f}%{change('p99'):>+9.0f}%"
+                  f"{result['onemap_route_calls']['mean'] - previous['onemap_route_calls']['mean']:>+12.1f}"
+                  f"{result['peak_memory_mb'] - previous['peak_memory_mb']:>+10.1f}")
+    print(f"Max RSS of the benchmark process: {results['max_rss_mb']:.0f} MB")
+
+
+async def main(args):
+    # Avoidance reselections and similar warnings are routine here and would drown the report
+    logging.basicConfig(level=args.log_level)
+    random.seed(args.seed)
+    np.random.seed(args.seed)
+    geojson_files = synthetic_geojson_files(args.pois, args.toilets, args.stairs, seed=args.seed)
+    bench = BenchmarkApp(geojson_files, MockOneMap(latency=args.latency, seed=args.seed), leg_cache=args.leg_cache)
+
+    scenarios = {name: SCENARIOS[name] for name in args.scenarios} if args.scenarios else SCENARIOS
+    results = {
+        "label": args.label,
+        "git_commit": git_commit(),
+        "created": time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        "python": platform.python_version(),
+        "config": {key: value for key, value in vars(args).items() if key not in ('label', 'compare', 'output', 'log_level')},
+        "scenarios": {}
+    }
+    try:
+        for name, user_data in scenarios.items():
+            results["scenarios"][name] = await run_scenario(bench, dict(user_data, solver=args.solver), args.iterations, args.warmup, args.warm)
+    finally:
+        await bench.aclose()
+    # ru_maxrss is in kilobytes on Linux
+    results["max_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_results(results, baseline)
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{args.label or results['git_commit'] or 'latest'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results saved to {output}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark route generation offline, against synthetic layers and a mock OneMap.")
+    parser.add_argument('--scenarios', nargs='*', choices=list(SCENARIOS), help="Scenarios to run (default: all)")
+    parser.add_argument('--iterations', type=int, default=20, help="Measured requests per scenario")
+    parser.add_argument('--warmup', type=int, default=2, help="Unmeasured requests per scenario")
+    parser.add_argument('--latency', type=float, default=0.05, help="Seconds each mock OneMap call takes")
+    parser.add_argument('--pois', type=int, default=1000, help="Features per POI layer")
+    parser.add_argument('--toilets', type=int, default=2000, help="Features in the toilet layer")
+    parser.add_argument('--stairs', type=int, default=5000, help="Features in the stairs layer")
+    parser.add_argument('--solver', default='orienteering', choices=['orienteering', 'cluster'])
+    parser.add_argument('--leg-cache', action='store_true', help="Put an in-memory leg cache in front of OneMap")
+    parser.add_argument('--warm', action='store_true', help="Keep route, geocode and cluster caches between requests")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--log-level', default='ERROR')
+    parser.add_argument('--label', help="Name of this run; results go to benchmarks/results/<label>.json")
+    parser.add_argument('--output', help="Results file, overriding the label-based path")
+    parser.add_argument('--compare', help="Earlier results file to compare against")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
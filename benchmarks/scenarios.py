@@ -0,0 +1,34 @@
+# benchmarks/scenarios.py
+
+# Long/lat of a few central locations
+RAFFLES_PLACE = [103.8514, 1.2840]
+MARINA_BAY = [103.8607, 1.2834]
+ORCHARD = [103.8320, 1.3040]
+BOTANIC_GARDENS = [103.8159, 1.3138]
+KALLANG = [103.8710, 1.3020]
+
+
+def user_data(user_location: list, end_location: list, search_radius: int = 500, max_route_length: int = 5000, num_POIs: int = 5, poi_types: list = None, amenity: bool = False, barrier_free: bool = False) -> dict:
+    """ Builds the user_data that /generate_route hands to route_service.generate_route.
+    """
+    return {
+        "user_location": user_location,
+        "end_location": end_location,
+        "search_radius": search_radius,
+        "num_POIs": num_POIs,
+        "max_route_length": max_route_length,
+        "poi_types": poi_types if poi_types is not None else ['park', 'museum', 'heritage'],
+        "amenity": amenity,
+        "barrier_free": barrier_free
+    }
+
+
+SCENARIOS = {
+    "short_walk": user_data(RAFFLES_PLACE, MARINA_BAY, search_radius=400, max_route_length=3000),
+    "long_walk": user_data(BOTANIC_GARDENS, KALLANG, search_radius=800, max_route_length=12000, num_POIs=8),
+    "barrier_free": user_data(ORCHARD, RAFFLES_PLACE, search_radius=600, max_route_length=6000, barrier_free=True),
+    "amenity": user_data(ORCHARD, KALLANG, search_radius=600, max_route_length=8000, amenity=True),
+    "start_equals_end": user_data(BOTANIC_GARDENS, BOTANIC_GARDENS, search_radius=1000, max_route_length=5000),
+    "wide_radius": user_data(ORCHARD, MARINA_BAY, search_radius=2500, max_route_length=10000),
+    "all_options": user_data(BOTANIC_GARDENS, MARINA_BAY, search_radius=1000, max_route_length=10000, amenity=True, barrier_free=True),
+}
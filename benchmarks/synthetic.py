@@ -0,0 +1,67 @@
+# benchmarks/synthetic.py
+
+import numpy as np
+
+# Rough extent of Singapore in long/lat (min_lon, min_lat, max_lon, max_lat)
+SINGAPORE_BOUNDS = (103.62, 1.24, 104.00, 1.46)
+
+# Scenario endpoints sit in the denser central area, like most real requests
+CENTRAL_BOUNDS = (103.80, 1.27, 103.90, 1.36)
+
+POI_TYPES = ['park', 'museum', 'heritage', 'monument']
+
+
+def feature_collection(n: int, feature_type: str, rng: np.random.Generator, name: str = None, bounds: tuple = SINGAPORE_BOUNDS, central_share: float = 0.5) -> dict:
+    """ Builds a GeoJSON FeatureCollection of n random points shaped like the S3 layers.
+
+    Args:
+    - n (int): Number of features
+    - feature_type (str): Value of the TYPE property
+    - rng (np.random.Generator): Random generator, so a seed reproduces the same layer
+    - name (str): Prefix of the NAME property, defaults to feature_type
+    - bounds (tuple): Extent the points are drawn from
+    - central_share (float): Share of points drawn from CENTRAL_BOUNDS instead, as real POIs cluster in the centre
+
+    Returns:
+    - feature_collection (dict): GeoJSON FeatureCollection with NAME, TYPE, DESCRIPTION and PHOTOURL properties
+    """
+    num_central = int(n * central_share)
+    lon = np.concatenate([rng.uniform(CENTRAL_BOUNDS[0], CENTRAL_BOUNDS[2], num_central), rng.uniform(bounds[0], bounds[2], n - num_central)])
+    lat = np.concatenate([rng.uniform(CENTRAL_BOUNDS[1], CENTRAL_BOUNDS[3], num_central), rng.uniform(bounds[1], bounds[3], n - num_central)])
+    name = name or feature_type
+    return {
+        "type": "FeatureCollection",
+        "features": [
+            {
+                "type": "Feature",
+                "geometry": {"type": "Point", "coordinates": [float(x), float(y)]},
+                "properties": {
+                    "NAME": f"{name} {i}",
+                    "TYPE": feature_type,
+                    "DESCRIPTION": f"<p>{name} {i} is a synthetic {feature_type}. It only exists for benchmarking.</p>",
+                    "PHOTOURL": None
+                }
+            }
+            for i, (x, y) in enumerate(zip(lon, lat))
+        ]
+    }
+
+
+def synthetic_geojson_files(num_pois: int = 1000, num_toilets: int = 2000, num_stairs: int = 5000, poi_types: list = POI_TYPES, seed: int = 0) -> dict:
+    """ Builds synthetic layers in the shape of app.state.geojson_files.
+
+    Args:
+    - num_pois (int): Features per POI layer
+    - num_toilets (int): Features in toilet.geojson
+    - num_stairs (int): Features in stairs.geojson, the barrier-free avoidance layer
+    - poi_types (list): POI layers to build, as <type>.geojson
+    - seed (int): Random seed
+
+    Returns:
+    - geojson_files (dict): File key to GeoJSON FeatureCollection
+    """
+    rng = np.random.default_rng(seed)
+    geojson_files = {f"{poi_type}.geojson": feature_collection(num_pois, poi_type, rng) for poi_type in poi_types}
+    geojson_files['toilet.geojson'] = feature_collection(num_toilets, 'Toilet', rng)
+    geojson_files['stairs.geojson'] = feature_collection(num_stairs, 'Stairs', rng)
+    return geojson_files